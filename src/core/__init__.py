@@ -20,13 +20,13 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+from utils import startup # Imported first, startup is timed from here
 from configuration import configsources
 from network import ntmanager
 import ntcore
 import logging
 from video import CameraManager
 from pipeline import PipelineManager
-from utils.misc import releaseGIL
 
 from processes import rootsrv_client as rootsrv
 import os
@@ -47,6 +47,7 @@ logger = logging.getLogger(__name__)
 if __name__ == "__main__":
 
     logger.info("Launching Spyglass")
+    startup.mark("Imports")
 
     
     inst: ntcore.NetworkTableInstance = ntcore.NetworkTableInstance.getDefault()
@@ -54,18 +55,24 @@ if __name__ == "__main__":
     inst.startClient4(os.getenv("DEV_NAME"))
     ntmanager.initialize(os.getenv("DEV_NAME"),inst)
     rootsrv.initialize(os.getenv("ROOTSRV_SOCK"))
+    startup.mark("NetworkTables")
 
     configurator = configsources.ConfigParser("config.toml")
 
     configurator.loadFieldConfig()
+    startup.mark("Configuration")
 
     CameraManager.loadCameras(configurator.getCameraConfigs())
-    PipelineManager.loadPipelines(configurator.getPipelineConfigs())
+    startup.mark("Cameras")
+    PipelineManager.loadPipelines(configurator.getPipelineConfigs(),configurator.getSchedulerConfig())
+    startup.mark("Pipelines built")
+    supervisorConfig = configurator.getSupervisorConfig()
+    PipelineManager.setStartupGrace(supervisorConfig.startupGrace)
     PipelineManager.startAll()
+    startup.mark("Pipelines started")
 
-    while True:
-        #TODO: Manage webclient/NT client here
-        releaseGIL()
+    #TODO: Manage webclient/NT client here
+    PipelineManager.supervise(supervisorConfig)
 
     
     
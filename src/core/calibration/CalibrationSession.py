@@ -3,6 +3,7 @@
 # the license found in the root directory of this project
 
 from video.CameraHandler import CameraHandler
+from video import CameraManager
 from typing import Callable, Tuple, List, Union
 from calibration.common import CalibrationModule, Seed, BoardObservation, CalibrationInput
 from calibration import loader
@@ -32,7 +33,7 @@ class CalibrationSession():
     ):
         self._resolution = resolution
         self._board = aruco.CharucoBoard(board_size,square_len,marker_len,dictionary)
-        self._input = camera.getSink()
+        self._input = CameraManager.subscribe(camera) # Shares decoded frames with any pipeline running on the same camera
         self._capture = capTrigger
         self._end = endTrigger
         self._calibrator : CalibrationModule = None
@@ -88,10 +89,13 @@ class CalibrationSession():
         logger.info("Calibration complete. Results stored at %s",os.path.join(os.getcwd(),self._path))
     
     def run(self):
-        frame: cv2.Mat = np.zeros(shape=(1,1,1),dtype=np.uint8)
         prevCap: bool = False
         while not self._end():
             cap = self._capture()
-            time, frame = self._input.grabFrame(frame)
-            self.process(frame, cap and not prevCap)
+            frame = self._input.grabFrame()
+            if frame is None:
+                continue
+            self.process(frame.image, cap and not prevCap)
+            frame.release()
+        self._input.close()
         
@@ -21,15 +21,27 @@
 # SOFTWARE.
 
 import robotpy_apriltag as apriltag
+import numpy as np
+from typing import List, Union
+from wpimath.geometry import Pose3d, Rotation3d, Transform3d, Translation3d
+from pipeline.coords import wpilibTranslationToOpenCv
+from pipeline.transforms import fromPose3d
 # A singleton class for maintaining global field configuration
 
-_tag_size: float
+_tag_size: Union[float,None] = None
 _family: str
-_layout: apriltag.AprilTagFieldLayout
+_layout: Union[apriltag.AprilTagFieldLayout,None] = None
+
+# Field geometry index, rebuilt whenever the layout or tag size changes so the solvers can assemble their inputs with plain numpy indexing
+_id_to_row: np.ndarray = np.full(0,-1,dtype=np.int32) # Tag id -> row in the arrays below, -1 for tags not on the field
+_tag_transforms: np.ndarray = np.empty((0,4,4),dtype=np.float64) # Field to tag transform of each tag, in WPILib axes
+_field_corners: np.ndarray = np.empty((0,4,3),dtype=np.float64) # Field-frame corners of each tag, in OpenCV coordinates
+_tag_corners: np.ndarray = np.empty((4,3),dtype=np.float64) # Corners of a tag in its own frame, in OpenCV coordinates
 
 def setTagSize(size: float) -> None:
     global _tag_size
     _tag_size = size
+    _rebuildIndex()
 
 def getTagSize() -> float:
     global _tag_size
@@ -48,16 +60,72 @@ def getFamily() -> str:
 def loadLayout(layoutName: str) -> None:
     global _layout
     _layout = apriltag.AprilTagFieldLayout("resources/fields/" + layoutName + ".json")
+    _rebuildIndex()
 
 def setLayout(layout: apriltag.AprilTagFieldLayout) -> None:
     #For testing only
     global _layout
     _layout = layout
+    _rebuildIndex()
 
 def getLayout() -> apriltag.AprilTagFieldLayout:
     global _layout
     return _layout
 
+def _rebuildIndex() -> None:
+    global _id_to_row, _tag_transforms, _field_corners, _tag_corners
+    if _tag_size is None:
+        return
+    half = _tag_size / 2.0
+    _tag_corners = np.array(
+        [
+            [-half, half, 0],
+            [half, half, 0],
+            [half, -half, 0],
+            [-half, -half, 0],
+        ],
+        dtype=np.float64
+    )
+    if _layout is None:
+        return
+    tags = _layout.getTags()
+    id_to_row = np.full(max((tag.ID for tag in tags),default=-1) + 1,-1,dtype=np.int32)
+    tag_transforms = np.empty((len(tags),4,4),dtype=np.float64)
+    field_corners = np.empty((len(tags),4,3),dtype=np.float64)
+    offsets = [(half,-half),(-half,-half),(-half,half),(half,half)]
+    for row, tag in enumerate(tags):
+        pose: Pose3d = _layout.getTagPose(tag.ID) # Unlike tag.pose, this accounts for the layout's origin
+        id_to_row[tag.ID] = row
+        tag_transforms[row] = fromPose3d(pose)
+        for corner, (y, z) in enumerate(offsets):
+            field_corners[row,corner] = wpilibTranslationToOpenCv((pose + Transform3d(Translation3d(0,y,z),Rotation3d())).translation())
+    _id_to_row = id_to_row
+    _tag_transforms = tag_transforms
+    _field_corners = field_corners
+
+def getTagRows(ids: np.ndarray) -> np.ndarray:
+    """
+    :return: The row of each tag id in the field geometry index, -1 for tags that are not on the field
+    """
+    rows = np.full(len(ids),-1,dtype=np.int32)
+    known = (ids >= 0) & (ids < len(_id_to_row))
+    rows[known] = _id_to_row[ids[known]]
+    return rows
 
+def getTagTransforms() -> np.ndarray:
+    """
+    :return: (num_tags,4,4) array of the field to tag transform of every tag, in WPILib axes. Index it with getTagRows.
+    """
+    return _tag_transforms
 
+def getFieldCorners() -> np.ndarray:
+    """
+    :return: (num_tags,4,3) array of the field-frame corners of every tag, in OpenCV coordinates. Index it with getTagRows.
+    """
+    return _field_corners
 
+def getTagCorners() -> np.ndarray:
+    """
+    :return: (4,3) array of the corners of a tag in its own frame, in OpenCV coordinates
+    """
+    return _tag_corners
@@ -20,7 +20,7 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import numpy as np
 import cscore
 import robotpy_apriltag as apriltag
@@ -50,6 +50,31 @@ class DeviceConfig:
     name: str #The device ID
     server_ip: str #The IP address of the networktables server
     
+@dataclass
+class SupervisorConfig:
+    """Pipeline supervisor configuration class."""
+    deadline: float #A pipeline that goes this many seconds without finishing a frame is restarted. Pipelines slower than this get a multiple of their own frame time
+    startupGrace: float #Extra time in seconds a pipeline is given to produce its first frame
+    interval: float #Time in seconds between supervisor checks
+    feedTimeout: float #A camera feed that goes this many seconds without a frame has its sink rebuilt
+    
+@dataclass
+class SchedulerConfig:
+    """Load scheduler configuration class."""
+    enabled: bool
+    cores: int #Number of cores available to pipelines
+    utilization: float #Fraction of the available cores the scheduler hands out
+    period: float #Time in seconds between scheduling decisions
+    smoothing: float #Weight of the newest sample in the moving average of processing cost
+    
+@dataclass
+class TagFilterConfig:
+    """Detection quality thresholds, detections that fail any of them are rejected before pose solving"""
+    minDecisionMargin: float = 0.0
+    maxHamming: Union[int,None] = None
+    minArea: float = 0.0 #Minimum area of the tag's quad, in pixels
+    maxSkew: Union[float,None] = None #Maximum ratio of the quad's longest side to its shortest side
+
 @dataclass
 class ApriltagConfig:
     """Apriltag-specific pipeline configuration"""
@@ -57,12 +82,31 @@ class ApriltagConfig:
     excludeTagsPNP: List[int] #Tags to reject in multitag PNP solving, they will still be used for single-tag distance estimation
     detConfigs: Union[apriltag.AprilTagDetector.Config,None]
     detQtps: Union[apriltag.AprilTagDetector.QuadThresholdParameters,None]
+    tracking: bool = False #Only search around previously detected tags between full-frame sweeps
+    sweepInterval: int = 10 #Frames between full-frame sweeps in tracking mode
+    roiPadding: float = 0.5 #Padding around tracked tags, as a fraction of the tag's size
+    tileGrid: Union[List[int],None] = None #[columns, rows] to split the frame into, each tile is detected in parallel. None detects the whole frame in one call
+    tileOverlap: int = 128 #Overlap between tiles in pixels, should be at least the size of the largest tag
+    filter: TagFilterConfig = field(default_factory=TagFilterConfig)
+    tagFilters: Dict[int,TagFilterConfig] = field(default_factory=dict) #Per-tag overrides of the filter thresholds
+    latencyBudget: Union[float,None] = None #Target detection time in milliseconds, decimation and threads are adjusted at runtime to stay under it. None keeps the configured settings
+    temporalPnP: bool = False #Keep single tag solves on the IPPE ambiguity that is consistent with the previous frame
+    temporalMaxError: float = 2.0 #Largest reprojection error in pixels of a solution promoted for its consistency with the previous frame
 
 @dataclass
 class ObjDetectConfig:
     """Object detection-specific pipeline configuration"""
     model: str
-    confidenceThreshold: float
+    confidenceThreshold: float #Detections below this confidence are dropped
+    backend: str = "ultralytics" #Inference backend, "ultralytics", or "onnxruntime" or "opencv" to run an exported ONNX model without torch
+    inputSize: int = 640 #Side length in pixels of the model input for the ONNX backends, should match the size the model was exported with
+    batchWindow: Union[float,None] = None #Milliseconds to wait for frames from other pipelines using the same model, to run them in one batch. None runs inference per pipeline
+    classes: Union[List[int],None] = None #Classes to publish, None publishes every class
+    asyncInference: bool = False #Runs the model on a background thread, and tracks the last inference's boxes on the frames in between so results are published at camera rate
+    trackIou: float = 0.3 #Lowest overlap between a detection and a tracked box for them to be the same object
+    trackTimeout: float = 500.0 #Milliseconds an object is tracked after it was last detected
+    quantization: str = "none" #"int8" or "int8-dynamic" run a quantized version of the model, for the ONNX backends. See pipeline.quantize
+    calibrationFrames: Union[str,None] = None #Directory of representative frames the "int8" quantization is calibrated on
 
 @dataclass
 class PipelineConfig:
@@ -79,4 +123,15 @@ class PipelineConfig:
     processedport: Union[int,None]
     objdetectConfig: Union[ObjDetectConfig,None]
     apriltagConfig: Union[ApriltagConfig,None]
+    multiprocess: bool = False #Runs the pipeline in its own process instead of on the worker thread
+    configFile: Union[str,None] = None #The config file this pipeline was parsed from, needed to rebuild the pipeline in a child process
+    staged: bool = False #Runs capture, processing, and publishing on separate threads
+    publishQueueDepth: int = 2 #Maximum number of results waiting to be published by a staged worker
+    parallelism: int = 1 #Number of frames processed concurrently, each on its own pipeline instance. Ignored by object detection pipelines, which track objects across frames
+    maxResultAge: int = 100 #Results older than this many milliseconds are dropped instead of published when running in parallel
+    cpus: Union[List[int],None] = None #CPU cores the pipeline's threads are pinned to, None leaves them unpinned
+    priority: int = 0 #Pipelines with a higher priority get CPU time first when the load scheduler is enabled
+    targetFps: Union[float,None] = None #Frame rate the load scheduler aims for, None uses the camera's frame rate
+    undistortStep: Union[int,None] = None #Spacing in pixels of the camera's undistortion lookup table, for strongly distorted lenses. None undistorts detections with OpenCV, which is faster for a handful of points
+    deadline: Union[float,None] = None #Seconds the pipeline may spend on one frame before the supervisor restarts it, None uses the supervisor's deadline
  
@@ -21,6 +21,7 @@
 # SOFTWARE.
 
 import tomllib
+import os
 from configuration.config_types import *
 import robotpy_apriltag as apriltag
 import logging
@@ -91,6 +92,25 @@ class ConfigParser:
         Field.setFamily(family)
         Field.loadLayout(layoutName)
     
+    def getSupervisorConfig(self) -> SupervisorConfig:
+        supdict: dict = self.config.get("supervisor",{})
+        return SupervisorConfig(
+            supdict.get("deadline",0.5),
+            supdict.get("startupGrace",5.0),
+            supdict.get("interval",0.05),
+            supdict.get("feedTimeout",2.0)
+        )
+    
+    def getSchedulerConfig(self) -> SchedulerConfig:
+        scheddict: dict = self.config.get("scheduler",{})
+        return SchedulerConfig(
+            scheddict.get("enabled",False),
+            scheddict.get("cores",os.cpu_count()),
+            scheddict.get("utilization",0.9),
+            scheddict.get("period",0.5),
+            scheddict.get("smoothing",0.2)
+        )
+    
     #TODO: Add separate stream resolution
     def getPipelineConfigs(self) -> List[PipelineConfig]:
         config_list = []
@@ -106,6 +126,16 @@ class ConfigParser:
             stream_fps: int = pipedict.get("stream_fps",30)
             rawport: int = pipedict.get("rawport",None)
             processedport: int = pipedict.get("processedport",None)
+            multiprocess: bool = pipedict.get("multiprocess",False)
+            staged: bool = pipedict.get("staged",False)
+            publishQueueDepth: int = pipedict.get("publishQueueDepth",2)
+            parallelism: int = pipedict.get("parallelism",1)
+            maxResultAge: int = pipedict.get("maxResultAge",100)
+            cpus: List[int] = pipedict.get("cpus",None)
+            priority: int = pipedict.get("priority",0)
+            targetFps: float = pipedict.get("targetFps",None)
+            undistortStep: Union[int,None] = pipedict.get("undistortStep",None) or None # Opt-in, 0 also turns the lookup table off
+            deadline: Union[float,None] = pipedict.get("deadline",None)
             if stream and (rawport is None):
                 logger.warning("Streaming enabled on pipeline %s, but no raw video port detected. Raw stream will be disabled",pipeline_name)
             if stream and (processedport is None):
@@ -127,6 +157,23 @@ class ConfigParser:
                     qtps.maxNumMaxima = pipedict.get("maxNumMaxima",10)
                     qtps.minClusterPixels = pipedict.get("minClusterPixels",300)
                     qtps.minWhiteBlackDiff = pipedict.get("minWhiteBlackDiff",5)
+                    filterDict = {
+                        "minDecisionMargin": pipedict.get("minDecisionMargin",0.0),
+                        "maxHamming": pipedict.get("maxHamming",None),
+                        "minArea": pipedict.get("minTagArea",0.0),
+                        "maxSkew": pipedict.get("maxTagSkew",None)
+                    }
+                    tagFilters: Dict[int,TagFilterConfig] = {} # Per-tag overrides only need to list the thresholds they change
+                    for tag, overrideDict in pipedict.get("tagFilters",{}).items():
+                        tagFilters[int(tag)] = TagFilterConfig(**{
+                            **filterDict,
+                            **{key: value for key, value in {
+                                "minDecisionMargin": overrideDict.get("minDecisionMargin"),
+                                "maxHamming": overrideDict.get("maxHamming"),
+                                "minArea": overrideDict.get("minTagArea"),
+                                "maxSkew": overrideDict.get("maxTagSkew")
+                            }.items() if value is not None}
+                        })
                     config = PipelineConfig(
                         pipeline_name,
                         "apriltag",
@@ -143,16 +190,37 @@ class ConfigParser:
                             pipedict.get("excludeTags",[]),
                             pipedict.get("excludeTagsPNP",[]),
                             atconf,
-                            qtps
-                        )
+                            qtps,
+                            pipedict.get("tracking",False),
+                            pipedict.get("sweepInterval",10),
+                            pipedict.get("roiPadding",0.5),
+                            pipedict.get("tileGrid",None),
+                            pipedict.get("tileOverlap",128),
+                            TagFilterConfig(**filterDict),
+                            tagFilters,
+                            pipedict.get("latencyBudget",None),
+                            pipedict.get("temporalPnP",False),
+                            pipedict.get("temporalMaxError",2.0)
+                        ),
+                        multiprocess=multiprocess,
+                        configFile=self.config_file,
+                        staged=staged,
+                        publishQueueDepth=publishQueueDepth,
+                        parallelism=parallelism,
+                        maxResultAge=maxResultAge,
+                        cpus=cpus,
+                        priority=priority,
+                        targetFps=targetFps,
+                        undistortStep=undistortStep,
+                        deadline=deadline
                     )
                     config_list.append(config)
                 case "objdetect":
                     config = PipelineConfig(
                         pipeline_name,
-                        "apriltag",
+                        "objdetect",
                         camera,
-                        True,
+                        pipedict.get("grayscale",False),
                         stream,
                         stream_xres,
                         stream_yres,
@@ -161,11 +229,31 @@ class ConfigParser:
                         processedport,
                         ObjDetectConfig(
                             pipedict.get("model"),
-                            pipedict.get("confidenceThreshold") #Doesn't do anything at the moment
+                            pipedict.get("confidenceThreshold",0.25),
+                            pipedict.get("backend","ultralytics"),
+                            pipedict.get("inputSize",640),
+                            pipedict.get("batchWindow",None),
+                            pipedict.get("classes",None),
+                            pipedict.get("asyncInference",False),
+                            pipedict.get("trackIou",0.3),
+                            pipedict.get("trackTimeout",500.0),
+                            pipedict.get("quantization","none"),
+                            pipedict.get("calibrationFrames",None)
                         ),
-                        None
+                        None,
+                        multiprocess=multiprocess,
+                        configFile=self.config_file,
+                        staged=staged,
+                        publishQueueDepth=publishQueueDepth,
+                        parallelism=parallelism,
+                        maxResultAge=maxResultAge,
+                        cpus=cpus,
+                        priority=priority,
+                        targetFps=targetFps,
+                        undistortStep=undistortStep,
+                        deadline=deadline
                     )
-                    continue
+                    config_list.append(config)
                 case None:
                     logger.error("No pipeline type detected for pipeline %s",pipeline_name)
                     continue
@@ -173,7 +261,13 @@ class ConfigParser:
                     logger.error("'%s' is not recognized as a valid pipeline type for %s",type,pipeline_name)
                     continue
         return config_list
-
+    
+    def getPipelineConfig(self, name: str) -> Union[PipelineConfig,None]:
+        for config in self.getPipelineConfigs():
+            if config.name == name:
+                return config
+        logger.error("No pipeline named %s is configured",name)
+        return None
 
     
     def dump(self):
@@ -21,8 +21,10 @@
 # SOFTWARE.
 
 import ntcore
-from typing import List, Union
+from typing import List, Union, Sequence
 from utils.vtypes import *
+from pipeline import transforms
+import numpy as np
 import logging
 logger = logging.getLogger(__name__)
 inst: ntcore.NetworkTableInstance
@@ -45,84 +47,154 @@ class NTManager():
             ntcore.PubSubOptions(periodic=0.01, sendAll=True, keepDuplicates=True)
         )
         self._fps_pub: ntcore.IntegerPublisher = self._table.getIntegerTopic("fps").publish()
+        self._capture_drops_pub: Union[ntcore.IntegerPublisher,None] = None # Stage statistics are only published by staged workers
+        self._publish_drops_pub: Union[ntcore.IntegerPublisher,None] = None
+        self._publish_depth_pub: Union[ntcore.IntegerPublisher,None] = None
+        self._sched_allowed_pub: Union[ntcore.DoublePublisher,None] = None # Scheduler state is only published when the load scheduler is enabled
+        self._sched_achieved_pub: Union[ntcore.DoublePublisher,None] = None
+        self._sched_cost_pub: Union[ntcore.DoublePublisher,None] = None
+        self._sched_skipped_pub: Union[ntcore.IntegerPublisher,None] = None
+        self._det_decimate_pub: Union[ntcore.DoublePublisher,None] = None # Detector settings are only published by pipelines with a latency budget
+        self._det_sigma_pub: Union[ntcore.DoublePublisher,None] = None
+        self._det_threads_pub: Union[ntcore.IntegerPublisher,None] = None
+        self._rejection_pubs: Union[List[ntcore.IntegerPublisher],None] = None # Rejection counters are only published by apriltag pipelines
     
     def publishApriltagResult(
             self,
             timestamp: int, #microseconds since FPGA epoch
             result: ApriltagResult
         ) -> None:
-        result_data: List[float] = [0,0] #1st element indicates the number of results, 2nd element indicates number of apriltag detections
-        if result.poseResult != None:
-            result_data[0] = 1
-            result_data.append(result.poseResult.field_pose_0.translation().X())
-            result_data.append(result.poseResult.field_pose_0.translation().Y())
-            result_data.append(result.poseResult.field_pose_0.translation().Z())
-            result_data.append(result.poseResult.field_pose_0.rotation().getQuaternion().W())
-            result_data.append(result.poseResult.field_pose_0.rotation().getQuaternion().X())
-            result_data.append(result.poseResult.field_pose_0.rotation().getQuaternion().Y())
-            result_data.append(result.poseResult.field_pose_0.rotation().getQuaternion().Z())
-            if (result.poseResult.field_pose_1 != None):
-                result_data[0] = 2
-                result_data.append(result.poseResult.field_pose_1.translation().X())
-                result_data.append(result.poseResult.field_pose_1.translation().Y())
-                result_data.append(result.poseResult.field_pose_1.translation().Z())
-                result_data.append(result.poseResult.field_pose_1.rotation().getQuaternion().W())
-                result_data.append(result.poseResult.field_pose_1.rotation().getQuaternion().X())
-                result_data.append(result.poseResult.field_pose_1.rotation().getQuaternion().Y())
-                result_data.append(result.poseResult.field_pose_1.rotation().getQuaternion().Z())
-        for fiducial in result.fiducials:
-            result_data[1] = result_data[1] + 1
-            result_data.append(fiducial.id)
-            for corner in fiducial.corners.ravel(): # corners are stored as a 2d array, numpy's ravel method flattens them into a 1d array for networktables
-                result_data.append(corner)
-            result_data.append(fiducial.decisionMargin)
-            result_data.append(fiducial.hammingDist)
-            result_data.append(fiducial.distance)
-            result_data.append(fiducial.tag_pose_0.translation().X())
-            result_data.append(fiducial.tag_pose_0.translation().Y())
-            result_data.append(fiducial.tag_pose_0.translation().Z())
-            result_data.append(fiducial.tag_pose_0.rotation().getQuaternion().W())
-            result_data.append(fiducial.tag_pose_0.rotation().getQuaternion().X())
-            result_data.append(fiducial.tag_pose_0.rotation().getQuaternion().Y())
-            result_data.append(fiducial.tag_pose_0.rotation().getQuaternion().Z())
-            result_data.append(fiducial.tag_pose_1.translation().X())
-            result_data.append(fiducial.tag_pose_1.translation().Y())
-            result_data.append(fiducial.tag_pose_1.translation().Z())
-            result_data.append(fiducial.tag_pose_1.rotation().getQuaternion().W())
-            result_data.append(fiducial.tag_pose_1.rotation().getQuaternion().X())
-            result_data.append(fiducial.tag_pose_1.rotation().getQuaternion().Y())
-            result_data.append(fiducial.tag_pose_1.rotation().getQuaternion().Z())
-        self._apriltag_results_pub.set(result_data,timestamp)
+        self.publishApriltagData(timestamp,serializeApriltagResult(result))
+    
+    def publishApriltagData(
+            self,
+            timestamp: int, #microseconds since FPGA epoch
+            data: Sequence[float]
+        ) -> None:
+        """
+        Publish apriltag results that have already been serialized with serializeApriltagResult
+        """
+        self._apriltag_results_pub.set(data,timestamp)
     
     def publishObjDetectResults(
             self,
             timestamp: int, #microseconds since FPGA epoch
             results: List[ObjDetectResult]
         ) -> None:
-        result_data: List[float] = [0] #1st element indicates the number of results
-        for res in results:
-            result_data[0] = result_data[0] + 1
-            result_data.append(res.obj_class)
-            result_data.append(res.confidence)
-            result_data.append(res.percent_area)
-            for corner_angle in res.corner_angles.ravel():
-                result_data.append(corner_angle)
-            for corner_pixel in res.corner_pixels.ravel():
-                result_data.append(corner_pixel)
-        self._objdetect_results_pub.set(result_data,timestamp)
+        self.publishObjDetectData(timestamp,serializeObjDetectResults(results))
+    
+    def publishObjDetectData(
+            self,
+            timestamp: int, #microseconds since FPGA epoch
+            data: Sequence[float]
+        ) -> None:
+        """
+        Publish object detection results that have already been serialized with serializeObjDetectResults
+        """
+        self._objdetect_results_pub.set(data,timestamp)
     
     def publishResult(
         self,
         timestamp: int,
-        result: PipelineResult
+        result: Union[PipelineResult,SerializedPipelineResult]
     ):
+        if isinstance(result,SerializedPipelineResult):
+            self.publishSerializedResult(timestamp,result)
+            return
         if result.apriltagResult is not None:
             self.publishApriltagResult(timestamp,result.apriltagResult)
         if result.objDetectResults is not None:
             self.publishObjDetectResults(timestamp,result.objDetectResults)
     
+    def publishSerializedResult(
+        self,
+        timestamp: int,
+        result: SerializedPipelineResult
+    ):
+        if result.apriltagData is not None:
+            self.publishApriltagData(timestamp,result.apriltagData)
+        if result.objDetectData is not None:
+            self.publishObjDetectData(timestamp,result.objDetectData)
+    
     def publishFPS(self, fps: int, timestamp: int) -> None:
         self._fps_pub.set(fps,timestamp)
+    
+    def publishStageStats(self, captureDrops: int, publishDrops: int, publishDepth: int, timestamp: int) -> None:
+        if self._capture_drops_pub is None:
+            self._capture_drops_pub = self._table.getIntegerTopic("capture_drops").publish()
+            self._publish_drops_pub = self._table.getIntegerTopic("publish_drops").publish()
+            self._publish_depth_pub = self._table.getIntegerTopic("publish_queue_depth").publish()
+        self._capture_drops_pub.set(captureDrops,timestamp)
+        self._publish_drops_pub.set(publishDrops,timestamp)
+        self._publish_depth_pub.set(publishDepth,timestamp)
+    
+    def publishSchedulerState(self, allowedFps: float, achievedFps: float, cost: float, skipped: int, timestamp: int) -> None:
+        if self._sched_allowed_pub is None:
+            self._sched_allowed_pub = self._table.getDoubleTopic("sched_allowed_fps").publish()
+            self._sched_achieved_pub = self._table.getDoubleTopic("sched_achieved_fps").publish()
+            self._sched_cost_pub = self._table.getDoubleTopic("sched_cost_ms").publish()
+            self._sched_skipped_pub = self._table.getIntegerTopic("sched_skipped").publish()
+        self._sched_allowed_pub.set(allowedFps,timestamp)
+        self._sched_achieved_pub.set(achievedFps,timestamp)
+        self._sched_cost_pub.set(cost,timestamp)
+        self._sched_skipped_pub.set(skipped,timestamp)
+
+    def publishDetectorSettings(self, decimate: float, sigma: float, threads: int, timestamp: int) -> None:
+        if self._det_decimate_pub is None:
+            self._det_decimate_pub = self._table.getDoubleTopic("det_quad_decimate").publish()
+            self._det_sigma_pub = self._table.getDoubleTopic("det_quad_sigma").publish()
+            self._det_threads_pub = self._table.getIntegerTopic("det_num_threads").publish()
+        self._det_decimate_pub.set(decimate,timestamp)
+        self._det_sigma_pub.set(sigma,timestamp)
+        self._det_threads_pub.set(threads,timestamp)
+
+    def publishRejections(self, rejections: Sequence[int], timestamp: int) -> None:
+        """
+        :param rejections: Number of rejected detections for each reason in REJECTION_REASONS
+        """
+        if self._rejection_pubs is None:
+            self._rejection_pubs = [self._table.getIntegerTopic(f"rejected_{reason}").publish() for reason in REJECTION_REASONS]
+        for pub, count in zip(self._rejection_pubs,rejections):
+            pub.set(count,timestamp)
+
+def serializeApriltagResult(result: ApriltagResult) -> List[float]:
+    """
+    Flattens an apriltag result into the array layout published on the apriltag_results topic
+    """
+    fieldPoses = []
+    if result.poseResult != None:
+        fieldPoses.append(result.poseResult.field_pose_0)
+        if (result.poseResult.field_pose_1 is not None):
+            fieldPoses.append(result.poseResult.field_pose_1)
+    fiducials = result.fiducials
+    result_data: List[float] = [len(fieldPoses),len(fiducials)] #1st element indicates the number of results, 2nd element indicates number of apriltag detections
+    if len(fieldPoses) == 0 and len(fiducials) == 0:
+        return result_data
+    # Every pose in the result is converted in one batch, as x, y, z, qw, qx, qy, qz
+    poses = transforms.toTranslationQuaternions(np.array(fieldPoses + [pose for fiducial in fiducials for pose in (fiducial.tag_pose_0,fiducial.tag_pose_1)]))
+    result_data.extend(poses[:len(fieldPoses)].ravel().tolist())
+    if len(fiducials) > 0:
+        # One row per fiducial: id, corners, decision margin, hamming distance, distance, then both tag poses
+        rows = np.concatenate((
+            np.array([[fiducial.id,*fiducial.corners.ravel(),fiducial.decisionMargin,fiducial.hammingDist,fiducial.distance] for fiducial in fiducials],dtype=np.float64),
+            poses[len(fieldPoses):].reshape((len(fiducials),14))
+        ),axis=1)
+        result_data.extend(rows.ravel().tolist())
+    return result_data
+
+def serializeObjDetectResults(results: List[ObjDetectResult]) -> List[float]:
+    """
+    Flattens a list of object detection results into the array layout published on the objdetect_results topic.
+    Each result is its class, confidence, area, 8 corner angles, 8 corner pixels, track ID, and whether it was interpolated
+    """
+    result_data: List[float] = [len(results)] #1st element indicates the number of results
+    for res in results:
+        # Corners are converted with tolist() rather than appended one numpy scalar at a time
+        result_data += (res.obj_class,res.confidence,res.percent_area)
+        result_data += res.corner_angles.ravel().tolist()
+        result_data += res.corner_pixels.ravel().tolist()
+        result_data += (res.track_id,1.0 if res.interpolated else 0.0)
+    return result_data
 
 def getGlobalTable() -> ntcore.NetworkTable:
     """
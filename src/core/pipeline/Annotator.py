@@ -21,7 +21,7 @@
 # SOFTWARE.
 
 import cv2
-from utils.vtypes import Fiducial, SingleTagPoseResult, ObjDetectResult
+from utils.vtypes import FiducialBatch, SingleTagPoseResult, ObjDetectResult
 from typing import List, Union
 from configuration.config_types import *
 from configuration import Field
@@ -52,30 +52,30 @@ class Annotator:
                 Field.getTagSize()/2
             )
     
-    def drawFiducials(self, image: cv2.Mat,fiducials: List[Fiducial]):
-        for f in fiducials:
-            color = (0,0,255) if f.id in self._filterTags else (0,255,0) #Draws Multitag rejected tags in red, not green
-            bottom_left = tuple(f.corners[0].astype(int))
-            bottom_right = tuple(f.corners[1].astype(int))
-            top_right = tuple(f.corners[2].astype(int))
-            top_left = tuple(f.corners[3].astype(int))
-            cv2.line(image, bottom_left, bottom_right, color, 2)
-            cv2.line(image, bottom_right, top_right, color, 2)
-            cv2.line(image, top_right, top_left, color, 2)
-            cv2.line(image, top_left, bottom_left, color, 2)
-            cv2.putText(image, str(f.id), (top_left[0],top_left[1]-15), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 0), 2)
+    def drawFiducials(self, image: cv2.Mat,fiducials: FiducialBatch):
+        if len(fiducials) == 0:
+            return
+        outlines = fiducials.corners.astype(np.int32)
+        rejected = np.isin(fiducials.ids,self._filterTags)
+        cv2.polylines(image, list(outlines[~rejected]), True, (0,255,0), 2)
+        cv2.polylines(image, list(outlines[rejected]), True, (0,0,255), 2) #Draws Multitag rejected tags in red, not green
+        for id, top_left in zip(fiducials.ids.tolist(),outlines[:,3].tolist()):
+            cv2.putText(image, str(id), (top_left[0],top_left[1]-15), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 0), 2)
     
     def drawObjDetectResults(self,image: cv2.Mat, results: List[ObjDetectResult],class_names: Union[Dict[int,str],None] = None) -> None:
         for result in results:
+            color = (0, 255, 255) if result.interpolated else (0, 0, 255) # Boxes propagated by the tracker are drawn in yellow
             bottom_left = tuple(result.corner_pixels[0].astype(int))
             bottom_right = tuple(result.corner_pixels[1].astype(int))
             top_right = tuple(result.corner_pixels[2].astype(int))
             top_left = tuple(result.corner_pixels[3].astype(int))
-            cv2.line(image, bottom_left, bottom_right, (0, 0, 255), 2)
-            cv2.line(image, bottom_right, top_right, (0, 0, 255), 2)
-            cv2.line(image, top_right, top_left, (0, 0, 255), 2)
-            cv2.line(image, top_left, bottom_left, (0, 0, 255), 2)
+            cv2.line(image, bottom_left, bottom_right, color, 2)
+            cv2.line(image, bottom_right, top_right, color, 2)
+            cv2.line(image, top_right, top_left, color, 2)
+            cv2.line(image, top_left, bottom_left, color, 2)
             labelText = f"{class_names.get(result.obj_class,f"Object Class {result.obj_class}") if class_names is not None else "Object Class " + str(result.obj_class)} ({result.confidence:.3f})"
+            if result.track_id >= 0:
+                labelText += f" #{result.track_id}"
             cv2.putText(
                 image, 
                 labelText, 
@@ -23,53 +23,156 @@
 import robotpy_apriltag as apriltag
 import numpy as np
 import cv2
-from typing import List
-from utils.vtypes import Fiducial
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple, Union
+from utils.vtypes import FiducialBatch
+from pipeline.FiducialFilter import FiducialFilter
 
-def _toFiducial(detection: apriltag._apriltag.AprilTagDetection) -> Fiducial:
+_CORNERS_BUF = (0.0,) * 8
+
+def _toFiducialBatch(detections: List[apriltag.AprilTagDetection], xoffset: int = 0, yoffset: int = 0) -> FiducialBatch:
     """
-    Convert an AprilTag detection to a Fiducial object.
-    :param detection: The AprilTag detection to convert.
-    :return: The converted Fiducial object.
+    Convert AprilTag detections to a FiducialBatch, in a single pass.
+    :param detections: The AprilTag detections to convert.
+    :param xoffset: Horizontal offset of the image the tags were detected in, relative to the full frame
+    :param yoffset: Vertical offset of the image the tags were detected in, relative to the full frame
+    :return: The converted detections.
     """
-    #TODO: Maybe shift corner position in array for OpenCV? IDK
-    corners: List[float] = []
-    for i in range(4):
-        cornerPoint: apriltag._apriltag.AprilTagDetection.Point = detection.getCorner(i)
-        corners += [cornerPoint.x, cornerPoint.y]
-
-    return Fiducial(
-        detection.getId(),
-        np.array(corners, dtype=np.float64).reshape((4, 2)),
-        detection.getDecisionMargin(),
-        detection.getHamming()
-    )
+    count = len(detections)
+    ids = np.empty(count,dtype=np.int32)
+    corners = np.empty((count,8),dtype=np.float64)
+    margins = np.empty(count,dtype=np.float64)
+    hamming = np.empty(count,dtype=np.int32)
+    for i, detection in enumerate(detections):
+        ids[i] = detection.getId()
+        corners[i] = detection.getCorners(_CORNERS_BUF)
+        margins[i] = detection.getDecisionMargin()
+        hamming[i] = detection.getHamming()
+    corners = corners.reshape((count,4,2))
+    if xoffset != 0 or yoffset != 0:
+        corners += (xoffset,yoffset)
+    return FiducialBatch(ids,corners,margins,hamming)
+
+def _mergeRois(rois: List[List[int]]) -> List[List[int]]:
+    """
+    Merges overlapping regions of interest, so that no tag is detected twice
+    :param rois: Regions as [x0, y0, x1, y1]
+    """
+    merged: List[List[int]] = []
+    for roi in rois:
+        roi = roi.copy()
+        overlapping = True
+        while overlapping:
+            overlapping = False
+            for other in merged:
+                if roi[0] < other[2] and other[0] < roi[2] and roi[1] < other[3] and other[1] < roi[3]:
+                    merged.remove(other)
+                    roi = [min(roi[0],other[0]),min(roi[1],other[1]),max(roi[2],other[2]),max(roi[3],other[3])]
+                    overlapping = True
+                    break
+        merged.append(roi)
+    return merged
 
 class ApriltagDetector:
     """
     A class that encapsulates an apriltag detector.
+    In tracking mode, tags found in the previous frame are searched for only in padded regions around their last position,
+    with a full-frame sweep every few frames (or whenever a tracked tag is lost) to pick up new tags.
     """
     def __init__(self):
         self._detector: apriltag.AprilTagDetector = apriltag.AprilTagDetector()
         self._ignorelist: List[int] = []
+        self._filterStage: FiducialFilter = FiducialFilter()
+        self._tracking: bool = False
+        self._sweepInterval: int = 10
+        self._roiPadding: float = 0.5
+        self._tracked: FiducialBatch = FiducialBatch.empty()
+        self._framesSinceSweep: int = 0
     
-    def detect(self, image: cv2.Mat) -> List[Fiducial]:
+    def detect(self, image: cv2.Mat) -> FiducialBatch:
         """
         Detect AprilTags in a grayscale image.
         :param image: A grayscale image to detect AprilTags in.
         :return: A list of detected AprilTags.
         """
+        if not self._tracking:
+            return self._detectFull(image)
+        self._framesSinceSweep += 1
+        if len(self._tracked) == 0 or self._framesSinceSweep >= self._sweepInterval:
+            return self._sweep(image)
+        rois = self._detectRois(image)
+        if rois is None or len(rois[0]) < len(self._tracked):
+            # Lost a tag (or the regions cover most of the frame anyway), look everywhere. The sweep's rejections are counted instead of the regions'
+            return self._sweep(image)
+        fiducials, rejections = rois
+        self._filterStage.record(rejections)
+        self._tracked = fiducials
+        return fiducials
+
+    def _detectFull(self, image: cv2.Mat) -> FiducialBatch:
         rawdetections: List[apriltag.AprilTagDetection] = self._detector.detect(image)
-        return [_toFiducial(detection) for detection in rawdetections if self._filter(detection)]
+        return self._filter(_toFiducialBatch(rawdetections))
+
+    def _sweep(self, image: cv2.Mat) -> FiducialBatch:
+        fiducials = self._detectFull(image)
+        self._tracked = fiducials
+        self._framesSinceSweep = 0
+        return fiducials
+
+    def _detectRois(self, image: cv2.Mat) -> Union[Tuple[FiducialBatch,np.ndarray],None]:
+        """
+        Detects tags only in padded regions around the tracked tags
+        :return: The detected tags that pass the filter in full-frame coordinates, and the filter's uncounted rejections (see FiducialFilter.evaluate),
+            or None if the regions are too large to be worth cropping
+        """
+        height, width = image.shape[:2]
+        mins = self._tracked.corners.min(axis=1)
+        maxes = self._tracked.corners.max(axis=1)
+        pads = self._roiPadding * (maxes - mins).max(axis=1,keepdims=True)
+        lower = np.maximum(mins - pads,0).astype(int)
+        upper = np.minimum(np.ceil(maxes + pads),(width,height)).astype(int)
+        rois = _mergeRois(np.hstack((lower,upper)).tolist())
+        if sum((roi[2] - roi[0]) * (roi[3] - roi[1]) for roi in rois) > 0.5 * width * height:
+            return None
+        batches: List[FiducialBatch] = []
+        for x0, y0, x1, y1 in rois:
+            crop = np.ascontiguousarray(image[y0:y1,x0:x1])
+            rawdetections: List[apriltag.AprilTagDetection] = self._detector.detect(crop)
+            batches.append(_toFiducialBatch(rawdetections,x0,y0))
+        return self._filterStage.evaluate(FiducialBatch.concatenate(batches))
+
+    def setTracking(self, enabled: bool, sweepInterval: int = 10, roiPadding: float = 0.5) -> None:
+        """
+        Enables or disables region of interest tracking.
+        :param sweepInterval: Number of frames between full-frame sweeps for new tags
+        :param roiPadding: Padding added around each tracked tag, as a fraction of the tag's size in pixels. Should cover how far a tag can move between frames.
+        """
+        self._tracking = enabled
+        self._sweepInterval = max(sweepInterval,1)
+        self._roiPadding = roiPadding
+        self._tracked = FiducialBatch.empty()
+        self._framesSinceSweep = 0
     
-    def _filter(self, detection: apriltag.AprilTagDetection) -> bool:
+    def _filter(self, fiducials: FiducialBatch) -> FiducialBatch:
         """
         Filter function for detecting AprilTags.
-        :param detection: The AprilTag detection to filter.
-        :return: True if the detection passes the filter, False otherwise.
+        :param fiducials: The AprilTag detections to filter.
+        :return: The detections that pass the filter.
+        """
+        return self._filterStage.filter(fiducials)
+
+    def setFilter(self, filterStage: FiducialFilter) -> None:
+        """
+        Replaces the detection quality filter. The rejectlist carries over to the new filter.
         """
-        #TODO: Implement filtering logic
-        return not (detection.getId() in self._ignorelist)
+        filterStage.setExcluded(self._ignorelist)
+        self._filterStage = filterStage
+
+    def getRejections(self) -> Tuple[int,...]:
+        """
+        :return: Number of detections rejected by the filter for each reason in vtypes.REJECTION_REASONS
+        """
+        return self._filterStage.getRejections()
     
     def addFamily(self, family: str) -> None:
         """
@@ -121,6 +224,89 @@ class ApriltagDetector:
     
     def setRejectlist(self,tags: List[int]) -> None:
         self._ignorelist = tags
+        self._filterStage.setExcluded(tags)
     
     def getRejectlist(self) -> List[int]:
-        return self._ignorelist.copy()
\ No newline at end of file
+        return self._ignorelist.copy()
+
+
+def _dedupe(fiducials: FiducialBatch) -> FiducialBatch:
+    """
+    Removes tags detected more than once (e.g. in overlapping tiles), keeping the detection with the highest decision margin
+    """
+    if len(fiducials) < 2 or len(np.unique(fiducials.ids)) == len(fiducials):
+        return fiducials
+    centers = fiducials.corners.mean(axis=1)
+    sizes = np.linalg.norm(fiducials.corners[:,0] - fiducials.corners[:,2],axis=1)
+    keep: List[int] = []
+    for i in np.argsort(-fiducials.decisionMargins).tolist():
+        duplicate = any(
+            fiducials.ids[j] == fiducials.ids[i] and np.linalg.norm(centers[j] - centers[i]) < 0.5 * sizes[i]
+            for j in keep
+        )
+        if not duplicate:
+            keep.append(i)
+    return fiducials.select(np.sort(keep))
+
+class TiledApriltagDetector(ApriltagDetector):
+    """
+    An apriltag detector that splits the frame into overlapping tiles and detects each tile on its own detector instance, in parallel.
+    The overlap should be at least as large as the largest tag in pixels, so that every tag lies entirely within some tile.
+    """
+    def __init__(self, columns: int, rows: int, overlap: int):
+        super().__init__()
+        self._columns = max(columns,1)
+        self._rows = max(rows,1)
+        self._overlap = overlap
+        self._tileDetectors: List[apriltag.AprilTagDetector] = [self._detector] + [
+            apriltag.AprilTagDetector() for _ in range(self._columns * self._rows - 1)
+        ]
+        self._executor = ThreadPoolExecutor(max_workers=len(self._tileDetectors),thread_name_prefix="apriltag_tile")
+        self._tiles: List[Tuple[int,int,int,int]] = []
+        self._tiledShape: Tuple[int,...] = ()
+
+    def _layoutTiles(self, shape: Tuple[int,...]) -> None:
+        height, width = shape[:2]
+        xedges = np.linspace(0,width,self._columns + 1).astype(int)
+        yedges = np.linspace(0,height,self._rows + 1).astype(int)
+        half = self._overlap // 2
+        self._tiles = [
+            (max(xedges[col] - half,0),max(yedges[row] - half,0),min(xedges[col+1] + half,width),min(yedges[row+1] + half,height))
+            for row in range(self._rows) for col in range(self._columns)
+        ]
+        self._tiledShape = shape
+
+    def _detectTile(self, detector: apriltag.AprilTagDetector, image: cv2.Mat, tile: Tuple[int,int,int,int]) -> FiducialBatch:
+        x0, y0, x1, y1 = tile
+        rawdetections: List[apriltag.AprilTagDetection] = detector.detect(np.ascontiguousarray(image[y0:y1,x0:x1]))
+        return _toFiducialBatch(rawdetections,x0,y0)
+
+    def _detectFull(self, image: cv2.Mat) -> FiducialBatch:
+        if image.shape != self._tiledShape:
+            self._layoutTiles(image.shape)
+        # The native detect call releases the GIL, so the tiles are detected in parallel
+        futures = [
+            self._executor.submit(self._detectTile,detector,image,tile)
+            for detector, tile in zip(self._tileDetectors,self._tiles)
+        ]
+        return self._filter(_dedupe(FiducialBatch.concatenate([future.result() for future in futures])))
+
+    def addFamily(self, family: str) -> None:
+        for detector in self._tileDetectors:
+            detector.addFamily(family)
+
+    def removeFamily(self, family: str) -> None:
+        for detector in self._tileDetectors:
+            detector.removeFamily(family)
+
+    def clearFamilies(self) -> None:
+        for detector in self._tileDetectors:
+            detector.clearFamilies()
+
+    def setConfig(self, config: apriltag.AprilTagDetector.Config) -> None:
+        for detector in self._tileDetectors:
+            detector.setConfig(config)
+
+    def setQuadThresholdParameters(self, params: apriltag.AprilTagDetector.QuadThresholdParameters) -> None:
+        for detector in self._tileDetectors:
+            detector.setQuadThresholdParameters(params)
@@ -0,0 +1,109 @@
+# Copyright (c) FRC 1076 PiHi Samurai
+# You may use, distribute, and modify this software under the terms of
+# the license found in the root directory of this project
+
+import logging
+import numpy as np
+from typing import List, Tuple
+from utils.vtypes import FiducialBatch
+from pipeline.ApriltagDetector import ApriltagDetector
+
+logger = logging.getLogger(__name__)
+
+# Detector settings from most to least accurate, as (quadDecimate, quadSigma).
+# A little blur helps quad detection on noisy full resolution images, decimated images are already smoothed.
+_LEVELS: List[Tuple[float,float]] = [
+    (1.0,0.8),
+    (1.5,0.4),
+    (2.0,0.0),
+    (3.0,0.0),
+    (4.0,0.0)
+]
+
+class DetectorController:
+    """
+    Adjusts an apriltag detector's decimation, blur, and thread count at runtime to keep detection latency under a budget.
+    Settings are coarsened when latency goes over budget, and refined when latency is well under budget,
+    or when the detected tags are getting too small for the current decimation.
+    Changes are spaced out by a cooldown and separated by a dead band, so the controller does not oscillate.
+    """
+    def __init__(
+        self,
+        detector: ApriltagDetector,
+        budget: float,
+        maxThreads: int,
+        minTagSize: float = 24.0,
+        cooldown: int = 15,
+        smoothing: float = 0.2
+    ):
+        """
+        :param budget: Target detection time, in milliseconds
+        :param maxThreads: Maximum number of detector threads
+        :param minTagSize: Smallest tag side length, in decimated pixels, that is still reliably detected
+        :param cooldown: Minimum number of frames between changes
+        """
+        self._detector = detector
+        self._budget = budget * 1e6
+        self._maxThreads = max(maxThreads,1)
+        self._minTagSize = minTagSize
+        self._cooldown = cooldown
+        self._smoothing = smoothing
+        config = detector.getConfig()
+        self._level = min(range(len(_LEVELS)),key=lambda level: abs(_LEVELS[level][0] - config.quadDecimate))
+        self._threads = min(max(config.numThreads,1),self._maxThreads)
+        self._latency: float = 0.0 # Moving average of detection time, in nanoseconds
+        self._framesSinceChange: int = 0
+        self._apply()
+
+    def _apply(self) -> None:
+        config = self._detector.getConfig()
+        config.quadDecimate, config.quadSigma = _LEVELS[self._level]
+        config.numThreads = self._threads
+        self._detector.setConfig(config)
+        self._framesSinceChange = 0
+        logger.debug("Detector settings: decimate %.1f, sigma %.1f, %d threads",*self.getSettings())
+
+    def update(self, latency: int, fiducials: FiducialBatch) -> None:
+        """
+        :param latency: Time taken by the last detection, in nanoseconds
+        :param fiducials: Tags found by the last detection
+        """
+        self._latency = latency if self._latency == 0.0 else self._latency + self._smoothing * (latency - self._latency)
+        self._framesSinceChange += 1
+        if self._framesSinceChange < self._cooldown:
+            return
+
+        decimate = _LEVELS[self._level][0]
+        tagsTooSmall = len(fiducials) > 0 and _tagSizes(fiducials).min() / decimate < self._minTagSize
+
+        if self._latency > self._budget:
+            # Over budget, spread the work over more threads before giving up resolution
+            if self._threads < self._maxThreads:
+                self._threads += 1
+            elif self._level < len(_LEVELS) - 1 and not tagsTooSmall:
+                self._level += 1
+            else:
+                return
+            self._apply()
+        elif self._latency < 0.6 * self._budget or (tagsTooSmall and self._latency < 0.85 * self._budget):
+            # Well under budget, or losing small tags with some headroom left, get resolution back before releasing threads
+            if self._level > 0:
+                self._level -= 1
+            elif self._latency < 0.4 * self._budget and self._threads > 1:
+                self._threads -= 1
+            else:
+                return
+            self._apply()
+
+    def getSettings(self) -> Tuple[float,float,int]:
+        """
+        :return: The active decimation, blur sigma, and thread count
+        """
+        return _LEVELS[self._level][0],_LEVELS[self._level][1],self._threads
+
+def _tagSizes(fiducials: FiducialBatch) -> np.ndarray:
+    """
+    :return: Length of the longest side of each tag's bounding box, in pixels
+    """
+    extents = fiducials.corners.max(axis=1) - fiducials.corners.min(axis=1)
+    return extents.max(axis=1)
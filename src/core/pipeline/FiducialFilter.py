@@ -0,0 +1,100 @@
+# Copyright (c) FRC 1076 PiHi Samurai
+# You may use, distribute, and modify this software under the terms of
+# the license found in the root directory of this project
+
+import numpy as np
+from typing import Dict, List, Tuple
+from utils.vtypes import FiducialBatch, REJECTION_REASONS
+from configuration.config_types import TagFilterConfig
+
+class FiducialFilter:
+    """
+    Rejects low quality detections before they reach the pose solvers. Runs on a whole batch at once,
+    thresholds are kept in lookup tables indexed by tag id so that per-tag overrides cost nothing extra.
+    The tables only reach the highest overridden or excluded id, their last entry holds the defaults and is shared by every id past it,
+    so families with large id ranges (e.g. tagStandard52h13) do not need large tables.
+    """
+    def __init__(self, defaults: TagFilterConfig = TagFilterConfig(), overrides: Dict[int,TagFilterConfig] = {}):
+        self._excluded = np.zeros(1,dtype=np.bool_)
+        self._minMargin = np.empty(1,dtype=np.float64)
+        self._maxHamming = np.empty(1,dtype=np.int32)
+        self._minArea = np.empty(1,dtype=np.float64)
+        self._maxSkew = np.empty(1,dtype=np.float64)
+        self._setThresholds(slice(None),defaults)
+        self._reserve(max(overrides.keys(),default=-1) + 1)
+        for id, override in overrides.items():
+            self._setThresholds(id,override)
+        self._rejections = np.zeros(len(REJECTION_REASONS),dtype=np.int64)
+
+    def _setThresholds(self, index, config: TagFilterConfig) -> None:
+        self._minMargin[index] = config.minDecisionMargin
+        self._maxHamming[index] = config.maxHamming if config.maxHamming is not None else np.iinfo(np.int32).max
+        self._minArea[index] = config.minArea
+        self._maxSkew[index] = config.maxSkew if config.maxSkew is not None else np.inf
+
+    def _reserve(self, ids: int) -> None:
+        """
+        Grows the tables to hold their own entry for every id below ids, new entries start out with the defaults
+        """
+        size = ids + 1
+        if size <= len(self._excluded):
+            return
+        for name in ("_excluded","_minMargin","_maxHamming","_minArea","_maxSkew"):
+            table = getattr(self,name)
+            grown = np.full(size,table[-1],dtype=table.dtype)
+            grown[:len(table) - 1] = table[:-1]
+            setattr(self,name,grown)
+
+    def setExcluded(self, tags: List[int]) -> None:
+        self._reserve(max(tags,default=-1) + 1)
+        self._excluded[:] = False
+        self._excluded[tags] = True
+
+    def filter(self, fiducials: FiducialBatch) -> FiducialBatch:
+        """
+        :return: The detections that pass every check
+        """
+        passed, rejections = self.evaluate(fiducials)
+        self.record(rejections)
+        return passed
+
+    def evaluate(self, fiducials: FiducialBatch) -> Tuple[FiducialBatch,np.ndarray]:
+        """
+        Filters without counting the rejections, for callers that may throw the result away
+        :return: The detections that pass every check, and the number rejected for each reason, to be passed to record() if the result is used
+        """
+        rejections = np.zeros(len(REJECTION_REASONS),dtype=np.int64)
+        if len(fiducials) == 0:
+            return fiducials, rejections
+        ids = np.minimum(fiducials.ids,len(self._excluded) - 1)
+        corners = fiducials.corners
+        # Shoelace formula for the quad's area, and the ratio of its longest to shortest side as a measure of skew
+        x, y = corners[:,:,0], corners[:,:,1]
+        area = 0.5 * np.abs(np.sum(x * np.roll(y,-1,axis=1) - np.roll(x,-1,axis=1) * y,axis=1))
+        sides = np.linalg.norm(corners - np.roll(corners,-1,axis=1),axis=2)
+        skew = sides.max(axis=1) / np.maximum(sides.min(axis=1),1e-9)
+
+        failed = (
+            self._excluded[ids],
+            fiducials.hammingDists > self._maxHamming[ids],
+            fiducials.decisionMargins < self._minMargin[ids],
+            area < self._minArea[ids],
+            skew > self._maxSkew[ids]
+        )
+        rejected = np.zeros(len(fiducials),dtype=np.bool_)
+        for reason, mask in enumerate(failed):
+            rejections[reason] = np.count_nonzero(mask & ~rejected)
+            rejected |= mask
+        return (fiducials.select(~rejected) if rejected.any() else fiducials), rejections
+
+    def record(self, rejections: np.ndarray) -> None:
+        """
+        Adds rejections returned by evaluate() to the totals
+        """
+        self._rejections += rejections
+
+    def getRejections(self) -> Tuple[int,...]:
+        """
+        :return: Total number of rejected detections for each reason in REJECTION_REASONS
+        """
+        return tuple(self._rejections.tolist())
@@ -0,0 +1,123 @@
+# Copyright (c) FRC 1076 PiHi Samurai
+# You may use, distribute, and modify this software under the terms of
+# the license found in the root directory of this project
+
+import logging
+import threading
+import cv2
+import numpy as np
+from time import perf_counter
+from typing import Dict, List, Tuple, Union
+from pipeline import backends
+
+logger = logging.getLogger(__name__)
+
+_ACTIVE_TIMEOUT = 1.0 # Seconds after its last request that a client stops being waited for
+
+class _Request:
+    def __init__(self, frame: cv2.Mat):
+        self.frame = frame
+        self.result: Union[np.ndarray,None] = None
+        self.error: Union[BaseException,None] = None
+        self.done: bool = False
+
+class InferenceService:
+    """
+    Runs one model for every object detection pipeline that uses it, batching frames from different cameras into a single forward pass.
+    The first request of a batch waits up to the batch window for requests from the other active clients,
+    then runs the batch on its own thread and hands every other request its detections. There is no service thread.
+    """
+    def __init__(self, backend: backends.InferenceBackend, window: float):
+        """
+        :param window: Longest time in seconds a request waits for the rest of its batch
+        """
+        self._backend = backend
+        self._window = window
+        self._cond = threading.Condition()
+        self._inferLock = threading.Lock() # Backends are not thread safe, a batch can only start once the previous one has finished
+        self._pending: List[_Request] = []
+        self._lastSeen: Dict[str,float] = {} # perf_counter time of each client's last request
+        self._batches: int = 0
+        self._frames: int = 0
+
+    def infer(self, frame: cv2.Mat, client: str) -> np.ndarray:
+        """
+        Blocks until the frame has been run through the model, possibly in a batch with other clients' frames
+        :param client: Name of the requesting pipeline, used to tell how many requests to wait for
+        :return: (N,6) detections, see InferenceBackend.infer
+        """
+        request = _Request(frame)
+        with self._cond:
+            now = perf_counter()
+            self._lastSeen[client] = now
+            self._pending.append(request)
+            if len(self._pending) > 1:
+                # Another request is leading this batch
+                self._cond.notify_all()
+                while not request.done:
+                    self._cond.wait()
+                if request.error is not None:
+                    raise request.error
+                return request.result
+            active = sum(1 for seen in self._lastSeen.values() if now - seen < _ACTIVE_TIMEOUT)
+            deadline = now + self._window
+            while len(self._pending) < active:
+                remaining = deadline - perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = self._pending
+            self._pending = []
+        try:
+            with self._inferLock:
+                results = self._backend.inferBatch([pending.frame for pending in batch])
+        except BaseException as e:
+            results = None
+            error = e
+        with self._cond:
+            for index, pending in enumerate(batch):
+                if results is not None:
+                    pending.result = results[index]
+                else:
+                    pending.error = error
+                pending.done = True
+            self._batches += 1
+            self._frames += len(batch)
+            self._cond.notify_all()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def getClassNames(self) -> Dict[int,str]:
+        return self._backend.getClassNames()
+
+    def getStats(self) -> Tuple[int,int]:
+        """
+        :return: Total number of batches run, and frames inferred
+        """
+        return self._batches, self._frames
+
+_services: Dict[Tuple[str,str,int,float,Union[Tuple[int,...],None]],InferenceService] = {}
+_servicesLock = threading.Lock()
+
+def getService(
+    model_path: str,
+    backend: str,
+    inputSize: int,
+    window: float,
+    confidenceThreshold: float = backends._CONFIDENCE_THRESHOLD,
+    classes: Union[List[int],None] = None
+) -> InferenceService:
+    """
+    Returns the inference service for a model, creating it if needed. There is only ever one service per model, backend, input size, and filter
+    in a process, so every pipeline that uses the same model with the same confidence threshold and classes shares its batches.
+    The window of the first pipeline to create the service is used.
+    """
+    key = (model_path,backend,inputSize,confidenceThreshold,tuple(classes) if classes is not None else None)
+    with _servicesLock:
+        service = _services.get(key)
+        if service is None:
+            service = InferenceService(backends.createBackend(backend,model_path,inputSize,confidenceThreshold,classes),window)
+            _services[key] = service
+            logger.debug("Started inference service for %s on %s",model_path,backend)
+    return service
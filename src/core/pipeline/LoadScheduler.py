@@ -0,0 +1,134 @@
+# Copyright (c) FRC 1076 PiHi Samurai
+# You may use, distribute, and modify this software under the terms of
+# the license found in the root directory of this project
+
+import threading
+import logging
+from time import perf_counter_ns
+from typing import Dict, List, Tuple, Union
+from dataclasses import dataclass
+from configuration.config_types import SchedulerConfig
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class _PipelineState:
+    priority: int
+    targetFps: float
+    cost: float = 0.0 # Moving average of processing time per frame, in seconds
+    allowedFps: float = 0.0
+    throttled: bool = False # Whether the pipeline was granted less than its demand, unthrottled pipelines take every frame
+    credit: float = 1.0 # Token bucket, a frame is admitted when at least one token is available
+    lastAdmitCheck: int = 0
+    processed: int = 0 # Frames processed in the current measurement window
+    arrived: int = 0 # Frames the camera delivered in the current measurement window, admitted, skipped, or missed while busy
+    skipped: int = 0 # Frames skipped since startup
+    achievedFps: float = 0.0
+    arrivalFps: float = 0.0 # Rate frames actually arrive at, a pipeline can never run faster than its camera
+
+class LoadScheduler:
+    """
+    Shares the coprocessor's CPU time between pipelines by priority.
+    Each pipeline reports how long its frames take to process. The scheduler hands out CPU time to pipelines in order of priority,
+    up to what each one needs to reach its target FPS, and lower priority pipelines skip frames once the budget runs out.
+    Targets are capped at the rate frames actually arrive at, which may be lower than the configured target or the camera's nominal fps.
+    If a pipeline processes fewer frames than it was allowed to while lower priority pipelines are still running, the budget is shrunk until it catches up.
+    """
+    def __init__(self, config: SchedulerConfig):
+        self._capacity = config.cores * config.utilization # Core-seconds of processing available per second
+        self._scale: float = 1.0 # Correction factor applied to the capacity, adjusted from missed targets
+        self._period = int(config.period * 1e9)
+        self._smoothing = config.smoothing
+        self._pipelines: Dict[str,_PipelineState] = {}
+        self._lock = threading.Lock()
+        self._lastUpdate = perf_counter_ns()
+
+    def register(self, name: str, priority: int, targetFps: float) -> None:
+        with self._lock:
+            self._pipelines[name] = _PipelineState(priority,targetFps,allowedFps=targetFps,lastAdmitCheck=perf_counter_ns())
+        logger.debug("Scheduling %s with priority %d at %.1f fps",name,priority,targetFps)
+
+    def admit(self, name: str, missed: int = 0) -> bool:
+        """
+        Decides whether a pipeline should process the frame it just received
+        :param missed: Frames the camera delivered since the last call that the pipeline never received because it was busy
+        :return: True if the frame should be processed, False if it should be skipped
+        """
+        with self._lock:
+            state = self._pipelines[name]
+            state.arrived += 1 + missed
+            if not state.throttled:
+                # A token bucket at the camera's own rate would skip frames whenever they arrive slightly early
+                return True
+            now = perf_counter_ns()
+            state.credit = min(state.credit + (now - state.lastAdmitCheck) / 1e9 * state.allowedFps,1.0)
+            state.lastAdmitCheck = now
+            if state.credit >= 1.0:
+                state.credit -= 1.0
+                return True
+            state.skipped += 1
+            return False
+
+    def report(self, name: str, cost: int) -> None:
+        """
+        :param cost: Time taken to process one frame, in nanoseconds
+        """
+        with self._lock:
+            state = self._pipelines[name]
+            seconds = cost / 1e9
+            state.cost = seconds if state.cost == 0.0 else state.cost + self._smoothing * (seconds - state.cost)
+            state.processed += 1
+            now = perf_counter_ns()
+            if now - self._lastUpdate >= self._period:
+                self._update(now)
+
+    def _update(self, now: int) -> None:
+        window = (now - self._lastUpdate) / 1e9
+        self._lastUpdate = now
+        for state in self._pipelines.values():
+            state.achievedFps = state.processed / window
+            state.arrivalFps = state.arrived / window
+            state.processed = 0
+            state.arrived = 0
+
+        ordered: List[_PipelineState] = sorted(self._pipelines.values(),key=lambda state: state.priority,reverse=True)
+
+        # A pipeline that was granted its whole demand, yet left frames it was allowed to process unprocessed, is being slowed down by the pipelines sharing its budget
+        missed = False
+        for index,state in enumerate(ordered):
+            starving = state.achievedFps < 0.9 * min(state.allowedFps,state.arrivalFps) and state.allowedFps >= self._targetOf(state)
+            if starving and any(lower.priority < state.priority and lower.allowedFps > 0 for lower in ordered[index+1:]):
+                missed = True
+                break
+        if missed:
+            self._scale = max(self._scale * 0.8,0.1)
+        else:
+            self._scale = min(self._scale + 0.05,1.0)
+
+        remaining = self._capacity * self._scale
+        for state in ordered:
+            if state.cost == 0.0:
+                state.allowedFps = state.targetFps # No measurements yet
+                state.throttled = False
+                continue
+            demand = state.cost * self._targetOf(state)
+            grant = min(demand,max(remaining,0.0))
+            state.throttled = grant < demand
+            state.allowedFps = grant / state.cost if state.throttled else state.targetFps
+            if not state.throttled:
+                state.credit = 1.0
+            remaining -= grant
+
+    def _targetOf(self, state: _PipelineState) -> float:
+        """
+        :return: The rate the pipeline can actually reach, its target capped at the rate frames arrive at
+        """
+        return min(state.targetFps,state.arrivalFps) if state.arrivalFps > 0.0 else state.targetFps
+
+    def getState(self, name: str) -> Tuple[float,float,float,int]:
+        """
+        :return: The allowed fps, achieved fps, average processing cost in milliseconds, and total skipped frames of a pipeline
+        """
+        with self._lock:
+            state = self._pipelines[name]
+            return state.allowedFps,state.achievedFps,state.cost * 1e3,state.skipped
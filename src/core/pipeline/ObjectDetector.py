@@ -20,59 +20,150 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-import ultralytics
 from typing import List
 import cv2
-import ultralytics.engine.results
 from utils.vtypes import ObjDetectResult
 from configuration.config_types import CameraIntrinsics
-from typing import Dict, Tuple
+from pipeline.Undistorter import Undistorter
+from pipeline import backends, InferenceService, quantize
+from typing import Dict, Tuple, Union
+from time import perf_counter
+from utils import startup
 import numpy as np
-import math
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
 
 class ObjectDetector:
 
-    def __init__(self, model_path: str, intrinsics: CameraIntrinsics):
+    def __init__(
+        self,
+        model_path: str,
+        intrinsics: CameraIntrinsics,
+        undistorter: Union[Undistorter,None] = None,
+        backend: str = "ultralytics",
+        inputSize: int = 640,
+        batchWindow: Union[float,None] = None,
+        name: str = "",
+        confidenceThreshold: float = 0.25,
+        classes: Union[List[int],None] = None,
+        background: bool = False,
+        quantization: str = "none",
+        calibrationFrames: Union[str,None] = None
+    ):
         """
         Initialize the ObjectDetector with a YOLO model.
 
         :param model_path: Path to the YOLO model file.
+        :param undistorter: The camera's undistortion lookup table, bounding box corners are undistorted with OpenCV if None
+        :param backend: Inference backend the model is run with, one of backends.BACKENDS. The onnxruntime and opencv backends need an exported ONNX model
+        :param inputSize: Side length of the model input frames are letterboxed into, for the ONNX backends
+        :param batchWindow: If set, inference goes through the model's shared InferenceService, which waits up to this many seconds
+            to batch the frame with frames from other pipelines. Otherwise the detector runs the model on its own
+        :param name: Name of the detector's pipeline, identifies it to the inference service
+        :param confidenceThreshold: Detections at or below this confidence are dropped by the backend, before NMS
+        :param classes: Classes to detect, None detects every class
+        :param background: Loads and warms up the model on a background thread, so building the detector does not hold up startup.
+            The detector detects nothing until the model is ready
+        :param quantization: One of quantize.QUANTIZATIONS, runs a quantized version of the model. Only for the ONNX backends
+        :param calibrationFrames: Directory of representative frames the "int8" quantization is calibrated on
         """
         # This class is designed to help compute a 3 DoF pose estimate of an arbitrary object
         # Using camera intrinsics, we normalize the corners of the points, which we can then use to calculate rays from the camera to the corners of the bounding box
         # Using these rays (as well as the camera's extrinsic properties), we can work out a rough estimate 3 DoF pose of the object with 
         # the pythagorean theorem (Assuming the object is on the ground)
-        self._model = ultralytics.YOLO(model_path,'detect')
+        self._name = name
+        self._backend: Union[backends.InferenceBackend,None] = None
+        self._service: Union[InferenceService.InferenceService,None] = None
+        self._ready: bool = False
+        self._quantization = quantization
+        self._calibrationFrames = calibrationFrames
+        self._confidenceThreshold = confidenceThreshold
+        self._classes = classes
+        if background:
+            threading.Thread(target=self._loadInBackground,args=(model_path,backend,inputSize,batchWindow),name=f"{name}_model_loader",daemon=True).start()
+        else:
+            self._load(model_path,backend,inputSize,batchWindow)
         self._intrinsics = intrinsics
+        self._undistorter = undistorter
+
+    def _load(self, model_path: str, backend: str, inputSize: int, batchWindow: Union[float,None]) -> None:
+        """
+        Loads the model, and runs it once so the first frame does not pay for the runtime's lazy initialization
+        """
+        t0 = perf_counter()
+        if self._quantization != "none":
+            if backend == "ultralytics":
+                logger.warning("Quantization needs an exported ONNX model and the onnxruntime or opencv backend, running %s unquantized",model_path)
+            else:
+                model_path = quantize.getQuantizedModel(model_path,self._quantization,self._calibrationFrames,inputSize)
+        if batchWindow is not None:
+            self._service = InferenceService.getService(model_path,backend,inputSize,batchWindow,self._confidenceThreshold,self._classes)
+            self._service.infer(np.zeros((inputSize,inputSize,3),dtype=np.uint8),self._name)
+        else:
+            self._backend = backends.createBackend(backend,model_path,inputSize,self._confidenceThreshold,self._classes)
+            self._backend.infer(np.zeros((inputSize,inputSize,3),dtype=np.uint8))
+        self._ready = True
+        startup.event(f"{self._name} model ready",perf_counter() - t0)
+
+    def _loadInBackground(self, model_path: str, backend: str, inputSize: int, batchWindow: Union[float,None]) -> None:
+        try:
+            self._load(model_path,backend,inputSize,batchWindow)
+        except Exception:
+            logger.exception("Unable to load model %s",model_path)
+
+    def isReady(self) -> bool:
+        return self._ready
 
     def detect(self, frame: cv2.Mat) -> List[ObjDetectResult]:
-        model_result: ultralytics.engine.results.Results = self._model.predict(frame,verbose=False)[0]
-        bbxarr: np.ndarray = model_result.boxes.data #Numpy array containing bounding boxes
-        area: Tuple[int,int] = model_result.orig_shape
+        return self.buildResults(self.detectBoxes(frame),frame.shape)
+
+    def detectBoxes(self, frame: cv2.Mat) -> np.ndarray:
+        """
+        Runs the model on a frame
+        :return: (N,6) left, top, right, bottom, confidence, class of each bounding box that passes the confidence and class filters
+        """
+        if not self._ready:
+            return np.empty((0,6))
+        if self._service is not None:
+            return self._service.infer(frame,self._name)
+        return self._backend.infer(frame)
+
+    def buildResults(
+        self,
+        boxes: np.ndarray,
+        frameShape: Tuple[int,...],
+        track_ids: Union[np.ndarray,None] = None,
+        interpolated: Union[np.ndarray,None] = None
+    ) -> List[ObjDetectResult]:
+        """
+        Computes the corner angles and area of bounding boxes
+        :param boxes: (N,6) bounding boxes, see detectBoxes
+        :param track_ids: (N,) track ID of each box, if it is tracked
+        :param interpolated: (N,) whether each box was propagated by the tracker
+        """
+        area: Tuple[int,int] = frameShape[:2]
         results: List[ObjDetectResult] = []
-        for bbx in bbxarr:
-            left,top = bbx[0],bbx[1]
-            right,bottom = bbx[2],bbx[3]
-            confidence = bbx[4]
-            obj_class = bbx[5]
-            corner_pixels = np.array(
-                [
-                    [left,bottom],
-                    [right,bottom],
-                    [right,top],
-                    [left,top]
-                ]
-            )
-            percent_area: float = (abs(left-right)*abs(top-bottom))/(area[0]*area[1])
-            corner_angles: np.typing.NDArray[np.float64] = np.zeros(shape=(4,2))
-            norm_corners = cv2.undistortPoints(corner_pixels,self._intrinsics.matrix,self._intrinsics.dist_coeffs)
-            for index,corner in enumerate(norm_corners):
-                corner_angles[index][0] = math.atan(corner[0][0])
-                corner_angles[index][1] = math.atan(corner[0][1])
-            results.append(ObjDetectResult(int(obj_class),confidence,percent_area,corner_angles,corner_pixels))
+        if len(boxes) == 0:
+            return results
+        corner_pixels = boxes[:,[[0,3],[2,3],[2,1],[0,1]]] #(N,4,2) bottom left, bottom right, top right, top left
+        # Every corner of the frame is undistorted at once, and the angles and areas are computed over every detection together
+        if self._undistorter is not None:
+            norm_corners = self._undistorter.undistortNormalized(corner_pixels)
+        else:
+            norm_corners = cv2.undistortPoints(corner_pixels.reshape((-1,1,2)),self._intrinsics.matrix,self._intrinsics.dist_coeffs).reshape(corner_pixels.shape)
+        corner_angles = np.arctan(norm_corners)
+        percent_areas = (np.abs(boxes[:,2]-boxes[:,0])*np.abs(boxes[:,3]-boxes[:,1]))/(area[0]*area[1])
+        ids = track_ids.tolist() if track_ids is not None else [-1] * len(boxes)
+        flags = interpolated.tolist() if interpolated is not None else [False] * len(boxes)
+        for obj_class, confidence, percent_area, angles, pixels, track_id, flag in zip(boxes[:,5].astype(int).tolist(),boxes[:,4].tolist(),percent_areas.tolist(),corner_angles,corner_pixels,ids,flags):
+            results.append(ObjDetectResult(obj_class,confidence,percent_area,angles,pixels,track_id,flag))
         return results
     
     def getClassNames(self) -> Dict[int,str]:
-        return self._model.names
+        if not self._ready:
+            return {}
+        return self._service.getClassNames() if self._service is not None else self._backend.getClassNames()
             
                 
@@ -0,0 +1,109 @@
+# Copyright (c) FRC 1076 PiHi Samurai
+# You may use, distribute, and modify this software under the terms of
+# the license found in the root directory of this project
+
+import numpy as np
+from typing import Tuple, Union
+
+_VELOCITY_SMOOTHING = 0.5 # Weight of the newest measurement in each track's velocity estimate
+
+def iou(boxes: np.ndarray, others: np.ndarray) -> np.ndarray:
+    """
+    :param boxes: (N,4) left, top, right, bottom
+    :param others: (M,4) left, top, right, bottom
+    :return: (N,M) intersection over union of every pair of boxes
+    """
+    width = np.minimum(boxes[:,None,2],others[None,:,2]) - np.maximum(boxes[:,None,0],others[None,:,0])
+    height = np.minimum(boxes[:,None,3],others[None,:,3]) - np.maximum(boxes[:,None,1],others[None,:,1])
+    intersection = np.maximum(width,0.0) * np.maximum(height,0.0)
+    areas = (boxes[:,2] - boxes[:,0]) * (boxes[:,3] - boxes[:,1])
+    otherAreas = (others[:,2] - others[:,0]) * (others[:,3] - others[:,1])
+    return intersection / (areas[:,None] + otherAreas[None,:] - intersection + 1e-9)
+
+class ObjectTracker:
+    """
+    Follows object detections from frame to frame, giving each object a persistent track ID.
+    Detections are associated with tracks of the same class by IoU, and each track's box is propagated with a constant velocity
+    between detections, so boxes can be published on frames that were not run through the model.
+    """
+    def __init__(self, minIou: float = 0.3, timeout: float = 0.5):
+        """
+        :param minIou: Lowest overlap between a detection and a track's predicted box for them to be associated
+        :param timeout: Seconds a track is kept without being detected
+        """
+        self._minIou = minIou
+        self._timeout = timeout
+        self._nextId: int = 0
+        self._ids = np.empty(0,dtype=np.int64)
+        self._boxes = np.empty((0,6)) #Box, confidence, and class of each track at its last detection
+        self._velocities = np.empty((0,4)) #Pixels per second
+        self._times = np.empty(0) #Time of each track's last detection
+        self._fresh = np.empty(0,dtype=bool) #Whether each track was detected since it was last predicted
+
+    def update(self, detections: np.ndarray, time: float) -> np.ndarray:
+        """
+        Associates detections with the existing tracks, starting new tracks for unmatched detections and dropping tracks that timed out
+        :param detections: (N,6) left, top, right, bottom, confidence, class, see InferenceBackend.infer
+        :param time: Time in seconds of the frame the detections were made on
+        :return: (N,) track ID of each detection
+        """
+        alive = time - self._times <= self._timeout
+        self._ids, self._boxes, self._velocities, self._times, self._fresh = (
+            self._ids[alive], self._boxes[alive], self._velocities[alive], self._times[alive], self._fresh[alive]
+        )
+        detectionIds = np.empty(len(detections),dtype=np.int64)
+        matched = np.zeros(len(detections),dtype=bool)
+        if len(self._ids) > 0 and len(detections) > 0:
+            predicted = self._boxes[:,:4] + self._velocities * (time - self._times)[:,None]
+            overlaps = iou(predicted,detections[:,:4])
+            overlaps[self._boxes[:,5,None] != detections[None,:,5]] = 0.0
+            # Greedily match the most overlapping pairs first
+            for flat in np.argsort(overlaps,axis=None)[::-1]:
+                track, detection = divmod(int(flat),len(detections))
+                if overlaps[track,detection] < self._minIou:
+                    break
+                if matched[detection] or np.isnan(overlaps[track,detection]):
+                    continue
+                elapsed = time - self._times[track]
+                if elapsed > 0:
+                    measured = (detections[detection,:4] - self._boxes[track,:4]) / elapsed
+                    self._velocities[track] += _VELOCITY_SMOOTHING * (measured - self._velocities[track])
+                self._boxes[track] = detections[detection]
+                self._times[track] = time
+                self._fresh[track] = True
+                detectionIds[detection] = self._ids[track]
+                matched[detection] = True
+                overlaps[track] = np.nan # The track can not be matched again
+        unmatched = np.flatnonzero(~matched)
+        newIds = np.arange(self._nextId,self._nextId + len(unmatched))
+        self._nextId += len(unmatched)
+        detectionIds[unmatched] = newIds
+        self._ids = np.concatenate((self._ids,newIds))
+        self._boxes = np.concatenate((self._boxes,detections[unmatched]))
+        self._velocities = np.concatenate((self._velocities,np.zeros((len(unmatched),4))))
+        self._times = np.concatenate((self._times,np.full(len(unmatched),time)))
+        self._fresh = np.concatenate((self._fresh,np.ones(len(unmatched),dtype=bool)))
+        return detectionIds
+
+    def predict(self, time: float, frameShape: Union[Tuple[int,...],None] = None) -> Tuple[np.ndarray,np.ndarray,np.ndarray]:
+        """
+        Propagates every live track to a time. A track is fresh the first time it is predicted after being detected
+        :param frameShape: If given, boxes are clipped to the frame
+        :return: (M,6) box, confidence, and class, (M,) track IDs, and (M,) whether each track is fresh
+        """
+        alive = time - self._times <= self._timeout
+        boxes = self._boxes[alive].copy()
+        boxes[:,:4] += self._velocities[alive] * (time - self._times[alive])[:,None]
+        if frameShape is not None:
+            boxes[:,0:4:2] = np.clip(boxes[:,0:4:2],0,frameShape[1])
+            boxes[:,1:4:2] = np.clip(boxes[:,1:4:2],0,frameShape[0])
+        ids, fresh = self._ids[alive], self._fresh[alive]
+        self._fresh[:] = False
+        if frameShape is not None:
+            # Tracks that have moved out of the frame are not published
+            visible = (boxes[:,2] > boxes[:,0]) & (boxes[:,3] > boxes[:,1])
+            return boxes[visible], ids[visible], fresh[visible]
+        return boxes, ids, fresh
+
+    def getTrackCount(self) -> int:
+        return len(self._ids)
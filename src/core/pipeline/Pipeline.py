@@ -22,19 +22,46 @@
 
 import cv2
 import numpy as np
+import os
 from utils.vtypes import *
 from configuration.config_types import PipelineConfig, CameraIntrinsics
-from pipeline.ApriltagDetector import ApriltagDetector
-from pipeline.ObjectDetector import ObjectDetector
+from pipeline.ApriltagDetector import ApriltagDetector, TiledApriltagDetector
+from pipeline.DetectorController import DetectorController
+from pipeline.FiducialFilter import FiducialFilter
+from pipeline.ObjectTracker import ObjectTracker
+from pipeline.Undistorter import Undistorter
 from pipeline import Annotator, pnpsolvers
 from typing import Tuple
-from time import perf_counter_ns
+from time import perf_counter, perf_counter_ns
 import logging
+import threading
 from configuration import Field
+from utils.bufferpool import BufferPool
 
 logger = logging.getLogger(__name__)
+
+_INFER_IDLE_TIMEOUT = 2.0 # Seconds without a frame before an async object detection pipeline's inference thread exits
+
+def _asGrayscale(frame: cv2.Mat) -> Union[cv2.Mat,None]:
+    """
+    :return: A 2D view of the frame if it is already single channel (e.g. captured from a kGray feed), None otherwise
+    """
+    if frame.ndim == 2:
+        return frame
+    if frame.shape[2] == 1:
+        return frame.reshape(frame.shape[:2])
+    return None
+
 class Pipeline:
 
+    _pool: BufferPool
+
+    def setBufferPool(self, pool: BufferPool) -> None:
+        """
+        Sets the pool that intermediate and annotated frames are drawn from. Annotated frames in results should be released back to it once they have been streamed.
+        """
+        self._pool = pool
+
     def preprocess(self, frame: cv2.Mat) -> cv2.Mat:
         raise NotImplementedError("Pipeline.run() must be implemented by subclasses.")
 
@@ -55,10 +82,28 @@ class Pipeline:
         provides a more detailed benchmark, giving data on the performance of both the processing step and the postprocessing step
         """
         raise NotImplementedError("Pipeline.deepBenchmark() must be implemented by subclasses.")
+
+    def getDetectorSettings(self) -> Union[Tuple[float,float,int],None]:
+        """
+        :return: The decimation, blur sigma, and thread count chosen by the pipeline's detector controller, or None if it has none
+        """
+        return None
+
+    def getRejections(self) -> Union[Tuple[int,...],None]:
+        """
+        :return: Number of detections rejected by the pipeline's quality filter for each reason in vtypes.REJECTION_REASONS, or None if it has no filter
+        """
+        return None
+
+    def getSolveCacheStats(self) -> Union[Tuple[int,int],None]:
+        """
+        :return: Total hits and lookups of the pipeline's per-frame solve cache, or None if it has none
+        """
+        return None
     
 class ApriltagPipeline(Pipeline):
     """
-    A pipeline for detecting and solving AprilTags. Expects a grayscale frame
+    A pipeline for detecting and solving AprilTags. Accepts grayscale or BGR frames, grayscale frames skip the color conversion
     """
     def __init__(
         self,
@@ -66,16 +111,28 @@ class ApriltagPipeline(Pipeline):
         solver: pnpsolvers.GeneralPnPSolver,
         fidSolver: pnpsolvers.FiducialPnPSolver,
         annotator: Annotator.Annotator,
-        stream: bool
+        stream: bool,
+        controller: Union[DetectorController,None] = None,
+        undistorter: Union[Undistorter,None] = None
     ):
+        """
+        :param undistorter: The camera's undistortion lookup table, the solvers undistort corners themselves if None
+        """
         self._detector = detector
         self._solver = solver
         self._fidSolver = fidSolver
         self._annotator = annotator
         self._stream = stream
+        self._controller = controller
+        self._undistorter = undistorter
+        self._pool = BufferPool()
+        self._context = pnpsolvers.SolveContext()
 
     def preprocess(self, frame):
-        return cv2.cvtColor(frame,cv2.COLOR_BGR2GRAY)
+        gray = _asGrayscale(frame)
+        if gray is not None:
+            return gray
+        return cv2.cvtColor(frame,cv2.COLOR_BGR2GRAY,dst=self._pool.acquire(frame.shape[:2]))
     
     def process(self,frame: cv2.Mat) -> PipelineResult:
         """
@@ -83,30 +140,26 @@ class ApriltagPipeline(Pipeline):
         """
         ppFrame = self.preprocess(frame)
         # Process the frame
+        det_t0 = perf_counter_ns()
         fiducials = self._detector.detect(ppFrame)
-        nTagResult = self._solver.solve(fiducials)
-        singleTagResults: List[Tuple[SingleTagPoseResult,Fiducial]] = []
-        for fiducial in fiducials:
-            stres = self._fidSolver.solve(fiducial)
-            if stres != None:
-                singleTagResults.append((stres,fiducial))
+        if self._controller is not None:
+            self._controller.update(perf_counter_ns() - det_t0,fiducials)
+        if self._undistorter is not None:
+            fiducials = self._undistorter.undistortFiducials(fiducials)
+        self._context.reset()
+        singleTagResults = self._fidSolver.solveBatch(fiducials,self._context)
+        nTagResult = self._solver.solve(fiducials,self._context)
         
-        distResults: List[TagDistResult] = []
         annotatedFrame = None
         if self._stream:
-            annotatedFrame = cv2.cvtColor(ppFrame, cv2.COLOR_GRAY2BGR)
+            annotatedFrame = cv2.cvtColor(ppFrame, cv2.COLOR_GRAY2BGR, dst=self._pool.acquire(ppFrame.shape + (3,)))
             self._annotator.drawFiducials(annotatedFrame, fiducials)
-        for result in singleTagResults:
-            if self._stream: self._annotator.drawSingleTagPose(annotatedFrame, result[0])
-            distResults.append(TagDistResult(
-                result[1].id,
-                result[1].corners,
-                result[1].decisionMargin,
-                result[1].hammingDist,
-                np.linalg.norm(result[0].tvecs_0 if result[0].error_0 <= result[0].error_1 else result[0].tvecs_1)
-            ))
-
-        apriltagResult = ApriltagResult(distResults,nTagResult)
+            for result in singleTagResults:
+                self._annotator.drawSingleTagPose(annotatedFrame, result)
+
+        if ppFrame is not frame:
+            self._pool.release(ppFrame)
+        apriltagResult = ApriltagResult(singleTagResults,nTagResult)
         
         return PipelineResult(apriltagResult,None,annotatedFrame)
 
@@ -120,61 +173,146 @@ class ApriltagPipeline(Pipeline):
         # Process the frame
         fiducials = self._detector.detect(ppFrame)
         timestamps.append(perf_counter_ns())
+        if self._controller is not None:
+            self._controller.update(timestamps[-1] - timestamps[-2],fiducials)
 
-        nTagResult = self._solver.solve(fiducials)
+        if self._undistorter is not None:
+            fiducials = self._undistorter.undistortFiducials(fiducials)
+        self._context.reset()
+        singleTagResults = self._fidSolver.solveBatch(fiducials,self._context)
         timestamps.append(perf_counter_ns())
 
-        singleTagResults: List[Tuple[SingleTagPoseResult,Fiducial]] = []
-        for fiducial in fiducials:
-            stres = self._fidSolver.solve(fiducial)
-            if stres != None:
-                singleTagResults.append((stres,fiducial))
+        nTagResult = self._solver.solve(fiducials,self._context)
         timestamps.append(perf_counter_ns())
         
-        distResults: List[TagDistResult] = []
         annotatedFrame = None
         if self._stream:
-            annotatedFrame = cv2.cvtColor(ppFrame, cv2.COLOR_GRAY2BGR)
+            annotatedFrame = cv2.cvtColor(ppFrame, cv2.COLOR_GRAY2BGR, dst=self._pool.acquire(ppFrame.shape + (3,)))
             self._annotator.drawFiducials(annotatedFrame, fiducials)
-        for result in singleTagResults:
-            if self._stream: self._annotator.drawSingleTagPose(annotatedFrame, result[0])
-            distResults.append(TagDistResult(
-                result[1].id,
-                result[1].corners,
-                result[1].decisionMargin,
-                result[1].hammingDist,
-                np.linalg.norm(result[0].tvecs_0 if result[0].error_0 <= result[0].error_1 else result[0].tvecs_1)
-            ))
+            for result in singleTagResults:
+                self._annotator.drawSingleTagPose(annotatedFrame, result)
         timestamps.append(perf_counter_ns())
 
-
-        apriltagResult = ApriltagResult(distResults,nTagResult)
+        if ppFrame is not frame:
+            self._pool.release(ppFrame)
+        apriltagResult = ApriltagResult(singleTagResults,nTagResult)
         return timestamps,PipelineResult(apriltagResult,None,annotatedFrame)
 
+    def getDetectorSettings(self) -> Union[Tuple[float,float,int],None]:
+        return self._controller.getSettings() if self._controller is not None else None
+
+    def getRejections(self) -> Union[Tuple[int,...],None]:
+        return self._detector.getRejections()
+
+    def getSolveCacheStats(self) -> Union[Tuple[int,int],None]:
+        return self._context.getStats()
+
         
     
 #TODO: Add object detection pipeline
             
 class ObjDetectPipeline(Pipeline):
-    def __init__(self, detector: ObjectDetector, stream: bool, grayscale: bool, annotator: Annotator.Annotator):
+    """
+    A pipeline for detecting objects with a YOLO model. Every detection is given a persistent track ID by an ObjectTracker.
+    In async mode the model runs on a background thread, on the newest frame it can take, and the tracker propagates the boxes
+    of the last inference on every frame in between, so results are published at the camera's frame rate rather than the model's
+    """
+    def __init__(
+        self,
+        detector: "ObjectDetector",
+        stream: bool,
+        grayscale: bool,
+        annotator: Annotator.Annotator,
+        tracker: Union[ObjectTracker,None] = None,
+        asyncInference: bool = False
+    ):
         self._detector = detector
         self._annotator = annotator
         self._grayscale = grayscale
         self._stream = stream
+        self._pool = BufferPool()
+        self._tracker = tracker if tracker is not None else ObjectTracker()
+        self._async = asyncInference
+        self._trackerLock = threading.Lock() # The inference thread updates the tracker while frames are being tracked
+        self._inferCond = threading.Condition()
+        self._inferFrame: Union[cv2.Mat,None] = None # Copy of the frame being inferred, owned by the inference thread while it is busy
+        self._inferTime: float = 0.0
+        self._inferBusy: bool = False
+        self._inferThread: Union[threading.Thread,None] = None # Started by the first frame, and exits once frames stop coming
     
     def preprocess(self, frame: cv2.Mat) -> cv2.Mat:
+        gray = _asGrayscale(frame)
         if self._grayscale:
-            return cv2.cvtColor(frame,cv2.COLOR_BGR2GRAY)
+            return gray if gray is not None else cv2.cvtColor(frame,cv2.COLOR_BGR2GRAY,dst=self._pool.acquire(frame.shape[:2]))
+        elif gray is not None:
+            return cv2.cvtColor(gray,cv2.COLOR_GRAY2BGR,dst=self._pool.acquire(gray.shape + (3,)))
+        elif self._stream:
+            # Frames from the camera feed are shared and read-only, annotations need their own copy
+            ppFrame = self._pool.acquire(frame.shape,frame.dtype)
+            np.copyto(ppFrame,frame)
+            return ppFrame
         else:
-            return frame.copy()
+            return frame
 
-    def process(self,frame: cv2.Mat) -> PipelineResult:
-        ppFrame = self.preprocess(frame)
-        results = self._detector.detect(ppFrame)
+    def _detect(self, ppFrame: cv2.Mat) -> List[ObjDetectResult]:
+        time = perf_counter()
+        if not self._async:
+            boxes = self._detector.detectBoxes(ppFrame)
+            return self._detector.buildResults(boxes,ppFrame.shape,self._tracker.update(boxes,time))
+        self._submit(ppFrame,time)
+        with self._trackerLock:
+            boxes, ids, fresh = self._tracker.predict(time,ppFrame.shape)
+        return self._detector.buildResults(boxes,ppFrame.shape,ids,~fresh)
+
+    def _submit(self, frame: cv2.Mat, time: float) -> None:
+        """
+        Hands a copy of the frame to the inference thread if it is idle. Frames that arrive while it is busy are only tracked
+        """
+        with self._inferCond:
+            if self._inferBusy:
+                return
+            if self._inferFrame is None or self._inferFrame.shape != frame.shape:
+                self._inferFrame = np.empty_like(frame)
+            np.copyto(self._inferFrame,frame)
+            self._inferTime = time
+            self._inferBusy = True
+            if self._inferThread is None:
+                self._inferThread = threading.Thread(target=self._inferLoop,name="objdetect_inference",daemon=True)
+                self._inferThread.start()
+            self._inferCond.notify()
+
+    def _inferLoop(self) -> None:
+        while True:
+            with self._inferCond:
+                if not self._inferBusy:
+                    self._inferCond.wait(_INFER_IDLE_TIMEOUT)
+                    if not self._inferBusy:
+                        # The pipeline has been stopped or replaced
+                        self._inferThread = None
+                        return
+                frame, time = self._inferFrame, self._inferTime
+            try:
+                boxes = self._detector.detectBoxes(frame)
+                with self._trackerLock:
+                    self._tracker.update(boxes,time)
+            except Exception:
+                logger.exception("Background inference failed")
+            with self._inferCond:
+                self._inferBusy = False
+
+    def _annotate(self, ppFrame: cv2.Mat, results: List[ObjDetectResult]) -> Union[cv2.Mat,None]:
         annotatedFrame: Union[cv2.Mat,None] = None
         if self._stream:
-            annotatedFrame = cv2.cvtColor(ppFrame,cv2.COLOR_GRAY2BGR) if self._grayscale else ppFrame
+            annotatedFrame = cv2.cvtColor(ppFrame,cv2.COLOR_GRAY2BGR,dst=self._pool.acquire(ppFrame.shape + (3,))) if self._grayscale else ppFrame
             self._annotator.drawObjDetectResults(annotatedFrame,results,self._detector.getClassNames())
+        return annotatedFrame
+
+    def process(self,frame: cv2.Mat) -> PipelineResult:
+        ppFrame = self.preprocess(frame)
+        results = self._detect(ppFrame)
+        annotatedFrame = self._annotate(ppFrame,results)
+        if ppFrame is not frame and ppFrame is not annotatedFrame:
+            self._pool.release(ppFrame)
         return PipelineResult(None,results,annotatedFrame)
     
     def deepBenchmark(self, frame: cv2.Mat) -> Tuple[List[int],PipelineResult]:
@@ -182,31 +320,63 @@ class ObjDetectPipeline(Pipeline):
         timestamps.append(perf_counter_ns())
         ppFrame = self.preprocess(frame)
         timestamps.append(perf_counter_ns())
-        results = self._detector.detect(ppFrame)
+        results = self._detect(ppFrame)
         timestamps.append(perf_counter_ns())
-        annotatedFrame: Union[cv2.Mat,None] = None
-        if self._stream:
-            annotatedFrame = cv2.cvtColor(ppFrame,cv2.COLOR_GRAY2BGR) if self._grayscale else ppFrame
-            self._annotator.drawObjDetectResults(annotatedFrame,results,self._detector.getClassNames())
+        annotatedFrame = self._annotate(ppFrame,results)
+        if ppFrame is not frame and ppFrame is not annotatedFrame:
+            self._pool.release(ppFrame)
         timestamps.append(perf_counter_ns())
         return timestamps, PipelineResult(None,results,annotatedFrame)
     
-def buildPipeline(pipConf: PipelineConfig, intrinsics: CameraIntrinsics) -> Pipeline:
+def buildPipeline(pipConf: PipelineConfig, intrinsics: CameraIntrinsics, undistorter: Union[Undistorter,None] = None) -> Pipeline:
+    """
+    :param undistorter: The camera's undistortion lookup table (see Undistorter.forCamera), shared by every pipeline built for the camera
+    """
+    annotate = pipConf.stream and pipConf.processedport is not None # Annotated frames are only drawn (and converted to BGR) when something can view them
     match pipConf.type:
         case "apriltag":
             solver = pnpsolvers.GeneralPnPSolver(intrinsics,pipConf.apriltagConfig.excludeTagsPNP if pipConf.apriltagConfig is not None else [])
             fidSolver = pnpsolvers.FiducialPnPSolver(intrinsics)
-            detector = ApriltagDetector()
+            if pipConf.apriltagConfig is not None and pipConf.apriltagConfig.tileGrid is not None:
+                detector = TiledApriltagDetector(*pipConf.apriltagConfig.tileGrid,pipConf.apriltagConfig.tileOverlap)
+            else:
+                detector = ApriltagDetector()
             detector.addFamily(Field.getFamily())
             if pipConf.apriltagConfig is not None:
                 if pipConf.apriltagConfig.detConfigs is not None:
                     detector.setConfig(pipConf.apriltagConfig.detConfigs)
                 if pipConf.apriltagConfig.detQtps is not None:
                     detector.setQuadThresholdParameters(pipConf.apriltagConfig.detQtps)
+                if pipConf.apriltagConfig.tracking:
+                    detector.setTracking(True,pipConf.apriltagConfig.sweepInterval,pipConf.apriltagConfig.roiPadding)
+                if pipConf.apriltagConfig.temporalPnP:
+                    solver.setTemporal(True,pipConf.apriltagConfig.temporalMaxError)
+            if pipConf.apriltagConfig is not None:
+                detector.setFilter(FiducialFilter(pipConf.apriltagConfig.filter,pipConf.apriltagConfig.tagFilters))
             detector.setRejectlist(pipConf.apriltagConfig.excludeTags if pipConf.apriltagConfig is not None else [])
             annotator = Annotator.Annotator(intrinsics,pipConf.apriltagConfig.excludeTagsPNP if pipConf.apriltagConfig is not None else [])
-            return ApriltagPipeline(detector,solver,fidSolver,annotator,pipConf.stream)
+            controller = None
+            if pipConf.apriltagConfig is not None and pipConf.apriltagConfig.latencyBudget is not None:
+                maxThreads = len(pipConf.cpus) if pipConf.cpus is not None else os.cpu_count()
+                controller = DetectorController(detector,pipConf.apriltagConfig.latencyBudget,maxThreads)
+            return ApriltagPipeline(detector,solver,fidSolver,annotator,annotate,controller,undistorter)
         case "objdetect":
-            detector = ObjectDetector(pipConf.objdetectConfig.model,intrinsics)
+            # Object detection is only imported by pipelines that use it, so apriltag-only coprocessors skip it at startup
+            from pipeline.ObjectDetector import ObjectDetector
+            detector = ObjectDetector(
+                pipConf.objdetectConfig.model,
+                intrinsics,
+                undistorter,
+                pipConf.objdetectConfig.backend,
+                pipConf.objdetectConfig.inputSize,
+                pipConf.objdetectConfig.batchWindow / 1000 if pipConf.objdetectConfig.batchWindow is not None else None,
+                pipConf.name,
+                pipConf.objdetectConfig.confidenceThreshold,
+                pipConf.objdetectConfig.classes,
+                background=True,
+                quantization=pipConf.objdetectConfig.quantization,
+                calibrationFrames=pipConf.objdetectConfig.calibrationFrames
+            )
             annotator = Annotator.Annotator(intrinsics)
-            return ObjDetectPipeline(detector,pipConf.stream,pipConf.grayscale,annotator)
\ No newline at end of file
+            tracker = ObjectTracker(pipConf.objdetectConfig.trackIou,pipConf.objdetectConfig.trackTimeout / 1000)
+            return ObjDetectPipeline(detector,annotate,pipConf.grayscale,annotator,tracker,pipConf.objdetectConfig.asyncInference)
\ No newline at end of file
@@ -22,21 +22,37 @@
 
 from processes.PipelineWorker import PipelineWorker, buildPipelineWorker
 import logging
-from typing import List
-from configuration.config_types import PipelineConfig
+import time
+from time import perf_counter_ns
+from typing import List, Union
+from configuration.config_types import PipelineConfig, SupervisorConfig, SchedulerConfig
+from pipeline.LoadScheduler import LoadScheduler
+from utils import startup
+from video import CameraManager
 
 logger = logging.getLogger(__name__)
 
 _pipelines: dict[str,PipelineWorker] = {}
 _activePipelines: set[str] = set()
+_restarts: dict[str,int] = {}
+_lastRestart: dict[str,int] = {} # perf_counter_ns timestamp of each pipeline's latest restart
+_restartBackoff: dict[str,float] = {} # Seconds to wait after a pipeline's latest restart before restarting it again
+_MIN_RESTART_BACKOFF = 0.5
+_MAX_RESTART_BACKOFF = 30.0
+_startupGrace: float = 5.0
+_scheduler: Union[LoadScheduler,None] = None
 
-def loadPipelines(pipelineConfigs: List[PipelineConfig]) -> None:
+def loadPipelines(pipelineConfigs: List[PipelineConfig], schedulerConfig: Union[SchedulerConfig,None] = None) -> None:
+    global _scheduler
+    if schedulerConfig is not None and schedulerConfig.enabled and _scheduler is None:
+        _scheduler = LoadScheduler(schedulerConfig)
+        logger.info("Load scheduler enabled with %d cores",schedulerConfig.cores)
     for config in pipelineConfigs:
         if config.name in _pipelines.keys():
             logger.warning("Two pipelines named %s detected",config.name)
             continue
         logger.debug("Loading pipeline %s",config.name)
-        worker = buildPipelineWorker(config)
+        worker = buildPipelineWorker(config,_scheduler)
         _pipelines[config.name] = worker
 
 def startPipeline(pipename: str) -> None:
@@ -47,7 +63,7 @@ def startPipeline(pipename: str) -> None:
     if pipename in _activePipelines:
         logger.debug("Pipeline %s already started",pipename)
         return
-    worker.start()
+    worker.start(_startupGrace)
     _activePipelines.add(pipename)
 
 def stopPipeline(pipename: str) -> None:
@@ -66,8 +82,68 @@ def startAll() -> None:
         startPipeline(name)
 
 def stopAll() -> None:
-    for name in _activePipelines:
+    for name in list(_activePipelines):
         stopPipeline(name)
+
+def setStartupGrace(grace: float) -> None:
+    """
+    :param grace: Extra time in seconds a pipeline is given to produce its first frame after starting
+    """
+    global _startupGrace
+    _startupGrace = grace
+
+def getRestarts(pipename: str) -> int:
+    return _restarts.get(pipename,0)
+
+def checkPipelines(deadline: float) -> None:
+    """
+    Restarts every active pipeline whose worker has died, or has hung without making progress for longer than its deadline.
+    Capture failures are not restarted, silent camera feeds are rebuilt by CameraManager.checkFeeds instead.
+    A pipeline that keeps failing is restarted with exponential backoff, which resets once it has run healthily for a while.
+    :param deadline: Maximum time in seconds between frames, for pipelines that do not configure their own and are not slower than it
+    """
+    now = perf_counter_ns()
+    for name in list(_activePipelines):
+        worker = _pipelines[name]
+        backoff = _restartBackoff.get(name,0.0)
+        sinceRestart = (now - _lastRestart.get(name,0)) / 1e9
+        crashed = not worker.isAlive()
+        stalled = not crashed and now - worker.getHeartbeat() > worker.getDeadline(deadline) * 1e9
+        if not crashed and not stalled:
+            # Recovered once it has outlived its startup grace and deadline without failing again
+            if backoff > 0.0 and sinceRestart > max(2 * backoff,_startupGrace + worker.getDeadline(deadline)):
+                del _restartBackoff[name]
+            continue
+        if sinceRestart < backoff:
+            continue
+        if crashed:
+            logger.error("Pipeline %s crashed, restarting",name)
+        else:
+            logger.error("Pipeline %s stalled for %.3f s, restarting",name,(now - worker.getHeartbeat())/1e9)
+        _restarts[name] = _restarts.get(name,0) + 1
+        _lastRestart[name] = now
+        _restartBackoff[name] = min(max(backoff * 2,_MIN_RESTART_BACKOFF),_MAX_RESTART_BACKOFF)
+        try:
+            worker.restart(_startupGrace)
+        except Exception:
+            logger.exception("Unable to restart pipeline %s, retrying in %.1f s",name,_restartBackoff[name])
+
+def supervise(config: SupervisorConfig) -> None:
+    """
+    Watches the active pipelines forever, restarting any that crash or stall, and rebuilding camera feeds that stop delivering frames.
+    Blocks the calling thread.
+    """
+    logger.info("Supervising pipelines with a %.3f s deadline",config.deadline)
+    reportDeadline = startup.elapsed() + _startupGrace
+    reported = False
+    while True:
+        checkPipelines(config.deadline)
+        CameraManager.checkFeeds(config.feedTimeout)
+        # The startup report is logged once every pipeline has published, or the startup grace runs out
+        if not reported and (all(_pipelines[name].hasPublished() for name in _activePipelines) or startup.elapsed() > reportDeadline):
+            startup.report()
+            reported = True
+        time.sleep(config.interval)
     
 
 
@@ -0,0 +1,142 @@
+# Copyright (c) FRC 1076 PiHi Samurai
+# You may use, distribute, and modify this software under the terms of
+# the license found in the root directory of this project
+
+import logging
+import os
+import dataclasses
+import numpy as np
+from typing import Tuple, Union
+from configuration.config_types import CameraIntrinsics
+from utils.vtypes import FiducialBatch
+
+logger = logging.getLogger(__name__)
+
+_TABLE_ITERATIONS = 100 # Fixed-point iterations used to invert the distortion model when building the lookup table
+
+class Undistorter:
+    """
+    Maps distorted pixel coordinates to undistorted ones through a lookup table of normalized image coordinates, sampled every `step` pixels
+    over the camera's resolution and interpolated bilinearly. The table is built once by inverting the distortion model iteratively,
+    so undistorting points every frame costs a single vectorized lookup.
+    """
+    def __init__(self, intrinsics: CameraIntrinsics, resolution: Tuple[int,int], step: int = 4, table: Union[np.ndarray,None] = None):
+        """
+        :param resolution: Width and height of the camera's frames, in pixels
+        :param step: Spacing of the lookup table's samples, in pixels
+        :param table: A lookup table built by an earlier instance with the same parameters, built from scratch if None
+        """
+        self._intrinsics = intrinsics
+        self._resolution = (int(resolution[0]),int(resolution[1]))
+        self._step = int(step)
+        self._table = table if table is not None else self._buildTable()
+        self._idealIntrinsics = CameraIntrinsics(intrinsics.matrix,np.zeros(5))
+        # Each cell of the table stores its bilinear interpolant as the coefficients of 1, fx, fy, and fx*fy,
+        # where fx and fy are the point's fractional position in the cell
+        matrix = intrinsics.matrix
+        pixels = np.empty(self._table.shape)
+        pixels[...,0] = matrix[0,0] * self._table[...,0] + matrix[0,1] * self._table[...,1] + matrix[0,2]
+        pixels[...,1] = matrix[1,1] * self._table[...,1] + matrix[1,2]
+        self._normalizedCells = self._cellCoefficients(self._table)
+        self._pixelCells = self._cellCoefficients(pixels)
+        self._lastCell = np.array([self._table.shape[1] - 2,self._table.shape[0] - 2])
+        self._cellStrides = np.array([1,self._table.shape[1] - 1])
+
+    @staticmethod
+    def forCamera(name: str, intrinsics: CameraIntrinsics, resolution: Tuple[int,int], step: int = 4) -> "Undistorter":
+        """
+        Loads the camera's lookup table from output/calib/<camera>/, next to its calibration, or builds and stores it there if it is missing or stale
+        """
+        path = f"output/calib/{name}/{resolution[0]}x{resolution[1]}_undistort_{step}.npz"
+        if os.path.isfile(path):
+            try:
+                with np.load(path) as cached:
+                    if np.array_equal(cached["matrix"],intrinsics.matrix) and np.array_equal(cached["dist_coeffs"],np.ravel(intrinsics.dist_coeffs)):
+                        return Undistorter(intrinsics,resolution,step,cached["table"])
+                logger.info("Undistortion table at %s is from a different calibration, rebuilding it",path)
+            except Exception:
+                logger.warning("Unable to load undistortion table at %s, rebuilding it",path)
+        undistorter = Undistorter(intrinsics,resolution,step)
+        try:
+            os.makedirs(os.path.dirname(path),exist_ok=True)
+            np.savez(path,matrix=intrinsics.matrix,dist_coeffs=np.ravel(intrinsics.dist_coeffs),table=undistorter._table)
+        except OSError:
+            logger.warning("Unable to cache undistortion table at %s",path)
+        return undistorter
+
+    def __reduce__(self):
+        # Pipelines running in a child process only receive the table, the interpolation coefficients are rebuilt from it
+        return (Undistorter,(self._intrinsics,self._resolution,self._step,self._table))
+
+    @staticmethod
+    def _cellCoefficients(table: np.ndarray) -> np.ndarray:
+        """
+        :param table: (rows,columns,2) samples
+        :return: (cells,4,2) bilinear coefficients of each cell, in row-major order
+        """
+        origin = table[:-1,:-1]
+        dx = table[:-1,1:] - origin
+        dy = table[1:,:-1] - origin
+        dxy = table[1:,1:] - table[1:,:-1] - dx
+        return np.stack((origin,dx,dy,dxy),axis=2).reshape((-1,4,2))
+
+    def _buildTable(self) -> np.ndarray:
+        # Samples cover the whole frame, the last row and column may lie past its edge
+        columns = -(-(self._resolution[0] - 1) // self._step) + 1
+        rows = -(-(self._resolution[1] - 1) // self._step) + 1
+        x, y = np.meshgrid(np.arange(columns) * float(self._step),np.arange(rows) * float(self._step))
+        # Same fixed-point inversion of the distortion model as cv2.undistortPoints, run to convergence instead of a handful of iterations
+        matrix = self._intrinsics.matrix
+        yd = (y - matrix[1,2]) / matrix[1,1]
+        xd = (x - matrix[0,2] - matrix[0,1] * yd) / matrix[0,0]
+        k = np.zeros(8)
+        coeffs = np.ravel(self._intrinsics.dist_coeffs)[:8]
+        k[:len(coeffs)] = coeffs
+        u, v = xd.copy(), yd.copy()
+        for _ in range(_TABLE_ITERATIONS):
+            r2 = u * u + v * v
+            inverseRadial = (1.0 + r2 * (k[5] + r2 * (k[6] + r2 * k[7]))) / (1.0 + r2 * (k[0] + r2 * (k[1] + r2 * k[4])))
+            u = (xd - 2.0 * k[2] * u * v - k[3] * (r2 + 2.0 * u * u)) * inverseRadial
+            v = (yd - k[2] * (r2 + 2.0 * v * v) - 2.0 * k[3] * u * v) * inverseRadial
+        normalized = np.stack((u,v),axis=-1)
+        return normalized.reshape((rows,columns,2))
+
+    def undistortNormalized(self, points: np.ndarray) -> np.ndarray:
+        """
+        :param points: (...,2) distorted pixel coordinates
+        :return: (...,2) undistorted, normalized image coordinates. Points outside the frame are extrapolated from its edge
+        """
+        return self._lookup(self._normalizedCells,points)
+
+    def undistortPixels(self, points: np.ndarray) -> np.ndarray:
+        """
+        :param points: (...,2) distorted pixel coordinates
+        :return: (...,2) pixel coordinates the points would have with no lens distortion, to be used with getIdealIntrinsics()
+        """
+        return self._lookup(self._pixelCells,points)
+
+    def undistortFiducials(self, fiducials: FiducialBatch) -> FiducialBatch:
+        """
+        :return: The batch with the undistorted pixel coordinates of every corner attached, see FiducialBatch.undistorted
+        """
+        return dataclasses.replace(fiducials,undistorted=self.undistortPixels(fiducials.corners))
+
+    def _lookup(self, cells: np.ndarray, points: np.ndarray) -> np.ndarray:
+        flat = np.reshape(points,(-1,2)) * (1.0 / self._step)
+        # Truncation only differs from flooring left of or above the frame, where the cell is clamped to the edge anyway
+        index = np.minimum(np.maximum(flat.astype(np.intp),0),self._lastCell)
+        fraction = flat - index
+        weights = np.empty((len(flat),1,4))
+        weights[:,0,0] = 1.0
+        weights[:,0,1:3] = fraction
+        weights[:,0,3] = fraction[:,0] * fraction[:,1]
+        return (weights @ cells[index @ self._cellStrides]).reshape(np.shape(points))
+
+    def getIdealIntrinsics(self) -> CameraIntrinsics:
+        """
+        :return: The camera's intrinsics without distortion, which describe points returned by undistortPixels
+        """
+        return self._idealIntrinsics
+
+    def getResolution(self) -> Tuple[int,int]:
+        return self._resolution
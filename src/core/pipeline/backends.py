@@ -0,0 +1,235 @@
+# Copyright (c) FRC 1076 PiHi Samurai
+# You may use, distribute, and modify this software under the terms of
+# the license found in the root directory of this project
+
+import ast
+import logging
+import cv2
+import numpy as np
+from typing import Dict, List, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# Inference backends for ObjectDetector. Each backend runs a YOLO detection model on a frame and returns its detections as an (N,6) array of
+# left, top, right, bottom, confidence, and class, in the frame's pixel coordinates. The heavy runtimes are only imported by the backend that uses them.
+# Confidence and class filters are applied by the backends before NMS, so filtered out boxes never suppress the ones that are kept.
+
+BACKENDS: List[str] = ["ultralytics","onnxruntime","opencv"]
+
+_CONFIDENCE_THRESHOLD = 0.25 # Same defaults as ultralytics' predict
+_IOU_THRESHOLD = 0.7
+_MAX_DETECTIONS = 300
+_PAD_VALUE = 114 # Letterbox border color used by ultralytics during training
+
+def nms(boxes: np.ndarray, scores: np.ndarray, iouThreshold: float) -> np.ndarray:
+    """
+    Greedy non-maximum suppression
+    :param boxes: (N,4) left, top, right, bottom
+    :return: Indices of the kept boxes, highest score first
+    """
+    order = np.argsort(scores)[::-1]
+    areas = (boxes[:,2] - boxes[:,0]) * (boxes[:,3] - boxes[:,1])
+    keep: List[int] = []
+    while len(order) > 0 and len(keep) < _MAX_DETECTIONS:
+        best = order[0]
+        keep.append(int(best))
+        rest = order[1:]
+        width = np.minimum(boxes[best,2],boxes[rest,2]) - np.maximum(boxes[best,0],boxes[rest,0])
+        height = np.minimum(boxes[best,3],boxes[rest,3]) - np.maximum(boxes[best,1],boxes[rest,1])
+        intersection = np.maximum(width,0.0) * np.maximum(height,0.0)
+        iou = intersection / (areas[best] + areas[rest] - intersection + 1e-9)
+        order = rest[iou <= iouThreshold]
+    return np.array(keep,dtype=np.intp)
+
+class InferenceBackend:
+    def infer(self, frame: cv2.Mat) -> np.ndarray:
+        """
+        :return: (N,6) detections as left, top, right, bottom, confidence, class, in the frame's pixel coordinates
+        """
+        return self.inferBatch([frame])[0]
+
+    def inferBatch(self, frames: List[cv2.Mat]) -> List[np.ndarray]:
+        """
+        Runs the model on several frames at once, which may have different shapes
+        :return: The detections of each frame, see infer()
+        """
+        raise NotImplementedError("InferenceBackend.inferBatch() must be implemented by subclasses.")
+
+    def getClassNames(self) -> Dict[int,str]:
+        return {}
+
+class UltralyticsBackend(InferenceBackend):
+    """
+    Runs the model through ultralytics, which accepts any model format it can export to, but pulls in torch
+    """
+    def __init__(self, model_path: str, confidenceThreshold: float = _CONFIDENCE_THRESHOLD, classes: Union[List[int],None] = None):
+        import ultralytics
+        self._model = ultralytics.YOLO(model_path,'detect')
+        self._confidenceThreshold = confidenceThreshold
+        self._classes = classes
+
+    def inferBatch(self, frames: List[cv2.Mat]) -> List[np.ndarray]:
+        results = self._model.predict(frames,conf=self._confidenceThreshold,classes=self._classes,verbose=False)
+        return [result.boxes.cpu().numpy().data.astype(np.float64) for result in results]
+
+    def getClassNames(self) -> Dict[int,str]:
+        return self._model.names
+
+class _Letterbox:
+    """
+    Scales frames of one shape into the middle of a square canvas, keeping their aspect ratio
+    """
+    def __init__(self, frameShape: Tuple[int,...], inputSize: int):
+        self.frameShape = frameShape
+        height, width = frameShape[:2]
+        self.scale = min(inputSize / height,inputSize / width)
+        scaledWidth, scaledHeight = round(width * self.scale), round(height * self.scale)
+        left, top = (inputSize - scaledWidth) // 2, (inputSize - scaledHeight) // 2
+        self.offset = np.array([left,top,left,top],dtype=np.float64)
+        self._canvas = np.full((inputSize,inputSize) + frameShape[2:],_PAD_VALUE,dtype=np.uint8)
+        self._region = self._canvas[top:top + scaledHeight,left:left + scaledWidth] # The border is only filled once
+
+    def fill(self, frame: cv2.Mat, tensor: np.ndarray) -> None:
+        """
+        Letterboxes the frame into a (3,size,size) slice of the input tensor, as RGB scaled to [0,1]
+        """
+        cv2.resize(frame,(self._region.shape[1],self._region.shape[0]),dst=self._region,interpolation=cv2.INTER_LINEAR)
+        if self._canvas.ndim == 3:
+            np.multiply(self._canvas.transpose(2,0,1)[::-1],1.0 / 255.0,out=tensor,casting="unsafe")
+        else:
+            # Grayscale frames are repeated across the three channels
+            np.multiply(self._canvas,1.0 / 255.0,out=tensor,casting="unsafe")
+
+class _LetterboxBackend(InferenceBackend):
+    """
+    Base of the backends that run an exported ONNX model directly. Frames are letterboxed in place into a preallocated input tensor,
+    and the raw (batch,4+classes,anchors) output of the model is decoded and filtered with a numpy NMS.
+    """
+    def __init__(self, inputSize: int, batchSize: Union[int,None], confidenceThreshold: float, classes: Union[List[int],None]):
+        """
+        :param batchSize: The model's fixed batch size, None if it accepts any batch size
+        :param confidenceThreshold: Anchors at or below this confidence are dropped before NMS
+        :param classes: Classes to detect, None detects every class
+        """
+        self._inputSize = inputSize
+        self._confidenceThreshold = confidenceThreshold
+        self._classes = np.array(classes,dtype=np.intp) if classes is not None else None
+        self._batchSize = batchSize
+        self._input = np.empty((batchSize or 1,3,inputSize,inputSize),dtype=np.float32)
+        self._letterboxes: Dict[Tuple[int,...],_Letterbox] = {} # One per frame shape, so cameras with different resolutions can share a batch
+
+    def _run(self, tensor: np.ndarray) -> np.ndarray:
+        raise NotImplementedError("_LetterboxBackend._run() must be implemented by subclasses.")
+
+    def inferBatch(self, frames: List[cv2.Mat]) -> List[np.ndarray]:
+        count = len(frames)
+        step = self._batchSize or count
+        capacity = -(-count // step) * step # Models with a fixed batch size get a padded tensor
+        if capacity > len(self._input):
+            self._input = np.empty((capacity,) + self._input.shape[1:],dtype=np.float32)
+        letterboxes: List[_Letterbox] = []
+        for index, frame in enumerate(frames):
+            if frame.ndim == 3 and frame.shape[2] == 1:
+                frame = frame.reshape(frame.shape[:2])
+            letterbox = self._letterboxes.get(frame.shape)
+            if letterbox is None:
+                letterbox = _Letterbox(frame.shape,self._inputSize)
+                self._letterboxes[frame.shape] = letterbox
+            letterbox.fill(frame,self._input[index])
+            letterboxes.append(letterbox)
+        outputs = [self._run(self._input[start:start + step]) for start in range(0,count,step)]
+        predictions = np.concatenate([output.reshape((-1,) + output.shape[-2:]) for output in outputs])
+        return [self._decode(predictions[index],letterboxes[index]) for index in range(count)]
+
+    def _decode(self, predictions: np.ndarray, letterbox: _Letterbox) -> np.ndarray:
+        """
+        :param predictions: (4+classes,anchors) raw output of the model for one frame
+        """
+        classScores = predictions[4:]
+        if self._classes is not None:
+            # Each anchor is labelled with its best allowed class, so other classes cannot outscore it
+            allowed = self._classes[self._classes < len(classScores)]
+            classScores = classScores[allowed]
+        classes = classScores.argmax(axis=0)
+        confidences = classScores[classes,np.arange(classScores.shape[1])]
+        candidates = np.flatnonzero(confidences > self._confidenceThreshold)
+        if len(candidates) == 0:
+            return np.empty((0,6))
+        if self._classes is not None:
+            classes = allowed[classes]
+        centers = predictions[:2,candidates].T.astype(np.float64)
+        halfSizes = predictions[2:4,candidates].T.astype(np.float64) / 2.0
+        boxes = np.concatenate((centers - halfSizes,centers + halfSizes),axis=1)
+        boxes -= letterbox.offset
+        boxes /= letterbox.scale
+        classes = classes[candidates]
+        confidences = confidences[candidates]
+        # Offsetting each class into its own region makes one NMS pass class-aware
+        keep = nms(boxes + (classes * (self._inputSize / letterbox.scale + 1.0))[:,None],confidences,_IOU_THRESHOLD)
+        height, width = letterbox.frameShape[:2]
+        detections = np.empty((len(keep),6))
+        detections[:,0:4:2] = np.clip(boxes[keep,0:4:2],0,width)
+        detections[:,1:4:2] = np.clip(boxes[keep,1:4:2],0,height)
+        detections[:,4] = confidences[keep]
+        detections[:,5] = classes[keep]
+        return detections
+
+class OnnxRuntimeBackend(_LetterboxBackend):
+    """
+    Runs an exported ONNX model on the CPU with ONNX Runtime. Batches are run in one call if the model was exported with a dynamic batch size
+    """
+    def __init__(self, model_path: str, inputSize: int, confidenceThreshold: float = _CONFIDENCE_THRESHOLD, classes: Union[List[int],None] = None):
+        import onnxruntime
+        self._session = onnxruntime.InferenceSession(model_path,providers=["CPUExecutionProvider"])
+        modelInput = self._session.get_inputs()[0]
+        self._inputName = modelInput.name
+        if isinstance(modelInput.shape[-1],int) and modelInput.shape[-1] != inputSize:
+            logger.warning("Model %s has a fixed input size of %d, ignoring the configured input size of %d",model_path,modelInput.shape[-1],inputSize)
+            inputSize = modelInput.shape[-1]
+        super().__init__(inputSize,modelInput.shape[0] if isinstance(modelInput.shape[0],int) else None,confidenceThreshold,classes)
+        # Models exported by ultralytics store their class names in the metadata
+        names = self._session.get_modelmeta().custom_metadata_map.get("names")
+        self._names: Dict[int,str] = ast.literal_eval(names) if names is not None else {}
+
+    def _run(self, tensor: np.ndarray) -> np.ndarray:
+        return self._session.run(None,{self._inputName: tensor})[0]
+
+    def getClassNames(self) -> Dict[int,str]:
+        return self._names
+
+class OpenCVDnnBackend(_LetterboxBackend):
+    """
+    Runs an exported ONNX model on the CPU with OpenCV's DNN module, which needs no extra dependencies.
+    OpenCV cannot read the model's metadata, so detections are labelled by class number, and batches are run one frame at a time
+    """
+    def __init__(self, model_path: str, inputSize: int, confidenceThreshold: float = _CONFIDENCE_THRESHOLD, classes: Union[List[int],None] = None):
+        super().__init__(inputSize,1,confidenceThreshold,classes)
+        self._net = cv2.dnn.readNetFromONNX(model_path)
+        self._net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        self._net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+
+    def _run(self, tensor: np.ndarray) -> np.ndarray:
+        self._net.setInput(tensor)
+        return self._net.forward()
+
+def createBackend(
+    name: str,
+    model_path: str,
+    inputSize: int = 640,
+    confidenceThreshold: float = _CONFIDENCE_THRESHOLD,
+    classes: Union[List[int],None] = None
+) -> InferenceBackend:
+    """
+    :param name: One of BACKENDS
+    :param inputSize: Side length of the square model input, for the ONNX backends
+    :param confidenceThreshold: Detections at or below this confidence are dropped
+    :param classes: Classes to detect, None detects every class
+    """
+    match name:
+        case "ultralytics":
+            return UltralyticsBackend(model_path,confidenceThreshold,classes)
+        case "onnxruntime":
+            return OnnxRuntimeBackend(model_path,inputSize,confidenceThreshold,classes)
+        case "opencv":
+            return OpenCVDnnBackend(model_path,inputSize,confidenceThreshold,classes)
+    raise ValueError(f"Unknown inference backend {name}, expected one of {BACKENDS}")
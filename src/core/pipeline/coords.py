@@ -21,7 +21,7 @@
 # SOFTWARE.
 
 import math
-from typing import List
+from typing import List, Tuple
 
 import numpy
 import numpy.typing
@@ -39,3 +39,42 @@ def openCvPoseToWpilib(tvec: numpy.typing.NDArray[numpy.float64], rvec: numpy.ty
 
 def wpilibTranslationToOpenCv(translation: Translation3d) -> List[float]:
     return [-translation.Y(), -translation.Z(), translation.X()]
+
+def _shepperdMatrix() -> Tuple[numpy.typing.NDArray[numpy.float64],numpy.typing.NDArray[numpy.float64]]:
+    """
+    :return: The linear map and offset taking a flattened rotation matrix to the flattened symmetric matrix used by rotationMatricesToQuaternions
+    """
+    terms = {
+        (0,0): ((0,1),(4,1),(8,1)),    # 1 + m00 + m11 + m22
+        (1,1): ((0,1),(4,-1),(8,-1)),  # 1 + m00 - m11 - m22
+        (2,2): ((0,-1),(4,1),(8,-1)),  # 1 - m00 + m11 - m22
+        (3,3): ((0,-1),(4,-1),(8,1)),  # 1 - m00 - m11 + m22
+        (0,1): ((7,1),(5,-1)),         # m21 - m12
+        (0,2): ((2,1),(6,-1)),         # m02 - m20
+        (0,3): ((3,1),(1,-1)),         # m10 - m01
+        (1,2): ((1,1),(3,1)),          # m01 + m10
+        (1,3): ((2,1),(6,1)),          # m02 + m20
+        (2,3): ((5,1),(7,1)),          # m12 + m21
+    }
+    matrix = numpy.zeros((9,4,4))
+    for (row, column), entry in terms.items():
+        for element, sign in entry:
+            matrix[element,row,column] = matrix[element,column,row] = sign
+    return matrix.reshape((9,16)), numpy.eye(4).ravel()
+
+_SHEPPERD_MATRIX, _SHEPPERD_OFFSET = _shepperdMatrix()
+
+def rotationMatricesToQuaternions(R: numpy.typing.NDArray[numpy.float64]) -> numpy.typing.NDArray[numpy.float64]:
+    """
+    Converts a batch of rotation matrices to unit quaternions. Each row of a symmetric matrix built from R is proportional to the quaternion,
+    the row with the largest diagonal entry is used as it is the best conditioned (Shepperd's method).
+    :param R: (...,3,3) rotation matrices
+    :return: (...,4) quaternions as w, x, y, z, with w >= 0
+    """
+    batchShape = R.shape[:-2]
+    K = (R.reshape((-1,9)) @ _SHEPPERD_MATRIX + _SHEPPERD_OFFSET).reshape((-1,4,4))
+    case = numpy.argmax(K.reshape((-1,16))[:,::5],axis=-1)
+    q = K[numpy.arange(len(K)),case]
+    # Normalize, and flip the sign so that w >= 0
+    q *= numpy.copysign(1.0 / numpy.sqrt(numpy.sum(q * q,axis=-1,keepdims=True)),q[:,:1])
+    return q.reshape(batchShape + (4,))
@@ -23,13 +23,52 @@
 import robotpy_apriltag as apriltag
 import numpy as np
 import cv2
-from wpimath.geometry import *
-from typing import List, Union
-from utils.vtypes import Fiducial, NTagPoseResult, SingleTagPoseResult
-from pipeline.coords import wpilibTranslationToOpenCv, openCvPoseToWpilib
+from typing import Dict, List, Tuple, Union
+from utils.vtypes import Fiducial, FiducialBatch, NTagPoseResult, SingleTagPoseResult
+from pipeline import transforms
 from configuration.config_types import *
 from configuration import Field
 
+def _poseDistance(a: np.ndarray, b: np.ndarray) -> float:
+    """
+    Rough distance between two poses, meters of translation plus radians of rotation
+    """
+    relative = transforms.invert(b) @ a
+    return float(np.linalg.norm(relative[:3,3]) + transforms.rotationAngles(relative))
+
+class SolveContext:
+    """
+    Memoizes single tag solutions within a frame, keyed by tag id and corners, so that a tag seen by both solvers is only solved once.
+    Reset it at the start of every frame.
+    """
+    def __init__(self):
+        self._solutions: Dict[Tuple[int,bytes],Union[SingleTagPoseResult,None]] = {}
+        self._hits: int = 0
+        self._lookups: int = 0
+
+    def reset(self) -> None:
+        self._solutions.clear()
+
+    def lookup(self, id: int, corners: np.ndarray) -> Tuple[bool,Union[SingleTagPoseResult,None]]:
+        """
+        :return: Whether the tag has already been solved this frame, and its solution (None if it failed to solve)
+        """
+        self._lookups += 1
+        key = (id,corners.tobytes())
+        if key not in self._solutions:
+            return False, None
+        self._hits += 1
+        return True, self._solutions[key]
+
+    def store(self, id: int, corners: np.ndarray, result: Union[SingleTagPoseResult,None]) -> None:
+        self._solutions[(id,corners.tobytes())] = result
+
+    def getStats(self) -> Tuple[int,int]:
+        """
+        :return: Total number of cache hits and lookups
+        """
+        return self._hits, self._lookups
+
 #TODO: Figure out the apriltag axes
 class GeneralPnPSolver():
     '''
@@ -43,94 +82,81 @@ class GeneralPnPSolver():
     ):
         self._intrinsics = intrinsics
         self._ignorelist = ignorelist #list of tag ids to ignore
+        self._idealIntrinsics = CameraIntrinsics(intrinsics.matrix,np.zeros(5)) # Describes corners that have already been undistorted
+        self._tagSolver = FiducialPnPSolver(intrinsics) # Solves the single tag case
+
+        # Temporal mode state
+        self._temporal: bool = False
+        self._maxSwapError: float = 2.0
+        self._lastPose: Union[np.ndarray,None] = None # Field to camera transform from the previous frame
+
+    def setTemporal(self, enabled: bool, maxError: float = 2.0) -> None:
+        """
+        Enables or disables temporal mode. In temporal mode, single tag solves keep the IPPE ambiguity that is consistent with
+        the previous frame's pose as the primary solution, instead of letting it flip whenever the reprojection errors are close.
+        :param maxError: Largest RMS reprojection error, in pixels, of a secondary solution that can be promoted for its continuity with the previous frame
+        """
+        self._temporal = enabled
+        self._maxSwapError = maxError
+        self._lastPose = None
     
-    def solve(self,fiducials: List[Fiducial]) -> Union[NTagPoseResult,None]:
+    def solve(self,fiducials: FiducialBatch,context: Union[SolveContext,None] = None) -> Union[NTagPoseResult,None]:
         """
         Solves the Perspective-n-Point problem using the fiducials detected by the camera.
-        :param fiducials: List of Fiducial detections
+        :param fiducials: Batch of Fiducial detections
+        :param context: The frame's solve context, a single tag that was already solved this frame is not solved again
         """
-        object_points: List[float] = []
-        tag_ids: List[int] = []
-        tag_poses: List[Pose3d] = []
-        image_points: List[float] = []
-        
-        for fiducial in fiducials:
-            fid_pose: Pose3d = None
-            if fiducial.id in [tag.ID for tag in Field.getLayout().getTags()]:
-                fid_pose = Field.getLayout().getTagPose(fiducial.id)
-            if fid_pose != None:
-                corner_0 = fid_pose + Transform3d(Translation3d(0, Field.getTagSize() / 2.0, -Field.getTagSize() / 2.0), Rotation3d())
-                corner_1 = fid_pose + Transform3d(Translation3d(0, -Field.getTagSize() / 2.0, -Field.getTagSize() / 2.0), Rotation3d())
-                corner_2 = fid_pose + Transform3d(Translation3d(0, -Field.getTagSize() / 2.0, Field.getTagSize() / 2.0), Rotation3d())
-                corner_3 = fid_pose + Transform3d(Translation3d(0, Field.getTagSize() / 2.0, Field.getTagSize() / 2.0), Rotation3d())
-                object_points += [
-                    wpilibTranslationToOpenCv(corner_0.translation()),
-                    wpilibTranslationToOpenCv(corner_1.translation()),
-                    wpilibTranslationToOpenCv(corner_2.translation()),
-                    wpilibTranslationToOpenCv(corner_3.translation()),
-                ]
-                image_points += [
-                    [fiducial.corners[0][0], fiducial.corners[0][1]],
-                    [fiducial.corners[1][0], fiducial.corners[1][1]],
-                    [fiducial.corners[2][0], fiducial.corners[2][1]],
-                    [fiducial.corners[3][0], fiducial.corners[3][1]],
-                ]
-                tag_ids.append(fiducial.id)
-                tag_poses.append(fid_pose)
-        if len(tag_ids) == 0:
-            return None
-        elif len(tag_ids) == 1:
-            object_points = np.array(
-                [
-                    [-Field.getTagSize() / 2.0, Field.getTagSize() / 2.0, 0],
-                    [Field.getTagSize() / 2.0, Field.getTagSize() / 2.0, 0],
-                    [Field.getTagSize() / 2.0, -Field.getTagSize() / 2.0, 0],
-                    [-Field.getTagSize() / 2.0, -Field.getTagSize() / 2.0, 0],
-                ]
+        rows = Field.getTagRows(fiducials.ids)
+        used = rows >= 0
+        if len(self._ignorelist) > 0:
+            used &= ~np.isin(fiducials.ids,self._ignorelist)
+        result = None
+        if np.count_nonzero(used) == 1:
+            index = int(np.flatnonzero(used)[0])
+            tagResult = self._tagSolver.solve(fiducials[index],context)
+            if tagResult is not None:
+                result = self._fromTagResult(int(rows[index]),tagResult)
+        elif fiducials.undistorted is not None and used.any():
+            result = self._solveMulti(rows[used],fiducials.undistorted[used].reshape((-1,2)),self._idealIntrinsics)
+        elif used.any():
+            result = self._solveMulti(rows[used],fiducials.corners[used].reshape((-1,2)),self._intrinsics)
+        if self._temporal:
+            if result is not None and result.field_pose_1 is not None and self._lastPose is not None:
+                result = self._disambiguate(result)
+            self._lastPose = result.field_pose_0 if result is not None else None
+        return result
+
+    def _disambiguate(self, result: NTagPoseResult) -> NTagPoseResult:
+        """
+        Makes the solution closest to the previous frame's pose the primary one, if it fits the detections well enough
+        """
+        if result.error_1 > self._maxSwapError or _poseDistance(result.field_pose_1,self._lastPose) >= _poseDistance(result.field_pose_0,self._lastPose):
+            return result
+        return NTagPoseResult(result.field_pose_1, result.error_1, result.field_pose_0, result.error_0)
+
+    def _fromTagResult(self, row: int, result: SingleTagPoseResult) -> NTagPoseResult:
+        """
+        Converts both camera to tag solutions of a single tag to field to camera poses
+        """
+        field_to_camera = Field.getTagTransforms()[row] @ transforms.invert(np.stack((result.tag_pose_0,result.tag_pose_1)))
+        return NTagPoseResult(field_to_camera[0], result.error_0, field_to_camera[1], result.error_1)
+
+    def _solveMulti(self, rows: np.ndarray, image_points: np.ndarray, intrinsics: CameraIntrinsics) -> Union[NTagPoseResult,None]:
+        # Solve for multiple tags
+        try:
+            _, rvecs, tvecs, errors = cv2.solvePnPGeneric(
+                Field.getFieldCorners()[rows].reshape((-1,3)),
+                image_points,
+                intrinsics.matrix,
+                intrinsics.dist_coeffs,
+                flags=cv2.SOLVEPNP_SQPNP
             )
-            try:
-                _, rvecs, tvecs, errors = cv2.solvePnPGeneric(
-                    object_points,
-                    np.array(image_points),
-                    self._intrinsics.matrix,
-                    self._intrinsics.dist_coeffs,
-                    flags=cv2.SOLVEPNP_IPPE_SQUARE
-                )
-            except:
-                return None
-           
-            # Calculate WPILib camera poses
-            field_to_tag_pose = tag_poses[0]
-            camera_to_tag_pose_0 = openCvPoseToWpilib(tvecs[0], rvecs[0])
-            camera_to_tag_pose_1 = openCvPoseToWpilib(tvecs[1], rvecs[1])
-            camera_to_tag_0 = Transform3d(camera_to_tag_pose_0.translation(), camera_to_tag_pose_0.rotation())
-            camera_to_tag_1 = Transform3d(camera_to_tag_pose_1.translation(), camera_to_tag_pose_1.rotation())
-            field_to_camera_0 = field_to_tag_pose.transformBy(camera_to_tag_0.inverse())
-            field_to_camera_1 = field_to_tag_pose.transformBy(camera_to_tag_1.inverse())
-            field_to_camera_pose_0 = Pose3d(field_to_camera_0.translation(), field_to_camera_0.rotation())
-            field_to_camera_pose_1 = Pose3d(field_to_camera_1.translation(), field_to_camera_1.rotation())
-            # Return result
-            return NTagPoseResult(field_to_camera_pose_0, errors[0][0], field_to_camera_pose_1, errors[1][0])
-        else:
-            # Solve for multiple tags
-            try:
-                _, rvecs, tvecs, errors = cv2.solvePnPGeneric(
-                    np.array(object_points),
-                    np.array(image_points),
-                    self._intrinsics.matrix,
-                    self._intrinsics.dist_coeffs,
-                    flags=cv2.SOLVEPNP_SQPNP
-                )
-            except:
-                return None
-            
-            # Calculate WPILib camera poses
-            camera_to_field_pose = openCvPoseToWpilib(tvecs[0], rvecs[0])
-            camera_to_field = Transform3d(camera_to_field_pose.translation(), camera_to_field_pose.rotation())
-            field_to_camera = camera_to_field.inverse()
-            field_to_camera_pose = Pose3d(field_to_camera.translation(), field_to_camera.rotation())
-            
-            return NTagPoseResult(field_to_camera_pose, errors[0][0], None, None)
+        except:
+            return None
+        
+        # Calculate the WPILib camera pose
+        camera_to_field = transforms.openCvToWpilib(transforms.fromRvecTvec(rvecs[0], tvecs[0]))
+        return NTagPoseResult(transforms.invert(camera_to_field), errors[0][0], None, None)
 
 class FiducialPnPSolver():
     '''
@@ -141,44 +167,103 @@ class FiducialPnPSolver():
         intrinsics: CameraIntrinsics
     ):
         self._intrinsics = intrinsics
+        self._idealIntrinsics = CameraIntrinsics(intrinsics.matrix,np.zeros(5)) # Describes corners that have already been undistorted
     
-    def solve(self,fiducial: Fiducial) -> Union[SingleTagPoseResult,None]:
-        object_points = np.array(
-            [
-                [-Field.getTagSize() / 2.0, Field.getTagSize() / 2.0, 0],
-                [Field.getTagSize() / 2.0, Field.getTagSize() / 2.0, 0],
-                [Field.getTagSize() / 2.0, -Field.getTagSize() / 2.0, 0],
-                [-Field.getTagSize() / 2.0, -Field.getTagSize() / 2.0, 0],
-            ]
-        )
-        try:
-            _, rvecs, tvecs, errors = cv2.solvePnPGeneric(
-                object_points,
-                fiducial.corners,
-                self._intrinsics.matrix,
-                self._intrinsics.dist_coeffs,
-                flags=cv2.SOLVEPNP_IPPE_SQUARE
-            )
-        except:
-            return None
-          
+    def solve(self,fiducial: Fiducial,context: Union[SolveContext,None] = None) -> Union[SingleTagPoseResult,None]:
+        """
+        :param context: The frame's solve context, the tag is only solved if it has not been solved this frame
+        """
+        if context is None:
+            return self._solveOne(fiducial)
+        found, result = context.lookup(fiducial.id,fiducial.corners)
+        if not found:
+            result = self._solveOne(fiducial)
+            context.store(fiducial.id,fiducial.corners,result)
+        return result
+
+    def solveBatch(self,fiducials: FiducialBatch,context: Union[SolveContext,None] = None) -> List[SingleTagPoseResult]:
+        """
+        Solves every tag in a batch, tags that fail to solve are left out.
+        :param context: The frame's solve context, only tags that have not been solved this frame are solved
+        """
+        if context is None:
+            results = self._solveAll(fiducials)
+        else:
+            lookups = [context.lookup(int(fiducials.ids[index]),fiducials.corners[index]) for index in range(len(fiducials))]
+            results = [result for _, result in lookups]
+            missing = [index for index, (found, _) in enumerate(lookups) if not found]
+            if len(missing) > 0:
+                solved = self._solveAll(fiducials if len(missing) == len(fiducials) else fiducials.select(missing))
+                for index, result in zip(missing,solved):
+                    context.store(int(fiducials.ids[index]),fiducials.corners[index],result)
+                    results[index] = result
+        return [result for result in results if result is not None]
+
+    def _solveOne(self, fiducial: Fiducial) -> Union[SingleTagPoseResult,None]:
+        return self._solveAll(FiducialBatch(
+            np.array([fiducial.id],dtype=np.int32),
+            np.asarray(fiducial.corners,dtype=np.float64).reshape((1,4,2)),
+            np.array([fiducial.decisionMargin],dtype=np.float64),
+            np.array([fiducial.hammingDist],dtype=np.int32),
+            np.reshape(fiducial.undistorted,(1,4,2)) if fiducial.undistorted is not None else None
+        ))[0]
+
+    def _solveAll(self,fiducials: FiducialBatch) -> List[Union[SingleTagPoseResult,None]]:
+        """
+        :return: The solution for each tag in the batch, None for tags that failed to solve
+        """
+        if fiducials.undistorted is not None:
+            corners, intrinsics = fiducials.undistorted, self._idealIntrinsics
+        else:
+            corners, intrinsics = fiducials.corners, self._intrinsics
+        rvecs, tvecs, errors = self._solveEach(corners,intrinsics)
         # Convert to WPILib coordinate system (Does NOT transform to the field frame)
-        camera_to_tag_pose_0 = openCvPoseToWpilib(tvecs[0], rvecs[0])
-        camera_to_tag_pose_1 = openCvPoseToWpilib(tvecs[1], rvecs[1])
-        # Return result
-        return SingleTagPoseResult(
-            fiducial.id,
-            fiducial.corners,
-            fiducial.decisionMargin,
-            fiducial.hammingDist,
-            np.linalg.norm(tvecs[0] if errors[0][0] <= errors[1][0] else tvecs[1]),
-            rvecs[0],
-            tvecs[0],
-            camera_to_tag_pose_0,
-            errors[0][0],
-            rvecs[1],
-            tvecs[1],
-            camera_to_tag_pose_1,
-            errors[1][0]
-        )
+        tag_poses = transforms.openCvToWpilib(transforms.fromRvecTvec(rvecs,tvecs))
+        best = (errors[:,1] < errors[:,0]).astype(np.intp)
+        distances = np.linalg.norm(tvecs[np.arange(len(fiducials)),best,:,0],axis=1)
+        results: List[Union[SingleTagPoseResult,None]] = [None] * len(fiducials)
+        for index in np.flatnonzero(np.isfinite(errors).all(axis=1)).tolist():
+            results[index] = SingleTagPoseResult(
+                int(fiducials.ids[index]),
+                fiducials.corners[index],
+                float(fiducials.decisionMargins[index]),
+                int(fiducials.hammingDists[index]),
+                float(distances[index]),
+                rvecs[index,0],
+                tvecs[index,0],
+                tag_poses[index,0],
+                float(errors[index,0]),
+                rvecs[index,1],
+                tvecs[index,1],
+                tag_poses[index,1],
+                float(errors[index,1])
+            )
+        return results
 
+    def _solveEach(self, corners: np.ndarray, intrinsics: CameraIntrinsics) -> Tuple[np.ndarray,np.ndarray,np.ndarray]:
+        """
+        Solves the tags one at a time with OpenCV
+        :param corners: (N,4,2) pixel coordinates of each tag's corners
+        :return: (N,2,3,1) rotation and translation vectors of both IPPE solutions of each tag, best first, and their (N,2) reprojection errors, NaN for tags that failed to solve
+        """
+        object_points = Field.getTagCorners()
+        rvecs = np.zeros((len(corners),2,3,1))
+        tvecs = np.zeros((len(corners),2,3,1))
+        errors = np.full((len(corners),2),np.nan)
+        for index in range(len(corners)):
+            try:
+                _, tagRvecs, tagTvecs, tagErrors = cv2.solvePnPGeneric(
+                    object_points,
+                    corners[index],
+                    intrinsics.matrix,
+                    intrinsics.dist_coeffs,
+                    flags=cv2.SOLVEPNP_IPPE_SQUARE
+                )
+            except:
+                continue
+            if len(tagRvecs) < 2:
+                continue
+            rvecs[index] = tagRvecs[:2]
+            tvecs[index] = tagTvecs[:2]
+            errors[index] = tagErrors[:2,0]
+        return rvecs, tvecs, errors
@@ -0,0 +1,141 @@
+# Copyright (c) FRC 1076 PiHi Samurai
+# You may use, distribute, and modify this software under the terms of
+# the license found in the root directory of this project
+
+import os
+import logging
+import tempfile
+import threading
+import cv2
+import numpy as np
+from typing import Dict, List, Union
+from pipeline import backends
+
+logger = logging.getLogger(__name__)
+
+# Post-training quantization of exported ONNX detection models with ONNX Runtime's quantization tools.
+# "int8" quantizes the convolutions' weights and activations, with activation ranges calibrated on representative frames.
+# "int8-dynamic" only quantizes weights ahead of time, and computes activation ranges at runtime, so it needs no calibration frames.
+# The detection head's activations (sigmoids, box decoding) always stay in floating point, box coordinates and class scores do not share a range well.
+
+QUANTIZATIONS: List[str] = ["none","int8","int8-dynamic"]
+
+_MAX_CALIBRATION_FRAMES = 200
+_QUANTIZED_OPS = ["Conv","MatMul"]
+
+_locks: Dict[str,threading.Lock] = {} # One per output path, so pipelines sharing a model quantize it once
+_locksLock = threading.Lock()
+
+def loadFrames(directory: str, limit: Union[int,None] = None) -> List[cv2.Mat]:
+    """
+    :return: Every image in the directory that OpenCV can read, in name order
+    """
+    frames: List[cv2.Mat] = []
+    for name in sorted(os.listdir(directory)):
+        if limit is not None and len(frames) >= limit:
+            break
+        image = cv2.imread(os.path.join(directory,name))
+        if image is not None:
+            frames.append(image)
+    return frames
+
+def _calibrationReader(inputName: str, frames: List[cv2.Mat], inputSize: int, batchSize: int):
+    from onnxruntime.quantization import CalibrationDataReader
+    class CalibrationReader(CalibrationDataReader):
+        """
+        Feeds frames to the calibrator letterboxed exactly as the inference backends do
+        """
+        def __init__(self):
+            self._next = 0
+            self._letterboxes: Dict[tuple,backends._Letterbox] = {}
+
+        def get_next(self) -> Union[Dict[str,np.ndarray],None]:
+            if self._next + batchSize > len(frames):
+                return None
+            tensor = np.empty((batchSize,3,inputSize,inputSize),dtype=np.float32)
+            for index in range(batchSize):
+                frame = frames[self._next + index]
+                letterbox = self._letterboxes.get(frame.shape)
+                if letterbox is None:
+                    letterbox = backends._Letterbox(frame.shape,inputSize)
+                    self._letterboxes[frame.shape] = letterbox
+                letterbox.fill(frame,tensor[index])
+            self._next += batchSize
+            return {inputName: tensor}
+    return CalibrationReader()
+
+def quantizeModel(model_path: str, output_path: str, quantization: str, calibrationFrames: Union[str,None] = None, inputSize: int = 640) -> None:
+    """
+    Quantizes an exported ONNX model
+    :param quantization: One of QUANTIZATIONS other than "none"
+    :param calibrationFrames: Directory of representative frames, needed by "int8"
+    :param inputSize: Side length of the model input, used if the model was exported with a dynamic input size
+    """
+    import onnxruntime
+    from onnxruntime import quantization as ortq
+    if quantization not in QUANTIZATIONS[1:]:
+        raise ValueError(f"Unknown quantization {quantization}, expected one of {QUANTIZATIONS[1:]}")
+    with tempfile.TemporaryDirectory() as tmp:
+        # Shape inference and graph optimization beforehand let the quantizer cover more of the graph
+        preprocessed = os.path.join(tmp,"preprocessed.onnx")
+        try:
+            try:
+                ortq.quant_pre_process(model_path,preprocessed)
+            except ImportError:
+                # Symbolic shape inference needs sympy, models exported with a fixed input size do without it
+                ortq.quant_pre_process(model_path,preprocessed,skip_symbolic_shape=True)
+        except Exception as e:
+            logger.warning("Unable to preprocess %s for quantization, quantizing it as is: %s",model_path,e)
+            preprocessed = model_path
+        if quantization == "int8-dynamic":
+            ortq.quantize_dynamic(preprocessed,output_path,op_types_to_quantize=_QUANTIZED_OPS,weight_type=ortq.QuantType.QUInt8)
+            return
+        if calibrationFrames is None:
+            raise ValueError("int8 quantization needs a directory of calibration frames")
+        frames = loadFrames(calibrationFrames,_MAX_CALIBRATION_FRAMES)
+        modelInput = onnxruntime.InferenceSession(model_path,providers=["CPUExecutionProvider"]).get_inputs()[0]
+        batchSize = modelInput.shape[0] if isinstance(modelInput.shape[0],int) else 1
+        if isinstance(modelInput.shape[-1],int):
+            inputSize = modelInput.shape[-1]
+        if len(frames) < batchSize:
+            raise ValueError(f"No calibration frames found in {calibrationFrames}")
+        logger.info("Calibrating %s on %d frames",model_path,len(frames))
+        ortq.quantize_static(
+            preprocessed,
+            output_path,
+            _calibrationReader(modelInput.name,frames,inputSize,batchSize),
+            quant_format=ortq.QuantFormat.QDQ,
+            op_types_to_quantize=_QUANTIZED_OPS,
+            per_channel=True,
+            activation_type=ortq.QuantType.QUInt8,
+            weight_type=ortq.QuantType.QInt8,
+            calibrate_method=ortq.CalibrationMethod.MinMax
+        )
+
+def getQuantizedModel(model_path: str, quantization: str, calibrationFrames: Union[str,None] = None, inputSize: int = 640) -> str:
+    """
+    Returns the path of a quantized version of an ONNX model, loading it from output/models/ or quantizing and storing it there if it is missing or
+    older than the model. Quantizing with calibration can take minutes, delete the stored model to recalibrate with new frames.
+    :param quantization: One of QUANTIZATIONS, "none" returns the model itself
+    """
+    if quantization == "none":
+        return model_path
+    stem = os.path.splitext(os.path.basename(model_path))[0]
+    path = f"output/models/{stem}_{quantization}_{inputSize}.onnx"
+    with _locksLock:
+        lock = _locks.setdefault(path,threading.Lock())
+    with lock:
+        if os.path.isfile(path) and os.path.getmtime(path) >= os.path.getmtime(model_path):
+            return path
+        logger.info("Quantizing %s to %s",model_path,quantization)
+        os.makedirs(os.path.dirname(path),exist_ok=True)
+        # Quantized next to the final path and moved into place once complete, so no process ever loads a partially written model
+        fd, tmpPath = tempfile.mkstemp(suffix=".onnx",dir=os.path.dirname(path))
+        os.close(fd)
+        try:
+            quantizeModel(model_path,tmpPath,quantization,calibrationFrames,inputSize)
+            os.replace(tmpPath,path)
+        finally:
+            if os.path.exists(tmpPath):
+                os.remove(tmpPath)
+    return path
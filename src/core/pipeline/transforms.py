@@ -0,0 +1,100 @@
+# Copyright (c) FRC 1076 PiHi Samurai
+# You may use, distribute, and modify this software under the terms of
+# the license found in the root directory of this project
+
+import numpy as np
+from wpimath.geometry import Pose3d, Quaternion, Rotation3d, Translation3d
+from pipeline.coords import rotationMatricesToQuaternions
+
+# Rigid transforms as (...,4,4) homogeneous matrices, so that poses can be converted, composed, and inverted in batches
+# without creating wpimath objects. Convert to Pose3d only at the edges, where an API needs one.
+
+# Maps OpenCV axes (x right, y down, z forward) onto WPILib axes (x forward, y left, z up)
+_OPENCV_TO_WPILIB = np.array([
+    [0.0,0.0,1.0,0.0],
+    [-1.0,0.0,0.0,0.0],
+    [0.0,-1.0,0.0,0.0],
+    [0.0,0.0,0.0,1.0]
+])
+
+_IDENTITY = np.eye(3)
+
+# Maps a vector r onto its flattened cross product matrix K, with K @ v = r x v
+_CROSS = np.array([
+    [0.0,0.0,0.0,0.0,0.0,-1.0,0.0,1.0,0.0],
+    [0.0,0.0,1.0,0.0,0.0,0.0,-1.0,0.0,0.0],
+    [0.0,-1.0,0.0,1.0,0.0,0.0,0.0,0.0,0.0]
+])
+
+def fromRvecTvec(rvecs: np.ndarray, tvecs: np.ndarray) -> np.ndarray:
+    """
+    Builds transforms from OpenCV rotation and translation vectors
+    :param rvecs: (...,3) or (...,3,1) axis-angle rotation vectors
+    :param tvecs: Translation vectors, same shape as rvecs
+    :return: (...,4,4) transforms
+    """
+    batchShape = rvecs.shape[:-2] if rvecs.shape[-1] == 1 else rvecs.shape[:-1]
+    r = np.asarray(rvecs,dtype=np.float64).reshape((-1,3))
+    # Rodrigues' formula, R = I + a*K + b*K^2 with a = sin(angle)/angle and b = (1 - cos(angle))/angle^2, where K is the cross product matrix of r.
+    # K^2 = r*r^T - angle^2*I, and both coefficients are written in terms of sin(h)/h with h = angle/2,
+    # which is clamped away from zero so that it tends to 1 instead of 0/0.
+    squared = (r * r).sum(axis=1)
+    half = np.maximum(0.5 * np.sqrt(squared),1e-300)
+    sinc = np.sin(half) / half
+    a = (sinc * np.cos(half))[:,None,None]
+    b = (0.5 * sinc * sinc)[:,None,None]
+    T = np.empty((len(r),4,4))
+    T[:,:3,:3] = a * (r @ _CROSS).reshape((-1,3,3)) + b * (r[:,:,None] * r[:,None,:]) + (1.0 - b * squared[:,None,None]) * _IDENTITY
+    T[:,:3,3] = np.reshape(tvecs,(-1,3))
+    T[:,3,:] = (0.0,0.0,0.0,1.0)
+    return T.reshape(batchShape + (4,4))
+
+def openCvToWpilib(T: np.ndarray) -> np.ndarray:
+    """
+    Re-expresses transforms between OpenCV frames in WPILib axes, equivalent to coords.openCvPoseToWpilib
+    """
+    return _OPENCV_TO_WPILIB @ T @ _OPENCV_TO_WPILIB.T
+
+def invert(T: np.ndarray) -> np.ndarray:
+    """
+    Inverts rigid transforms
+    """
+    inverse = np.zeros(T.shape)
+    Rt = np.swapaxes(T[...,:3,:3],-1,-2)
+    inverse[...,:3,:3] = Rt
+    inverse[...,:3,3] = -(Rt @ T[...,:3,3,None])[...,0]
+    inverse[...,3,3] = 1.0
+    return inverse
+
+def rotationAngles(T: np.ndarray) -> np.ndarray:
+    """
+    :return: (...) angle of each transform's rotation, in radians
+    """
+    cosAngle = (np.trace(T[...,:3,:3],axis1=-2,axis2=-1) - 1.0) / 2.0
+    return np.arccos(np.clip(cosAngle,-1.0,1.0))
+
+def toTranslationQuaternions(T: np.ndarray) -> np.ndarray:
+    """
+    :return: (...,7) translations and rotation quaternions, as x, y, z, qw, qx, qy, qz
+    """
+    return np.concatenate((T[...,:3,3],rotationMatricesToQuaternions(T[...,:3,:3])),axis=-1)
+
+def fromPose3d(pose: Pose3d) -> np.ndarray:
+    """
+    :return: (4,4) transform equivalent to the pose
+    """
+    q = pose.rotation().getQuaternion()
+    w, x, y, z = q.W(), q.X(), q.Y(), q.Z()
+    return np.array([
+        [1.0 - 2.0 * (y * y + z * z), 2.0 * (x * y - w * z), 2.0 * (x * z + w * y), pose.X()],
+        [2.0 * (x * y + w * z), 1.0 - 2.0 * (x * x + z * z), 2.0 * (y * z - w * x), pose.Y()],
+        [2.0 * (x * z - w * y), 2.0 * (y * z + w * x), 1.0 - 2.0 * (x * x + y * y), pose.Z()],
+        [0.0, 0.0, 0.0, 1.0]
+    ])
+
+def toPose3d(T: np.ndarray) -> Pose3d:
+    """
+    :param T: A single (4,4) transform
+    """
+    x, y, z, qw, qx, qy, qz = toTranslationQuaternions(T).tolist()
+    return Pose3d(Translation3d(x,y,z),Rotation3d(Quaternion(qw,qx,qy,qz)))
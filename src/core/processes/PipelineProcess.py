@@ -0,0 +1,287 @@
+# Copyright (c) FRC 1076 PiHi Samurai
+# You may use, distribute, and modify this software under the terms of
+# the license found in the root directory of this project
+
+import multiprocessing
+import multiprocessing.connection
+from multiprocessing import shared_memory
+import numpy as np
+import cv2
+import logging
+import traceback
+from typing import List, Tuple, Union
+from configuration.config_types import PipelineConfig, CameraIntrinsics
+from configuration.configsources import ConfigParser
+from network.ntmanager import serializeApriltagResult, serializeObjDetectResults
+from pipeline import Pipeline
+from pipeline.Undistorter import Undistorter
+from utils.vtypes import SerializedPipelineResult
+from utils.misc import pinThread
+from utils.bufferpool import BufferPool
+
+logger = logging.getLogger(__name__)
+
+# Runs a pipeline in a child process, so that the python parts of the pipeline do not contend for the GIL with the other pipelines.
+# Frames and results are handed off through shared memory, only small control messages go through the pipe.
+# Every shared memory block is owned (created and unlinked) by the side that writes to it.
+
+_CMD_ATTACH = 0 # Parent has (re)allocated the input frame buffer
+_CMD_PROCESS = 1
+_CMD_BENCHMARK = 2
+_CMD_STOP = 3
+
+_MSG_READY = 0
+_MSG_RESULT = 1
+_MSG_ERROR = 2
+
+_RESULT_CAPACITY = 8192 # Maximum number of doubles in a serialized result, ~300 apriltag detections
+
+_ctx = multiprocessing.get_context("spawn") # Forking a process with running cscore/ntcore threads is not safe
+
+class _SharedArray:
+    """
+    A numpy array backed by a named shared memory block
+    """
+    def __init__(self, shm: shared_memory.SharedMemory, shape: Tuple[int,...], dtype: str, owner: bool):
+        self._shm = shm
+        self._owner = owner
+        self.shape = shape
+        self.dtype = dtype
+        self.array = np.ndarray(shape,dtype=np.dtype(dtype),buffer=shm.buf)
+
+    @classmethod
+    def create(cls, shape: Tuple[int,...], dtype: str) -> "_SharedArray":
+        size = max(int(np.prod(shape)) * np.dtype(dtype).itemsize,1)
+        return cls(shared_memory.SharedMemory(create=True,size=size),tuple(shape),dtype,True)
+
+    @classmethod
+    def attach(cls, name: str, shape: Tuple[int,...], dtype: str) -> "_SharedArray":
+        # The attaching side must not register the block with its resource tracker, otherwise it gets unlinked when that side exits
+        return cls(shared_memory.SharedMemory(name=name,track=False),tuple(shape),dtype,False)
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    def matches(self, arr: np.ndarray) -> bool:
+        return self.shape == arr.shape and np.dtype(self.dtype) == arr.dtype
+
+    def close(self) -> None:
+        if self.array is None:
+            return # Already closed
+        self.array = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+class PipelineProcess:
+    """
+    A proxy with the same process/deepBenchmark interface as Pipeline, which runs the actual pipeline in a child process.
+    Results are returned pre-serialized, as the child already does the networktables serialization work.
+    """
+    def __init__(self, config: PipelineConfig, intrinsics: CameraIntrinsics, cpus: Union[List[int],None] = None, undistorter: Union[Undistorter,None] = None):
+        self.name = config.name
+        self._conn, childConn = _ctx.Pipe()
+        self._process = _ctx.Process(
+            target=_run,
+            args=(config.name,config.configFile,intrinsics,cpus,undistorter,childConn),
+            name=f"{config.name}_process",
+            daemon=True
+        )
+        self._process.start()
+        childConn.close()
+        self._inFrame: Union[_SharedArray,None] = None
+        self._outFrame: Union[_SharedArray,None] = None
+        self._pool = BufferPool()
+        self._detectorSettings: Union[Tuple[float,float,int],None] = None
+        self._rejections: Union[Tuple[int,...],None] = None
+        self._solveCacheStats: Union[Tuple[int,int],None] = None
+        self._released: bool = False
+        try:
+            msg = self._conn.recv()
+        except EOFError:
+            msg = (_MSG_ERROR,"the process exited before it was ready")
+        if msg[0] != _MSG_READY:
+            # Nothing else holds the child, it has to be cleaned up here
+            self._process.kill()
+            self._process.join(timeout=1.0)
+            self._conn.close()
+            raise RuntimeError(f"Pipeline process {self.name} failed to start: {msg[1]}")
+        self._results = _SharedArray.attach(msg[1],(_RESULT_CAPACITY,),"float64")
+        logger.info("Started pipeline process %s (pid %d)",self.name,self._process.pid)
+
+    def getPid(self) -> int:
+        return self._process.pid
+
+    def getDetectorSettings(self) -> Union[Tuple[float,float,int],None]:
+        """
+        :return: The child pipeline's detector settings as of the last result
+        """
+        return self._detectorSettings
+
+    def getRejections(self) -> Union[Tuple[int,...],None]:
+        """
+        :return: The child pipeline's filter rejection counts as of the last result
+        """
+        return self._rejections
+
+    def getSolveCacheStats(self) -> Union[Tuple[int,int],None]:
+        """
+        :return: The child pipeline's solve cache hits and lookups as of the last result
+        """
+        return self._solveCacheStats
+
+    def setBufferPool(self, pool: BufferPool) -> None:
+        """
+        Sets the pool that output frames are copied into
+        """
+        self._pool = pool
+
+    def isAlive(self) -> bool:
+        return self._process.is_alive()
+
+    def _sendFrame(self, frame: cv2.Mat, cmd: int) -> None:
+        if self._inFrame is None or not self._inFrame.matches(frame):
+            if self._inFrame is not None:
+                self._inFrame.close()
+            self._inFrame = _SharedArray.create(frame.shape,frame.dtype.str)
+            self._conn.send((_CMD_ATTACH,self._inFrame.name,self._inFrame.shape,self._inFrame.dtype))
+        np.copyto(self._inFrame.array,frame)
+        self._conn.send((cmd,))
+
+    def _receive(self) -> Tuple[SerializedPipelineResult,Union[List[int],None]]:
+        msg = self._conn.recv()
+        if msg[0] == _MSG_ERROR:
+            raise RuntimeError(f"Pipeline process {self.name} raised an exception:\n{msg[1]}")
+        _, atLen, odLen, outInfo, dbench, hasFrame, self._detectorSettings, self._rejections, self._solveCacheStats = msg
+        if outInfo is not None:
+            # The child (re)allocated its output frame buffer
+            if self._outFrame is not None:
+                self._outFrame.close()
+            self._outFrame = _SharedArray.attach(*outInfo)
+        atData = self._results.array[:atLen].copy() if atLen >= 0 else None
+        odStart = max(atLen,0)
+        odData = self._results.array[odStart:odStart+odLen].copy() if odLen >= 0 else None
+        # The frame is copied out so the child can write the next one while this one is still being streamed
+        frame = None
+        if hasFrame:
+            frame = self._pool.acquire(self._outFrame.array.shape,self._outFrame.array.dtype)
+            np.copyto(frame,self._outFrame.array)
+        return SerializedPipelineResult(atData,odData,frame),dbench
+
+    def process(self, frame: cv2.Mat) -> SerializedPipelineResult:
+        self._sendFrame(frame,_CMD_PROCESS)
+        return self._receive()[0]
+
+    def deepBenchmark(self, frame: cv2.Mat) -> Tuple[List[int],SerializedPipelineResult]:
+        self._sendFrame(frame,_CMD_BENCHMARK)
+        res, dbench = self._receive()
+        return dbench,res
+
+    def close(self) -> None:
+        if self._released:
+            return
+        try:
+            self._conn.send((_CMD_STOP,))
+        except (BrokenPipeError,OSError):
+            pass
+        self._process.join(timeout=5.0)
+        if self._process.is_alive():
+            logger.warning("Pipeline process %s did not exit, terminating",self.name)
+            self._process.terminate()
+        self._release()
+        logger.info("Stopped pipeline process %s",self.name)
+
+    def kill(self) -> None:
+        """
+        Terminates the child process immediately, for recovering from a hung pipeline
+        """
+        if self._released:
+            return
+        self._process.kill()
+        self._process.join(timeout=1.0)
+        self._release()
+        logger.info("Killed pipeline process %s",self.name)
+
+    def _release(self) -> None:
+        if self._released:
+            return
+        self._released = True
+        self._results.close()
+        if self._inFrame is not None:
+            self._inFrame.close()
+        if self._outFrame is not None:
+            self._outFrame.close()
+        self._conn.close()
+
+def _run(name: str, configFile: str, intrinsics: CameraIntrinsics, cpus: Union[List[int],None], undistorter: Union[Undistorter,None], conn: multiprocessing.connection.Connection) -> None:
+    """
+    Entry point of the child process
+    """
+    pinThread(cpus) # Pinned before the pipeline is built, so detector threads inherit the affinity
+    try:
+        configurator = ConfigParser(configFile)
+        configurator.loadFieldConfig()
+        config = configurator.getPipelineConfig(name)
+        pipeline = Pipeline.buildPipeline(config,intrinsics,undistorter)
+        pool = BufferPool()
+        pipeline.setBufferPool(pool)
+    except Exception:
+        conn.send((_MSG_ERROR,traceback.format_exc()))
+        return
+    results = _SharedArray.create((_RESULT_CAPACITY,),"float64")
+    inFrame: Union[_SharedArray,None] = None
+    outFrame: Union[_SharedArray,None] = None
+    conn.send((_MSG_READY,results.name))
+
+    while True:
+        try:
+            msg = conn.recv()
+        except EOFError:
+            break # Parent exited
+        cmd = msg[0]
+        if cmd == _CMD_STOP:
+            break
+        if cmd == _CMD_ATTACH:
+            if inFrame is not None:
+                inFrame.close()
+            inFrame = _SharedArray.attach(msg[1],msg[2],msg[3])
+            continue
+
+        try:
+            dbench = None
+            if cmd == _CMD_BENCHMARK:
+                dbench,res = pipeline.deepBenchmark(inFrame.array)
+            else:
+                res = pipeline.process(inFrame.array)
+
+            atData = serializeApriltagResult(res.apriltagResult) if res.apriltagResult is not None else None
+            odData = serializeObjDetectResults(res.objDetectResults) if res.objDetectResults is not None else None
+            atLen = len(atData) if atData is not None else -1
+            odLen = len(odData) if odData is not None else -1
+            if max(atLen,0) + max(odLen,0) > _RESULT_CAPACITY:
+                raise ValueError(f"Serialized result does not fit in the shared result buffer ({_RESULT_CAPACITY} doubles)")
+            if atData is not None:
+                results.array[:atLen] = atData
+            if odData is not None:
+                results.array[max(atLen,0):max(atLen,0)+odLen] = odData
+
+            outInfo = None
+            hasFrame = res.frame is not None
+            if hasFrame:
+                if outFrame is None or not outFrame.matches(res.frame):
+                    if outFrame is not None:
+                        outFrame.close()
+                    outFrame = _SharedArray.create(res.frame.shape,res.frame.dtype.str)
+                    outInfo = (outFrame.name,outFrame.shape,outFrame.dtype)
+                np.copyto(outFrame.array,res.frame)
+                pool.release(res.frame)
+            conn.send((_MSG_RESULT,atLen,odLen,outInfo,dbench,hasFrame,pipeline.getDetectorSettings(),pipeline.getRejections(),pipeline.getSolveCacheStats()))
+        except Exception:
+            conn.send((_MSG_ERROR,traceback.format_exc()))
+
+    results.close()
+    if inFrame is not None:
+        inFrame.close()
+    if outFrame is not None:
+        outFrame.close()
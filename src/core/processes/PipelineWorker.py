@@ -25,29 +25,50 @@ import threading
 import multiprocessing
 from video.CameraHandler import CameraHandler
 from pipeline import Pipeline
+from processes.PipelineProcess import PipelineProcess
+from network import ntmanager
 from network.ntmanager import NTManager
 from configuration.config_types import *
 import cv2
 from time import perf_counter_ns
 import logging
-from typing import List,Tuple
+from typing import List,Tuple,Union
 from pipeline.Annotator import Annotator
-from utils.misc import releaseGIL
+from utils.misc import releaseGIL, pinThread
+from utils.framequeue import DropOldestQueue, ReorderBuffer
+from utils.vtypes import PipelineResult
+from utils.bufferpool import BufferPool
 import traceback
 import sys
 from video import CameraManager
+from video.CameraFeed import FeedSubscription, SharedFrame
+from pipeline.LoadScheduler import LoadScheduler
+from pipeline.Undistorter import Undistorter
+from utils import startup
 
 logger = logging.getLogger(__name__)
+
+_DEADLINE_FRAME_TIMES = 3.0 # A pipeline may take this many times its recent slowest frame before it counts as hung
+_FRAME_TIME_DECAY = 0.95 # Per frame decay of the recent slowest frame time
+
 #This class handles everything related to the camera, from capturing video to processing to output
 #TODO Later: Add option to turn on and off stream while the program is running
-#TODO: Refactor pixel format handling, cut out redundant opencv calls
 class PipelineWorker:
 
-    def __init__(self,config: PipelineConfig, camera: CameraHandler):
+    def __init__(self,config: PipelineConfig, camera: CameraHandler, scheduler: Union[LoadScheduler,None] = None):
         self.name = config.name
-        self._videoInput = camera.getSink()
+        self._camera = camera
+        self._videoInput: Union[FeedSubscription,None] = None # Subscribed when the worker starts
         self._intrinsics = camera.getIntrinsics()
-        self._pipeline = Pipeline.buildPipeline(config,self._intrinsics)
+        self._undistorter: Union[Undistorter,None] = None # Shared by every pipeline instance the worker builds
+        if self._intrinsics is not None and config.undistortStep is not None:
+            self._undistorter = Undistorter.forCamera(camera.name,self._intrinsics,camera.getResolution(),config.undistortStep)
+        # Intermediate and annotated frames are drawn from a pool shared by this worker's pipelines, and returned once they have been streamed
+        self._pool = BufferPool()
+        if config.stream and config.processedport is not None:
+            xres, yres = camera.getResolution()
+            self._pool.reserve((yres,xres,3),config.parallelism + config.publishQueueDepth + 1)
+        self._pipeline: Union[Pipeline.Pipeline,PipelineProcess,None] = self._buildPipeline(config)
         self._ntman = NTManager(self.name)
         self._rawserver: Union[cscore.MjpegServer,None] = None
         self._processedserver: Union[cscore.MjpegServer,None] = None
@@ -80,62 +101,223 @@ class PipelineWorker:
                 self._processedserver.setSource(self._videoOutput)
                 logger.debug("Started processed mjpeg server on port %d",config.processedport)
         
-        self._running: bool = False # Simple variable assignments are atomic by default in python
-        self._thread = threading.Thread(target=self.run,name=f"{self.name}_worker",daemon=True)
+        # Every start creates a new run token, loops exit once the token they started with is no longer current.
+        # This lets a restart abandon a thread that is hung in a native call without it resuming alongside its replacement.
+        self._runToken: Union[object,None] = None # Simple variable assignments are atomic by default in python
+        self._thread: Union[threading.Thread,None] = None
+        self._config = config
+        self._grayscale = config.grayscale # Grayscale pipelines get single channel frames straight from cscore
+        self._cpus = config.cpus
+        self._heartbeat: int = 0 # perf_counter_ns timestamp of the last time the worker's loop made progress
+        self._frameTime: float = 0.0 # Recent slowest processing time in nanoseconds, decays each frame
+        self._seenDrops: int = 0 # Frames the feed subscription had dropped as of the last admission check
+        self._published: bool = False # Whether the worker has published a result since the program started
+        self._scheduler = scheduler
+        if scheduler is not None:
+            scheduler.register(self.name,config.priority,config.targetFps if config.targetFps is not None else camera.getFPS())
+
+    def _buildPipeline(self, config: PipelineConfig) -> Union[Pipeline.Pipeline,PipelineProcess]:
+        pipeline = None
+        if config.multiprocess:
+            if config.configFile is not None:
+                pipeline = PipelineProcess(config,self._intrinsics,config.cpus,self._undistorter)
+            else:
+                logger.warning("Pipeline %s was not loaded from a config file, and cannot run in its own process",self.name)
+        if pipeline is None:
+            pipeline = Pipeline.buildPipeline(config,self._intrinsics,self._undistorter)
+        pipeline.setBufferPool(self._pool)
+        return pipeline
+
+    def _outputFrame(self, res: PipelineResult) -> None:
+        """
+        Streams the annotated frame of a result, if it has one, and returns the frame to the pool
+        """
+        if res.frame is None:
+            return
+        Annotator.drawPipelineName(res.frame,self.name)
+        self._videoOutput.putFrame(res.frame)
+        self._pool.release(res.frame)
+
+    def _discardFrame(self, item: Tuple[int,PipelineResult]) -> None:
+        if item[1].frame is not None:
+            self._pool.release(item[1].frame)
+
+    def _admit(self, frame: SharedFrame) -> bool:
+        """
+        Asks the load scheduler whether to process a frame. Skipped frames are released.
+        """
+        if self._scheduler is None:
+            return True
+        # Frames the feed replaced while the worker was busy still count towards the rate the camera delivers at
+        drops = self._videoInput.drops()
+        missed = max(drops - self._seenDrops,0)
+        self._seenDrops = drops
+        if self._scheduler.admit(self.name,missed):
+            return True
+        frame.release()
+        self._heartbeat = perf_counter_ns() # A throttled worker is still alive
+        return False
+
+    def _grabFrame(self) -> Union[SharedFrame,None]:
+        """
+        Waits for the next frame. When none arrives the worker is still alive, so its heartbeat is refreshed.
+        Rebuilding the pipeline would not bring a missing camera back, the supervisor rebuilds feeds that stay silent instead.
+        """
+        frame = self._videoInput.grabFrame()
+        if frame is None:
+            logger.warning("Error grabbing frame: %s",self._videoInput.getError())
+            self._heartbeat = max(self._heartbeat,perf_counter_ns()) # Keeps what is left of the startup grace
+        return frame
+
+    def _reportCost(self, cost: int) -> None:
+        self._frameTime = max(float(cost),self._frameTime * _FRAME_TIME_DECAY)
+        if self._scheduler is not None:
+            self._scheduler.report(self.name,cost)
+
+    def _publishResult(self, time: int, res: PipelineResult) -> None:
+        self._ntman.publishResult(time,res)
+        if not self._published:
+            self._published = True
+            startup.event(f"{self.name} first result")
+
+    def _publishStats(self, fps: int, time: int) -> None:
+        logger.debug(f"Running at {fps} fps")
+        self._ntman.publishFPS(fps,time)
+        if self._scheduler is not None:
+            self._ntman.publishSchedulerState(*self._scheduler.getState(self.name),time)
+        settings = self._pipeline.getDetectorSettings()
+        if settings is not None:
+            self._ntman.publishDetectorSettings(*settings,time)
+        # Every parallel instance filters its own share of the frames
+        counts = [rejections for rejections in (pipeline.getRejections() for pipeline in self._getPipelines()) if rejections is not None]
+        if len(counts) > 0:
+            self._ntman.publishRejections(tuple(sum(reason) for reason in zip(*counts)),time)
 
     def run(self) -> None:
         """
         Run the pipeline.
         """
-        frame: cv2.Mat = np.zeros(shape=(1,1,1),dtype=np.uint8)
+        token = self._runToken
+        pinThread(self._cpus)
         nanosSinceLastFPS = perf_counter_ns()
         frameCounter = 0
-        while self._running:
+        while self._runToken is token:
 
-            time, frame = self._videoInput.grabFrame(frame)
-            if time == 0: 
-                logger.warning("Error grabbing frame: %s",self._videoInput.getError())
+            frame = self._grabFrame()
+            if frame is None: 
+                continue
+            time = frame.time
+            if not self._admit(frame):
                 continue
 
             releaseGIL()
             res = None
+            prc_t0 = perf_counter_ns()
             try:
-                res = self._pipeline.process(frame)
+                res = self._pipeline.process(frame.image)
             except Exception as e:
                 logger.warning(f"Unable to process frame due to an unhandled exception.")
                 traceback.print_exc()
                 continue
+            finally:
+                frame.release()
+            self._reportCost(perf_counter_ns() - prc_t0)
+            if self._runToken is not token:
+                # The worker was restarted while this frame was processed, its replacement publishes from now on
+                self._discardFrame((time,res))
+                break
             releaseGIL()
-            self._ntman.publishResult(time,res)
-            Annotator.drawPipelineName(res.frame,self.name)
-            if res.frame is not None: self._videoOutput.putFrame(res.frame)
+            self._publishResult(time,res)
+            self._outputFrame(res)
+            self._heartbeat = perf_counter_ns()
 
             #Measure FPS
             frameCounter += 1
             if perf_counter_ns() - nanosSinceLastFPS >= 1e9:
-                logger.debug(f"Running at {frameCounter} fps")
-                self._ntman.publishFPS(frameCounter,time)
+                self._publishStats(frameCounter,time)
                 frameCounter = 0
                 nanosSinceLastFPS = perf_counter_ns()
     
-    def start(self) -> None:
-        self._running = True
+    def start(self, grace: float = 0.0) -> None:
+        """
+        :param grace: Extra time in seconds before the first frame is expected, added to the heartbeat
+        """
+        self._seenDrops = 0
+        self._videoInput = CameraManager.subscribe(self._camera,self._grayscale)
+        self._heartbeat = perf_counter_ns() + int(grace * 1e9)
+        self._runToken = object()
+        self._thread = threading.Thread(target=self.run,name=f"{self.name}_worker",daemon=True)
         self._thread.start()
         logger.info(f"Started {self.name} worker")
 
-    def stop(self) -> None:
-        self._running = False
-        self._thread.join()
+    def stop(self, timeout: Union[float,None] = None) -> None:
+        """
+        :param timeout: Maximum time to wait for the worker thread to exit, None waits indefinitely. A thread that does not exit in time is abandoned.
+        """
+        self._runToken = None
+        if self._thread is not None:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                logger.warning("%s worker did not exit within %.3f s, abandoning it",self.name,timeout)
+        self._videoInput.close()
         logger.info(f"Stopped {self.name} worker")
+
+    def restart(self, grace: float = 0.0) -> None:
+        """
+        Abandons the current worker thread, which may be hung or dead, and starts a fresh one on a rebuilt pipeline
+        """
+        self.stop(timeout=0.1)
+        # The old pipelines are dropped before rebuilding, so a rebuild that fails is retried from scratch instead of on dead processes
+        pipelines = self._getPipelines()
+        self._dropPipelines()
+        for pipeline in pipelines:
+            if isinstance(pipeline,PipelineProcess):
+                pipeline.kill()
+        self._rebuildPipelines()
+        self.start(grace)
+
+    def _getPipelines(self) -> List[Union[Pipeline.Pipeline,PipelineProcess]]:
+        return [self._pipeline] if self._pipeline is not None else []
+
+    def _dropPipelines(self) -> None:
+        self._pipeline = None
+
+    def _rebuildPipelines(self) -> None:
+        self._pipeline = self._buildPipeline(self._config)
+
+    def isAlive(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def hasPublished(self) -> bool:
+        return self._published
+
+    def getHeartbeat(self) -> int:
+        """
+        :return: perf_counter_ns timestamp of the last time the worker's loop made progress, a processed frame or a capture timeout
+        """
+        return self._heartbeat
+
+    def getDeadline(self, default: float) -> float:
+        """
+        :param default: The supervisor's deadline, used unless the pipeline configures its own
+        :return: Seconds the worker may go without making progress before it counts as hung.
+            Pipelines slower than the deadline (e.g. object detection on the CPU) get a multiple of their recent slowest frame
+        """
+        deadline = self._config.deadline if self._config.deadline is not None else default
+        return max(deadline,_DEADLINE_FRAME_TIMES * self._frameTime / 1e9)
     
     def startOnMainThread(self) -> None:
         #Starts the worker on the main thread, for testing. DO NOT USE, WILL BLOCK MAIN THREAD INDEFINITELY
-        self._running = True
+        self._videoInput = CameraManager.subscribe(self._camera,self._grayscale)
+        self._runToken = object()
         self.run()
 
     def benchmark(self,benchtime: float) -> None:
         logger.info(f"Benchmarking {self.name} for {benchtime} seconds")
-        frame: cv2.Mat = np.zeros(shape=(1,1,1),dtype=np.uint8)
+        self._videoInput = CameraManager.subscribe(self._camera,self._grayscale)
+        feed = CameraManager.getFeed(self._camera,self._grayscale)
+        feedAllocs0, poolAllocs0, poolReuses0 = feed.allocations(), self._pool.allocations(), self._pool.reuses()
+        cacheHits0, cacheLookups0 = self._pipeline.getSolveCacheStats() or (0,0)
         benchdata: List[Tuple[int,int,int,int,List[int]]] = [] #total cycle time,capture time,process time,publish time,deep benchmark data
         
         t0 = perf_counter_ns()
@@ -143,29 +325,40 @@ class PipelineWorker:
 
             cyc_t0 = perf_counter_ns()
             cap_t0 = perf_counter_ns()
-            time, frame = self._videoInput.grabFrame(frame)
-            if time == 0: 
+            frame = self._videoInput.grabFrame()
+            if frame is None: 
                 logger.warning(self._videoInput.getError())
                 continue
+            time = frame.time
             cap_t1 = perf_counter_ns()
 
 
             dbench,res = None,None
             prc_t0 = perf_counter_ns()
             try:
-                dbench,res = self._pipeline.deepBenchmark(frame)
+                dbench,res = self._pipeline.deepBenchmark(frame.image)
             except:
                 logger.warning(f"{self.name} unable to process frame due to an unhandled exception.")
                 traceback.print_exc()
                 continue
+            finally:
+                frame.release()
             prc_t1 = perf_counter_ns()
 
             pub_t0 = perf_counter_ns()
             self._ntman.publishResult(time,res)
-            if res.frame is not None: self._videoOutput.putFrame(res.frame)
+            self._outputFrame(res)
             pub_t1 = perf_counter_ns()
             cyc_t1 = perf_counter_ns()
             benchdata.append((cyc_t1-cyc_t0,cap_t1-cap_t0,prc_t1-prc_t0,pub_t1-pub_t0,dbench))
+        self._videoInput.close()
+        feedAllocs = feed.allocations() - feedAllocs0
+        poolAllocs = self._pool.allocations() - poolAllocs0
+        poolReuses = self._pool.reuses() - poolReuses0
+        cacheHits, cacheLookups = self._pipeline.getSolveCacheStats() or (0,0)
+        cacheHits -= cacheHits0
+        cacheLookups -= cacheLookups0
+        cacheHitRate = 100.0 * cacheHits / cacheLookups if cacheLookups > 0 else 0.0
         
         dbench_len = len(benchdata[0][4])
         cycles_measured = len(benchdata)
@@ -249,6 +442,14 @@ Min process time: {process_min:.3f} ms
 Avg publish time: {publish_avg:.3f} ms
 Max publish time: {publish_max:.3f} ms
 Min publish time: {publish_min:.3f} ms
+-----------------BUFFERS-----------------
+Capture buffer allocations: {feedAllocs}
+Frame buffer allocations: {poolAllocs}
+Frame buffer reuses: {poolReuses}
+---------------SOLVE CACHE---------------
+Lookups: {cacheLookups}
+Hits: {cacheHits}
+Hit rate: {cacheHitRate:.1f} %
 -----------------DPBENCH-----------------
 PRD |    AVG    |    MAX    |    MIN    |"""
         for i in range(dbench_len-1):
@@ -257,8 +458,177 @@ PRD |    AVG    |    MAX    |    MIN    |"""
 
 
 
-def buildPipelineWorker(config: PipelineConfig) -> PipelineWorker:
+class StagedPipelineWorker(PipelineWorker):
+    """
+    A pipeline worker that runs capture, processing, and publishing as separate stages on their own threads.
+    The capture stage (the camera's feed) only keeps the newest frame, and the publish stage drops its oldest result when it falls behind,
+    so a stage that goes over budget costs dropped frames instead of added latency.
+    """
+    def __init__(self, config: PipelineConfig, camera: CameraHandler, scheduler: Union[LoadScheduler,None] = None):
+        super().__init__(config,camera,scheduler)
+        self._resultQueue: DropOldestQueue[Tuple[int,PipelineResult]] = DropOldestQueue(config.publishQueueDepth,self._discardFrame)
+        self._publishThread: Union[threading.Thread,None] = None
+
+    def _publish(self, token: object) -> None:
+        nanosSinceLastFPS = perf_counter_ns()
+        frameCounter = 0
+        while self._runToken is token:
+            for time, res in self._takeResults(0.1):
+                self._publishResult(time,res)
+                self._outputFrame(res)
+
+                #Measure FPS
+                frameCounter += 1
+                if perf_counter_ns() - nanosSinceLastFPS >= 1e9:
+                    self._publishStats(frameCounter,time)
+                    self._ntman.publishStageStats(*self.getStageStats(),time)
+                    frameCounter = 0
+                    nanosSinceLastFPS = perf_counter_ns()
+
+    def _takeResults(self, timeout: float) -> List[Tuple[int,PipelineResult]]:
+        item = self._resultQueue.get(timeout)
+        return [] if item is None else [item]
+
+    def getStageStats(self) -> Tuple[int,int,int]:
+        """
+        :return: Number of captured frames dropped before processing, number of results dropped before publishing, and the current publish queue depth
+        """
+        return self._videoInput.drops(),self._resultQueue.drops(),self._resultQueue.depth()
+
+    def run(self) -> None:
+        """
+        Run the pipeline. The calling thread becomes the processing stage, capture is handled by the camera's feed.
+        """
+        token = self._runToken
+        pinThread(self._cpus)
+        self._publishThread = threading.Thread(target=self._publish,args=(token,),name=f"{self.name}_publish",daemon=True)
+        self._publishThread.start()
+        while self._runToken is token:
+            frame = self._grabFrame()
+            if frame is None:
+                continue
+            if not self._admit(frame):
+                continue
+            prc_t0 = perf_counter_ns()
+            try:
+                res = self._pipeline.process(frame.image)
+            except Exception as e:
+                logger.warning(f"Unable to process frame due to an unhandled exception.")
+                traceback.print_exc()
+                continue
+            finally:
+                frame.release()
+            self._reportCost(perf_counter_ns() - prc_t0)
+            if self._runToken is not token:
+                self._discardFrame((frame.time,res))
+                break
+            self._resultQueue.put((frame.time,res))
+            self._heartbeat = perf_counter_ns()
+        self._publishThread.join()
+
+class ParallelPipelineWorker(StagedPipelineWorker):
+    """
+    A staged worker that keeps several frames from one camera in flight at once, each on its own pipeline instance.
+    Results go through a reorder buffer so they are published in capture order, results older than maxResultAge are dropped.
+    """
+    def __init__(self, config: PipelineConfig, camera: CameraHandler, scheduler: Union[LoadScheduler,None] = None):
+        super().__init__(config,camera,scheduler)
+        # Each processing thread gets its own pipeline, since detectors and solvers are not thread safe
+        self._pipelines: List[Union[Pipeline.Pipeline,PipelineProcess]] = [self._pipeline]
+        for _ in range(config.parallelism - 1):
+            self._pipelines.append(self._buildPipeline(config))
+        self._reorder: ReorderBuffer[PipelineResult] = ReorderBuffer(config.maxResultAge * 1000,ntmanager.now,self._discardFrame)
+        self._grabLock = threading.Lock() # Frames are registered with the reorder buffer in the same critical section they are grabbed in
+        self._processThreads: List[threading.Thread] = []
+
+    def _takeResults(self, timeout: float) -> List[Tuple[int,PipelineResult]]:
+        return self._reorder.pop(timeout)
+
+    def getStageStats(self) -> Tuple[int,int,int]:
+        """
+        :return: Number of captured frames dropped before processing, number of late results dropped, and the number of frames in flight or awaiting publishing
+        """
+        return self._videoInput.drops(),self._reorder.drops(),self._reorder.depth()
+
+    def _getPipelines(self) -> List[Union[Pipeline.Pipeline,PipelineProcess]]:
+        return self._pipelines
+
+    def _dropPipelines(self) -> None:
+        self._pipelines = []
+        self._pipeline = None
+
+    def _rebuildPipelines(self) -> None:
+        pipelines: List[Union[Pipeline.Pipeline,PipelineProcess]] = []
+        try:
+            for _ in range(self._config.parallelism):
+                pipelines.append(self._buildPipeline(self._config))
+        except Exception:
+            # Instances that did start would otherwise keep running with nothing referencing them
+            for pipeline in pipelines:
+                if isinstance(pipeline,PipelineProcess):
+                    pipeline.kill()
+            raise
+        self._pipelines = pipelines
+        self._pipeline = self._pipelines[0]
+
+    def _processLoop(self, pipeline: Union[Pipeline.Pipeline,PipelineProcess], token: object) -> None:
+        pinThread(self._cpus)
+        while self._runToken is token:
+            # Idle processing threads compete for frames, so each frame goes to exactly one of them.
+            # Grabbing and registering a frame is atomic, otherwise a later frame could be begun and completed before an earlier one is registered,
+            # and the earlier frame's result would be dropped as late
+            with self._grabLock:
+                frame = self._grabFrame()
+                admitted = frame is not None and self._admit(frame)
+                if admitted:
+                    self._reorder.begin(frame.time)
+            if not admitted:
+                continue
+            prc_t0 = perf_counter_ns()
+            try:
+                res = pipeline.process(frame.image)
+            except Exception as e:
+                logger.warning(f"Unable to process frame due to an unhandled exception.")
+                traceback.print_exc()
+                self._reorder.cancel(frame.time)
+                continue
+            finally:
+                frame.release()
+            self._reportCost(perf_counter_ns() - prc_t0)
+            if self._runToken is not token:
+                self._reorder.cancel(frame.time)
+                self._discardFrame((frame.time,res))
+                break
+            self._reorder.complete(frame.time,res)
+            self._heartbeat = perf_counter_ns()
+
+    def run(self) -> None:
+        """
+        Run the pipeline. The calling thread becomes the first processing thread.
+        """
+        token = self._runToken
+        self._publishThread = threading.Thread(target=self._publish,args=(token,),name=f"{self.name}_publish",daemon=True)
+        self._publishThread.start()
+        self._processThreads = [
+            threading.Thread(target=self._processLoop,args=(pipeline,token),name=f"{self.name}_process_{index}",daemon=True)
+            for index,pipeline in enumerate(self._pipelines[1:],1)
+        ]
+        for thread in self._processThreads:
+            thread.start()
+        self._processLoop(self._pipelines[0],token)
+        for thread in self._processThreads:
+            thread.join()
+        self._publishThread.join()
+
+def buildPipelineWorker(config: PipelineConfig, scheduler: Union[LoadScheduler,None] = None) -> PipelineWorker:
     camera = CameraManager.getCamera(config.camera)
-    return PipelineWorker(config,camera)
+    if config.parallelism > 1 and config.objdetectConfig is not None:
+        # Each pipeline instance would track objects on its own, out of order and possibly in another process, giving them conflicting track IDs
+        logger.warning("Pipeline %s tracks objects, which needs a single pipeline instance, ignoring its parallelism. Use asyncInference to run inference in parallel",config.name)
+    elif config.parallelism > 1:
+        return ParallelPipelineWorker(config,camera,scheduler)
+    if config.staged:
+        return StagedPipelineWorker(config,camera,scheduler)
+    return PipelineWorker(config,camera,scheduler)
 
 
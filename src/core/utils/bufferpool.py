@@ -0,0 +1,65 @@
+# Copyright (c) FRC 1076 PiHi Samurai
+# You may use, distribute, and modify this software under the terms of
+# the license found in the root directory of this project
+
+import threading
+import numpy as np
+from typing import Dict, List, Tuple
+
+class BufferPool:
+    """
+    A thread-safe pool of reusable numpy buffers, keyed by shape and dtype.
+    Buffers are allocated on demand when none of the right shape are free, and the number of allocations is counted
+    so that allocator churn in the hot loop shows up in benchmarks.
+    """
+    def __init__(self, maxFree: int = 8):
+        """
+        :param maxFree: Maximum number of free buffers kept per shape, extra released buffers are left to the garbage collector
+        """
+        self._free: Dict[Tuple[Tuple[int,...],str],List[np.ndarray]] = {}
+        self._lock = threading.Lock()
+        self._maxFree = maxFree
+        self._allocations: int = 0
+        self._reuses: int = 0
+
+    def reserve(self, shape: Tuple[int,...], count: int, dtype: np.dtype = np.uint8) -> None:
+        """
+        Preallocates buffers so the first frames do not pay for allocation
+        """
+        buffers = [np.empty(shape,dtype=dtype) for _ in range(count)]
+        for buf in buffers:
+            buf.fill(0) # Touch every page now instead of faulting them in during the first frames
+        with self._lock:
+            self._free.setdefault((tuple(shape),np.dtype(dtype).str),[]).extend(buffers)
+
+    def acquire(self, shape: Tuple[int,...], dtype: np.dtype = np.uint8) -> np.ndarray:
+        """
+        :return: A writable buffer of the given shape and dtype, with undefined contents
+        """
+        with self._lock:
+            free = self._free.get((tuple(shape),np.dtype(dtype).str))
+            if free:
+                self._reuses += 1
+                return free.pop()
+            self._allocations += 1
+        return np.empty(shape,dtype=dtype)
+
+    def release(self, buf: np.ndarray) -> None:
+        """
+        Returns a buffer to the pool. The caller must not use it afterwards.
+        """
+        if not buf.flags.owndata or not buf.flags.writeable:
+            return # Views and read-only arrays are never pooled
+        with self._lock:
+            free = self._free.setdefault((buf.shape,buf.dtype.str),[])
+            if len(free) < self._maxFree and not any(f is buf for f in free):
+                free.append(buf)
+
+    def allocations(self) -> int:
+        """
+        :return: The number of buffers allocated because none were free
+        """
+        return self._allocations
+
+    def reuses(self) -> int:
+        return self._reuses
@@ -0,0 +1,189 @@
+# Copyright (c) FRC 1076 PiHi Samurai
+# You may use, distribute, and modify this software under the terms of
+# the license found in the root directory of this project
+
+import threading
+from collections import deque
+from typing import Any, Callable, Deque, Generic, List, Tuple, TypeVar, Union
+
+T = TypeVar("T")
+
+# Thread-safe handoff primitives for linking pipeline stages
+
+class LatestSlot(Generic[T]):
+    """
+    A single-item mailbox where the newest item always wins. Putting an item while an older one is still waiting drops the older one.
+    """
+    def __init__(self, onDrop: Union[Callable[[T],Any],None] = None):
+        self._cond = threading.Condition()
+        self._item: Union[T,None] = None
+        self._onDrop = onDrop
+        self._drops: int = 0
+
+    def put(self, item: T) -> None:
+        with self._cond:
+            dropped = self._item
+            self._item = item
+            if dropped is not None:
+                self._drops += 1
+            self._cond.notify()
+        if dropped is not None and self._onDrop is not None:
+            self._onDrop(dropped)
+
+    def get(self, timeout: Union[float,None] = None) -> Union[T,None]:
+        """
+        Takes the newest item, waiting up to timeout seconds for one to arrive.
+        :return: The item, or None if the timeout expired
+        """
+        with self._cond:
+            if self._item is None:
+                self._cond.wait(timeout)
+            item = self._item
+            self._item = None
+            return item
+
+    def clear(self) -> None:
+        with self._cond:
+            dropped = self._item
+            self._item = None
+        if dropped is not None and self._onDrop is not None:
+            self._onDrop(dropped)
+
+    def depth(self) -> int:
+        return 0 if self._item is None else 1
+
+    def drops(self) -> int:
+        return self._drops
+
+class DropOldestQueue(Generic[T]):
+    """
+    A bounded FIFO queue that drops its oldest item instead of blocking when full, so that a slow consumer never stalls the producer
+    """
+    def __init__(self, maxsize: int, onDrop: Union[Callable[[T],Any],None] = None):
+        self._cond = threading.Condition()
+        self._items: Deque[T] = deque()
+        self._maxsize = max(maxsize,1)
+        self._onDrop = onDrop
+        self._drops: int = 0
+
+    def put(self, item: T) -> None:
+        dropped = None
+        with self._cond:
+            if len(self._items) >= self._maxsize:
+                dropped = self._items.popleft()
+                self._drops += 1
+            self._items.append(item)
+            self._cond.notify()
+        if dropped is not None and self._onDrop is not None:
+            self._onDrop(dropped)
+
+    def get(self, timeout: Union[float,None] = None) -> Union[T,None]:
+        """
+        Takes the oldest item, waiting up to timeout seconds for one to arrive.
+        :return: The item, or None if the timeout expired
+        """
+        with self._cond:
+            if len(self._items) == 0:
+                self._cond.wait(timeout)
+            if len(self._items) == 0:
+                return None
+            return self._items.popleft()
+
+    def depth(self) -> int:
+        return len(self._items)
+
+    def drops(self) -> int:
+        return self._drops
+
+class ReorderBuffer(Generic[T]):
+    """
+    Collects results that complete out of order and releases them in key order (e.g. capture timestamp).
+    A result is held back until every earlier key still in flight has completed, or has grown older than maxAge.
+    Results that arrive after a later result was already released, or that are older than maxAge, are dropped.
+    """
+    def __init__(self, maxAge: int, clock: Callable[[],int], onDrop: Union[Callable[[Tuple[int,T]],Any],None] = None):
+        """
+        :param onDrop: Called with the key and result of every dropped result, e.g. to release its buffers
+        """
+        self._cond = threading.Condition()
+        self._maxAge = maxAge
+        self._clock = clock
+        self._onDrop = onDrop
+        self._inFlight: set[int] = set()
+        self._completed: dict[int,T] = {}
+        self._lastReleased: int = -1
+        self._drops: int = 0
+
+    def begin(self, key: int) -> None:
+        """
+        Registers a key as in flight, later keys will wait for it
+        """
+        with self._cond:
+            self._inFlight.add(key)
+
+    def complete(self, key: int, item: T) -> None:
+        with self._cond:
+            late = key not in self._inFlight or key <= self._lastReleased
+            if late:
+                # Already given up on this key
+                self._inFlight.discard(key)
+                self._drops += 1
+            else:
+                self._inFlight.remove(key)
+                self._completed[key] = item
+                self._cond.notify()
+        if late and self._onDrop is not None:
+            self._onDrop((key,item))
+
+    def cancel(self, key: int) -> None:
+        """
+        Stops waiting for a key that will never complete (e.g. processing failed)
+        """
+        with self._cond:
+            self._inFlight.discard(key)
+            self._cond.notify()
+
+    def pop(self, timeout: Union[float,None] = None) -> List[Tuple[int,T]]:
+        """
+        Waits up to timeout seconds for results to become releasable.
+        :return: The releasable results in key order, possibly empty
+        """
+        dropped: List[Tuple[int,T]] = []
+        with self._cond:
+            ready = self._collect(dropped)
+            if len(ready) == 0:
+                self._cond.wait(timeout)
+                ready = self._collect(dropped)
+        if self._onDrop is not None:
+            for item in dropped:
+                self._onDrop(item)
+        return ready
+
+    def _collect(self, dropped: List[Tuple[int,T]]) -> List[Tuple[int,T]]:
+        """
+        :param dropped: Results that aged out are appended here, to be handed to onDrop once the lock is released
+        """
+        cutoff = self._clock() - self._maxAge
+        for key in [key for key in self._inFlight if key < cutoff]:
+            self._inFlight.remove(key) # Stop holding later results back for a frame that is already too old
+        for key in [key for key in self._completed if key < cutoff]:
+            dropped.append((key,self._completed.pop(key)))
+            self._drops += 1
+        oldestInFlight = min(self._inFlight) if len(self._inFlight) > 0 else None
+        ready: List[Tuple[int,T]] = []
+        for key in sorted(self._completed):
+            if oldestInFlight is not None and key > oldestInFlight:
+                break
+            ready.append((key,self._completed.pop(key)))
+        if len(ready) > 0:
+            self._lastReleased = ready[-1][0]
+        return ready
+
+    def depth(self) -> int:
+        """
+        :return: The number of results in flight or waiting to be released
+        """
+        return len(self._inFlight) + len(self._completed)
+
+    def drops(self) -> int:
+        return self._drops
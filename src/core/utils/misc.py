@@ -1,4 +1,24 @@
 import time
+import os
+import logging
+from typing import List, Union
+
+logger = logging.getLogger(__name__)
 
 def releaseGIL():
-    time.sleep(0) # time.sleep releases the GIL
\ No newline at end of file
+    time.sleep(0) # time.sleep releases the GIL
+
+def pinThread(cpus: Union[List[int],None]) -> None:
+    """
+    Pins the calling thread to a set of CPU cores. Threads started afterwards by this thread inherit the affinity.
+    :param cpus: Core indices to run on, or None to leave the affinity unchanged
+    """
+    if cpus is None or len(cpus) == 0:
+        return
+    if not hasattr(os,"sched_setaffinity"):
+        logger.warning("CPU affinity is not supported on this platform")
+        return
+    try:
+        os.sched_setaffinity(0,cpus) # On linux, pid 0 refers to the calling thread
+    except OSError as e:
+        logger.warning("Unable to pin thread to cores %s: %s",cpus,e)
@@ -0,0 +1,59 @@
+# Copyright (c) FRC 1076 PiHi Samurai
+# You may use, distribute, and modify this software under the terms of
+# the license found in the root directory of this project
+
+import logging
+import threading
+from time import perf_counter
+from typing import List, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# Records how long each phase of startup takes, timed from the first import of this module, which should be the first thing the launcher does.
+# Phases run one after another on the main thread, events (model loads, first results) happen in the background and are timed on their own.
+
+_t0: float = perf_counter()
+_last: float = _t0
+_marks: List[Tuple[str,float,Union[float,None]]] = [] #Name, seconds since launch, and duration of each phase or event
+_lock = threading.Lock()
+_reported: bool = False
+
+def mark(phase: str) -> None:
+    """
+    Records the end of a startup phase, which started when the previous phase ended
+    """
+    global _last
+    with _lock:
+        now = perf_counter()
+        _marks.append((phase,now - _t0,now - _last))
+        _last = now
+
+def event(name: str, duration: Union[float,None] = None) -> None:
+    """
+    Records something that happened in the background during startup
+    :param duration: How long it took in seconds, if it has a duration
+    """
+    with _lock:
+        elapsed = perf_counter() - _t0
+        _marks.append((name,elapsed,duration))
+    if _reported:
+        # Events after the report are still worth knowing about
+        logger.info("Startup: %s at %.3f s",name,elapsed)
+
+def elapsed() -> float:
+    """
+    :return: Seconds since launch
+    """
+    return perf_counter() - _t0
+
+def report() -> None:
+    """
+    Logs the time of every phase and event recorded so far
+    """
+    global _reported
+    with _lock:
+        lines = [f"{'PHASE':<40} | {'AT':>8} | {'TOOK':>8} (seconds)"]
+        for name, at, duration in _marks:
+            lines.append(f"{name:<40} | {at: 8.3f} | {duration: 8.3f}" if duration is not None else f"{name:<40} | {at: 8.3f} | {'':>8}")
+        _reported = True
+    logger.info("Startup report\n%s","\n".join(lines))
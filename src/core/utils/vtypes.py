@@ -21,17 +21,77 @@
 # SOFTWARE.
 
 from dataclasses import dataclass
-from typing import List, Union
-from wpimath.geometry import Pose3d
+from typing import List, Sequence, Tuple, Union
 import numpy
 import cv2
 
+# Reasons the fiducial filter rejects a detection, in the order they are checked. A tag that fails several checks is counted under the first one.
+REJECTION_REASONS: Tuple[str,...] = ("excluded","hamming","margin","area","skew")
+
 @dataclass(frozen=True)
 class Fiducial:
     id: int
     corners: numpy.typing.NDArray[numpy.float64]
     decisionMargin: float
     hammingDist: float
+    undistorted: Union[numpy.typing.NDArray[numpy.float64],None] = None # See FiducialBatch.undistorted
+
+@dataclass(frozen=True)
+class FiducialBatch:
+    # Struct-of-arrays batch of tag detections, index i of every array describes the same tag
+    ids: numpy.typing.NDArray[numpy.int32] # (N,)
+    corners: numpy.typing.NDArray[numpy.float64] # (N,4,2)
+    decisionMargins: numpy.typing.NDArray[numpy.float64] # (N,)
+    hammingDists: numpy.typing.NDArray[numpy.int32] # (N,)
+    undistorted: Union[numpy.typing.NDArray[numpy.float64],None] = None # (N,4,2) corners with lens distortion removed (see pipeline.Undistorter), None if they have not been undistorted
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __getitem__(self, index: int) -> Fiducial:
+        return Fiducial(
+            int(self.ids[index]),
+            self.corners[index],
+            float(self.decisionMargins[index]),
+            int(self.hammingDists[index]),
+            self.undistorted[index] if self.undistorted is not None else None
+        )
+
+    def select(self, mask: numpy.typing.NDArray) -> "FiducialBatch":
+        """
+        :param mask: A boolean mask or index array over the batch
+        :return: A batch containing only the selected tags
+        """
+        return FiducialBatch(
+            self.ids[mask],
+            self.corners[mask],
+            self.decisionMargins[mask],
+            self.hammingDists[mask],
+            self.undistorted[mask] if self.undistorted is not None else None
+        )
+
+    @staticmethod
+    def empty() -> "FiducialBatch":
+        return FiducialBatch(
+            numpy.empty(0,dtype=numpy.int32),
+            numpy.empty((0,4,2),dtype=numpy.float64),
+            numpy.empty(0,dtype=numpy.float64),
+            numpy.empty(0,dtype=numpy.int32)
+        )
+
+    @staticmethod
+    def concatenate(batches: Sequence["FiducialBatch"]) -> "FiducialBatch":
+        if len(batches) == 0:
+            return FiducialBatch.empty()
+        if len(batches) == 1:
+            return batches[0]
+        return FiducialBatch(
+            numpy.concatenate([batch.ids for batch in batches]),
+            numpy.concatenate([batch.corners for batch in batches]),
+            numpy.concatenate([batch.decisionMargins for batch in batches]),
+            numpy.concatenate([batch.hammingDists for batch in batches]),
+            numpy.concatenate([batch.undistorted for batch in batches]) if all(batch.undistorted is not None for batch in batches) else None
+        )
 
 @dataclass(frozen=True)
 class TagDistResult:
@@ -51,18 +111,18 @@ class SingleTagPoseResult:
     distance: float
     rvecs_0: numpy.typing.NDArray[numpy.float64]
     tvecs_0: numpy.typing.NDArray[numpy.float64]
-    tag_pose_0: Pose3d # Pose of the tag from the camera's coordinate frame
+    tag_pose_0: numpy.typing.NDArray[numpy.float64] # Pose of the tag from the camera's coordinate frame, as a (4,4) transform in WPILib axes (see pipeline.transforms)
     error_0: float
     rvecs_1: numpy.typing.NDArray[numpy.float64]
     tvecs_1: numpy.typing.NDArray[numpy.float64]
-    tag_pose_1: Pose3d
+    tag_pose_1: numpy.typing.NDArray[numpy.float64]
     error_1: float
 
 @dataclass(frozen=True)
 class NTagPoseResult:
-    field_pose_0: Pose3d
+    field_pose_0: numpy.typing.NDArray[numpy.float64] # Pose of the camera on the field, as a (4,4) transform in WPILib axes (see pipeline.transforms)
     error_0: float
-    field_pose_1: Union[Pose3d, None] #The SolvePnP algorithm sometimes can return two poses, but only one is valid. This Union is meant to approximate an optional
+    field_pose_1: Union[numpy.typing.NDArray[numpy.float64], None] #The SolvePnP algorithm sometimes can return two poses, but only one is valid. This Union is meant to approximate an optional
     error_1: Union[float, None]
 
 @dataclass(frozen=True)
@@ -72,6 +132,8 @@ class ObjDetectResult:
     percent_area: float
     corner_angles: numpy.typing.NDArray[numpy.float64] #The euler angles of the bounding box corners relative to the principal axis of the camera, in radians
     corner_pixels: numpy.typing.NDArray[numpy.float64] #the actual pixel locations of the bounding box corners
+    track_id: int = -1 #Persistent ID of the object across frames, -1 if it is not tracked
+    interpolated: bool = False #True if the box was propagated by the tracker rather than freshly detected by the model
 
 @dataclass(frozen=True)
 class ApriltagResult:
@@ -84,5 +146,9 @@ class PipelineResult:
     objDetectResults: Union[List[ObjDetectResult],None]
     frame: Union[cv2.Mat,None]
 
-
-
+@dataclass(frozen=True)
+class SerializedPipelineResult:
+    # A pipeline result that has already been flattened into the networktables array layout, used when the pipeline runs in a separate process
+    apriltagData: Union[numpy.typing.NDArray[numpy.float64],None]
+    objDetectData: Union[numpy.typing.NDArray[numpy.float64],None]
+    frame: Union[cv2.Mat,None]
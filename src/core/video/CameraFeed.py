@@ -0,0 +1,196 @@
+# Copyright (c) FRC 1076 PiHi Samurai
+# You may use, distribute, and modify this software under the terms of
+# the license found in the root directory of this project
+
+import cscore
+import cv2
+import numpy as np
+import threading
+import queue
+import logging
+from time import perf_counter_ns
+from typing import List, Tuple, Union
+from video.CameraHandler import CameraHandler
+from utils.framequeue import LatestSlot
+
+logger = logging.getLogger(__name__)
+
+class SharedFrame:
+    """
+    A decoded frame shared between every subscriber of a camera feed. The image is read-only.
+    The frame is reference counted, its buffer is only reused by the feed once every holder has called release().
+    """
+    def __init__(self, time: int, image: cv2.Mat, feed: "CameraFeed", refs: int):
+        self.time = time # microseconds since FPGA epoch
+        self.image = image
+        self._feed = feed
+        self._refs = refs
+        self._lock = threading.Lock()
+
+    def acquire(self) -> "SharedFrame":
+        with self._lock:
+            self._refs += 1
+        return self
+
+    def release(self) -> None:
+        with self._lock:
+            self._refs -= 1
+            free = self._refs == 0
+        if free:
+            self._feed._recycle(self.image)
+
+class FeedSubscription:
+    """
+    A single consumer's view of a camera feed. Only the newest frame is kept, older unconsumed frames are released automatically.
+    """
+    def __init__(self, feed: "CameraFeed"):
+        self._feed = feed
+        self._slot: LatestSlot[SharedFrame] = LatestSlot(lambda frame: frame.release())
+        self._closed: bool = False
+        self._lock = threading.Lock() # Held while offering a frame, so close() cannot clear the slot between the closed check and the put
+
+    def _offer(self, frame: SharedFrame) -> None:
+        with self._lock:
+            if not self._closed:
+                self._slot.put(frame)
+                return
+        frame.release()
+
+    def grabFrame(self, timeout: float = 0.225) -> Union[SharedFrame,None]:
+        """
+        Waits for the next frame. The caller owns the returned frame and must release() it when done.
+        :param timeout: Maximum time to wait, in seconds
+        :return: The frame, or None if no frame arrived in time
+        """
+        return self._slot.get(timeout)
+
+    def getError(self) -> str:
+        return self._feed.getError()
+
+    def drops(self) -> int:
+        """
+        :return: The number of frames this subscriber never consumed because a newer frame replaced them
+        """
+        return self._slot.drops()
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+        self._feed._unsubscribe(self)
+        self._slot.clear()
+
+class CameraFeed:
+    """
+    Decodes each frame of a camera once, and fans it out to every subscriber
+    """
+    def __init__(self, camera: CameraHandler, grayscale: bool = False):
+        self.name = camera.name
+        self.grayscale = grayscale
+        self._camera = camera
+        self._sink = camera.getSink(self._pixelFormat())
+        self._subscribers: List[FeedSubscription] = []
+        self._lock = threading.Lock()
+        self._freeBuffers: queue.SimpleQueue[cv2.Mat] = queue.SimpleQueue()
+        xres, yres = camera.getResolution()
+        self._frameShape: Tuple[int,int,int] = (yres,xres,1 if grayscale else 3)
+        self._allocations: int = 0
+        self._thread: Union[threading.Thread,None] = None
+        self._lastFrame: int = perf_counter_ns() # perf_counter_ns timestamp of the last frame, or of the last time the capture loop was (re)started
+
+    def _pixelFormat(self) -> cscore.VideoMode.PixelFormat:
+        return cscore.VideoMode.PixelFormat.kGray if self.grayscale else cscore.VideoMode.PixelFormat.kBGR
+
+    def _ensureRunning(self) -> None:
+        """
+        Starts the capture loop if it is not running. Must be called with the lock held
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._lastFrame = perf_counter_ns()
+        self._thread = threading.Thread(target=self._run,name=f"{self.name}_{'gray' if self.grayscale else 'bgr'}_feed",daemon=True)
+        self._thread.start()
+        logger.debug("Started capture loop for camera %s",self.name)
+
+    def subscribe(self) -> FeedSubscription:
+        sub = FeedSubscription(self)
+        with self._lock:
+            self._subscribers.append(sub)
+            self._ensureRunning()
+        return sub
+
+    def getSilence(self) -> float:
+        """
+        :return: Seconds since the feed last delivered a frame, or since its capture loop was last (re)started
+        """
+        return (perf_counter_ns() - self._lastFrame) / 1e9
+
+    def reset(self) -> None:
+        """
+        Replaces the feed's sink with a fresh one, and restarts the capture loop if it died. Subscribers keep their subscriptions
+        """
+        with self._lock:
+            old = self._sink
+            self._sink = self._camera.getSink(self._pixelFormat())
+            self._lastFrame = perf_counter_ns()
+            if len(self._subscribers) > 0:
+                self._ensureRunning()
+        old.setEnabled(False)
+
+    def _unsubscribe(self, sub: FeedSubscription) -> None:
+        with self._lock:
+            if sub in self._subscribers:
+                self._subscribers.remove(sub)
+
+    def subscriberCount(self) -> int:
+        return len(self._subscribers)
+
+    def getError(self) -> str:
+        return self._sink.getError()
+
+    def allocations(self) -> int:
+        """
+        :return: The number of frame buffers allocated because none were free for recycling
+        """
+        return self._allocations
+
+    def _recycle(self, image: cv2.Mat) -> None:
+        self._freeBuffers.put(image)
+
+    def _run(self) -> None:
+        try:
+            self._capture()
+        except Exception:
+            logger.exception("Capture loop for camera %s failed",self.name)
+        finally:
+            # A loop that died lets the next subscribe() or reset() start a new one
+            with self._lock:
+                if self._thread is threading.current_thread():
+                    self._thread = None
+
+    def _capture(self) -> None:
+        while True:
+            with self._lock:
+                if len(self._subscribers) == 0:
+                    # Cleared under the lock, so a subscribe() that comes in while this loop exits starts a new one
+                    self._thread = None
+                    logger.debug("Stopped capture loop for camera %s",self.name)
+                    return
+                subscribers = self._subscribers.copy()
+                sink = self._sink
+            try:
+                image = self._freeBuffers.get_nowait()
+                image.flags.writeable = True
+            except queue.Empty:
+                # Sized from the camera's video mode so grabFrame can decode straight into it
+                image = np.zeros(shape=self._frameShape,dtype=np.uint8)
+                self._allocations += 1
+            time, image = sink.grabFrame(image)
+            if time == 0:
+                self._freeBuffers.put(image)
+                continue
+            self._lastFrame = perf_counter_ns()
+            image.flags.writeable = False
+            # Each subscriber holds one reference, the frame is recycled once all of them have released it
+            frame = SharedFrame(time,image,self,len(subscribers))
+            for sub in subscribers:
+                sub._offer(frame)
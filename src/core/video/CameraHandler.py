@@ -39,8 +39,11 @@ class CameraHandler:
         self._intrinsics = config.intrinsics 
         self._sinkCounter: int = 0
 
-    def getSink(self) -> cscore.CvSink:
-        sink = cscore.CvSink(f"opencv_{self.name}_{self._sinkCounter}")
+    def getSink(self, pixelFormat: cscore.VideoMode.PixelFormat = cscore.VideoMode.PixelFormat.kBGR) -> cscore.CvSink:
+        """
+        :param pixelFormat: Format frames are delivered in, kGray makes cscore convert straight to a single channel image
+        """
+        sink = cscore.CvSink(f"opencv_{self.name}_{self._sinkCounter}",pixelFormat)
         self._sinkCounter += 1
         sink.setSource(self._camera)
         return sink
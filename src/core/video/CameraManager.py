@@ -21,19 +21,22 @@
 # SOFTWARE.
 
 import cscore
-from typing import List,Union
+from typing import List,Union,Tuple
 from configuration.config_types import CameraConfig, CameraIntrinsics
 from video.CameraHandler import CameraHandler
+from video.CameraFeed import CameraFeed, FeedSubscription
 import logging
 
 logger = logging.getLogger(__name__)
 
 _cameras: dict[str,CameraHandler] = {}
-_validCameras: list[int] = [caminfo.dev for caminfo in cscore.UsbCamera.enumerateUsbCameras()]
+_feeds: dict[Tuple[str,bool],CameraFeed] = {}
 
 def loadCameras(cameraList: List[CameraConfig]) -> None:
+    # USB cameras are enumerated here rather than at import, so importing the module stays cheap
+    validCameras: List[int] = [caminfo.dev for caminfo in cscore.UsbCamera.enumerateUsbCameras()]
     for camConfig in cameraList:
-        if camConfig.device_number not in _validCameras:
+        if camConfig.device_number not in validCameras:
             logger.warning("Camera %d does not exist",camConfig.device_number)
             continue
         camera = CameraHandler(camConfig)
@@ -44,4 +47,30 @@ def getCamera(name: str) -> Union[CameraHandler,None]:
     cam = _cameras.get(name)
     if cam is None:
         logger.warning("Camera '%s' not found",name)
-    return cam
\ No newline at end of file
+    return cam
+
+def getFeed(camera: CameraHandler, grayscale: bool = False) -> CameraFeed:
+    """
+    Returns the capture loop for a camera, creating it if needed. There is only ever one feed per camera and pixel format,
+    so each frame is decoded once no matter how many consumers there are.
+    :param grayscale: True for a feed that delivers single channel frames, False for BGR
+    """
+    feed = _feeds.get((camera.name,grayscale))
+    if feed is None:
+        feed = CameraFeed(camera,grayscale)
+        _feeds[(camera.name,grayscale)] = feed
+    return feed
+
+def subscribe(camera: CameraHandler, grayscale: bool = False) -> FeedSubscription:
+    return getFeed(camera,grayscale).subscribe()
+
+def checkFeeds(timeout: float) -> None:
+    """
+    Rebuilds the sink of every feed that has subscribers but has not delivered a frame for longer than the timeout,
+    and restarts its capture loop if it died
+    :param timeout: Seconds a feed may go without a frame
+    """
+    for feed in list(_feeds.values()):
+        if feed.subscriberCount() > 0 and feed.getSilence() > timeout:
+            logger.warning("Camera %s delivered no frames for %.1f s, rebuilding its %s feed",feed.name,feed.getSilence(),"grayscale" if feed.grayscale else "BGR")
+            feed.reset()
@@ -0,0 +1,55 @@
+# Copyright (c) FRC 1076 PiHi Samurai
+# You may use, distribute, and modify this software under the terms of
+# the license found in the root directory of this project
+
+# Measures total object detection throughput of several simulated cameras, each inferring on its own vs. through a shared batched InferenceService.
+# Usage: python man_inference_batching_benchmark.py <model.onnx> [cameras] [window ms] [backend] [inputSize]
+# Export the model with a dynamic batch size for batches to run in one call: yolo export model=<model.pt> format=onnx dynamic=True
+
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__),'../src/core')))
+import threading
+import numpy as np
+from time import perf_counter
+from typing import Callable, List
+from pipeline import backends
+from pipeline.InferenceService import InferenceService
+
+FRAMES_PER_CAMERA = 50
+
+def throughput(infers: List[Callable[[np.ndarray],np.ndarray]], frames: List[np.ndarray]) -> float:
+    """
+    :return: Frames per second inferred by every camera's thread together
+    """
+    for infer, frame in zip(infers,frames):
+        infer(frame) # Warm up
+    def run(index: int):
+        for _ in range(FRAMES_PER_CAMERA):
+            infers[index](frames[index])
+    threads = [threading.Thread(target=run,args=(index,)) for index in range(len(infers))]
+    t0 = perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return len(infers) * FRAMES_PER_CAMERA / (perf_counter() - t0)
+
+if __name__ == "__main__":
+    model = sys.argv[1]
+    cameras = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    window = float(sys.argv[3]) / 1000 if len(sys.argv) > 3 else 0.005
+    backend = sys.argv[4] if len(sys.argv) > 4 else "onnxruntime"
+    inputSize = int(sys.argv[5]) if len(sys.argv) > 5 else 640
+    rng = np.random.default_rng(1076)
+    frames = [rng.integers(0,255,(720,1280,3),dtype=np.uint8) for _ in range(cameras)]
+
+    print(f"{'CAMERAS':>7} | {'SEPARATE':>9} | {'BATCHED':>9} | MEAN BATCH (frames per second)")
+    for count in range(1,cameras + 1):
+        separate = [backends.createBackend(backend,model,inputSize).infer for _ in range(count)]
+        service = InferenceService(backends.createBackend(backend,model,inputSize),window)
+        batched = [lambda frame, client=f"camera{index}": service.infer(frame,client) for index in range(count)]
+        separateFps = throughput(separate,frames[:count])
+        batchedFps = throughput(batched,frames[:count])
+        batches, inferred = service.getStats()
+        print(f"{count:>7} | {separateFps: 9.1f} | {batchedFps: 9.1f} | {inferred / batches:.2f}")
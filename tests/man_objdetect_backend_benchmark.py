@@ -0,0 +1,78 @@
+# Copyright (c) FRC 1076 PiHi Samurai
+# You may use, distribute, and modify this software under the terms of
+# the license found in the root directory of this project
+
+# Compares the object detection inference backends side by side on recorded frames.
+# Reports inference latency, and how closely each backend's detections match the ultralytics backend's.
+# Usage: python man_objdetect_backend_benchmark.py <model.pt> <model.onnx> <image directory or video file> [inputSize]
+# Export the ONNX model with: yolo export model=<model.pt> format=onnx imgsz=<inputSize>
+
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__),'../src/core')))
+import cv2
+import numpy as np
+from time import perf_counter_ns
+from typing import Dict, List
+from pipeline import backends
+
+def loadFrames(path: str) -> List[np.ndarray]:
+    frames: List[np.ndarray] = []
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            image = cv2.imread(os.path.join(path,name))
+            if image is not None:
+                frames.append(image)
+    else:
+        capture = cv2.VideoCapture(path)
+        while True:
+            ok, image = capture.read()
+            if not ok:
+                break
+            frames.append(image)
+    return frames
+
+def matchRate(detections: np.ndarray, reference: np.ndarray, minIou: float = 0.5) -> float:
+    """
+    :return: Fraction of the reference detections with a detection of the same class overlapping it by at least minIou
+    """
+    if len(reference) == 0:
+        return 1.0
+    matched = 0
+    for box in reference:
+        same = detections[detections[:,5] == box[5]]
+        width = np.minimum(box[2],same[:,2]) - np.maximum(box[0],same[:,0])
+        height = np.minimum(box[3],same[:,3]) - np.maximum(box[1],same[:,1])
+        intersection = np.maximum(width,0.0) * np.maximum(height,0.0)
+        union = (box[2] - box[0]) * (box[3] - box[1]) + (same[:,2] - same[:,0]) * (same[:,3] - same[:,1]) - intersection
+        if len(same) > 0 and (intersection / union).max() >= minIou:
+            matched += 1
+    return matched / len(reference)
+
+if __name__ == "__main__":
+    ptModel, onnxModel = sys.argv[1], sys.argv[2]
+    frames = loadFrames(sys.argv[3])
+    inputSize = int(sys.argv[4]) if len(sys.argv) > 4 else 640
+    print(f"Loaded {len(frames)} frames")
+
+    results: Dict[str,List[np.ndarray]] = {}
+    print(f"{'BACKEND':>11} |    AVG    |    P95    | DETECTIONS | MATCHED")
+    for name in backends.BACKENDS:
+        try:
+            backend = backends.createBackend(name,ptModel if name == "ultralytics" else onnxModel,inputSize)
+        except Exception as e:
+            print(f"{name:>11} | unavailable ({type(e).__name__}: {e})")
+            continue
+        for frame in frames[:5]:
+            backend.infer(frame) # Warm up
+        times: List[float] = []
+        detections: List[np.ndarray] = []
+        for frame in frames:
+            t0 = perf_counter_ns()
+            detections.append(backend.infer(frame))
+            times.append((perf_counter_ns() - t0) / 1e6)
+        results[name] = detections
+        reference = results.get("ultralytics")
+        matched = f"{np.mean([matchRate(ours,theirs) for ours, theirs in zip(detections,reference)]) * 100:.1f}%" if reference is not None else "-"
+        count = np.mean([len(frameDetections) for frameDetections in detections])
+        print(f"{name:>11} | {np.mean(times): 9.3f} | {np.percentile(times,95): 9.3f} | {count:10.2f} | {matched}")
@@ -0,0 +1,93 @@
+# Copyright (c) FRC 1076 PiHi Samurai
+# You may use, distribute, and modify this software under the terms of
+# the license found in the root directory of this project
+
+# Checks the object tracker on synthetic moving boxes, then compares the publish rate of synchronous and async object detection pipelines.
+# Usage: python man_objdetect_tracking_benchmark.py [model.onnx] [backend] [inputSize]
+
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__),'../src/core')))
+import numpy as np
+from time import perf_counter, sleep
+from configuration.config_types import CameraIntrinsics
+from pipeline.ObjectDetector import ObjectDetector
+from pipeline.ObjectTracker import ObjectTracker
+from pipeline.Pipeline import ObjDetectPipeline
+from pipeline import Annotator, Pipeline
+
+CAMERA_FPS = 60
+FRAMES = 600
+RESOLUTION = (1280,720)
+
+def trackSynthetic(inferenceFrames: int, objects: int = 5) -> tuple:
+    """
+    Moves boxes across the frame at constant velocity, detecting them with noise every inferenceFrames frames
+    and tracking them on every frame in between
+    :return: Mean and maximum corner error in pixels of the tracked boxes, and the number of track ID changes
+    """
+    rng = np.random.default_rng(1076)
+    starts = rng.uniform((100,100),(1000,500),size=(objects,2))
+    velocities = rng.uniform(-200,200,size=(objects,2)) # Pixels per second
+    sizes = rng.uniform(40,120,size=(objects,2))
+    tracker = ObjectTracker()
+    errors = []
+    idChanges = 0
+    lastIds = {}
+    for frame in range(FRAMES):
+        time = frame / CAMERA_FPS
+        centers = starts + velocities * time
+        truth = np.concatenate((centers - sizes / 2,centers + sizes / 2,np.full((objects,1),0.9),np.zeros((objects,1))),axis=1)
+        if frame % inferenceFrames == 0:
+            detections = truth.copy()
+            detections[:,:4] += rng.normal(scale=1.0,size=(objects,4))
+            tracker.update(detections,time)
+        boxes, ids, _ = tracker.predict(time)
+        # Match each true box to the closest tracked box
+        for index in range(objects):
+            distances = np.abs(boxes[:,:4] - truth[index,:4]).max(axis=1)
+            closest = int(distances.argmin())
+            errors.append(distances[closest])
+            if index in lastIds and lastIds[index] != ids[closest]:
+                idChanges += 1
+            lastIds[index] = ids[closest]
+    return float(np.mean(errors)), float(np.max(errors)), idChanges
+
+def publishRate(pipeline: ObjDetectPipeline, frames: list, seconds: float = 5.0) -> tuple:
+    """
+    Feeds frames to a pipeline as fast as it accepts them
+    :return: Results per second, and the fraction of published boxes that were interpolated
+    """
+    published, interpolated = 0, 0
+    count = 0
+    t0 = perf_counter()
+    while perf_counter() - t0 < seconds:
+        results = pipeline.process(frames[count % len(frames)]).objDetectResults
+        published += len(results)
+        interpolated += sum(result.interpolated for result in results)
+        count += 1
+    return count / (perf_counter() - t0), interpolated / published if published > 0 else 0.0
+
+if __name__ == "__main__":
+    print(f"{'INFERENCE EVERY':>15} | {'MEAN ERROR':>10} | {'MAX ERROR':>10} | ID CHANGES (pixels)")
+    for inferenceFrames in (1,2,4,8):
+        mean, worst, idChanges = trackSynthetic(inferenceFrames)
+        print(f"{inferenceFrames:>15} | {mean: 10.2f} | {worst: 10.2f} | {idChanges}")
+
+    if len(sys.argv) > 1:
+        model = sys.argv[1]
+        backend = sys.argv[2] if len(sys.argv) > 2 else "onnxruntime"
+        inputSize = int(sys.argv[3]) if len(sys.argv) > 3 else 640
+        intrinsics = CameraIntrinsics(
+            np.array([[979.1,0,608.6],[0,979.8,353.0],[0,0,1.0]]),
+            np.array([0.0958,-0.2604,0.00358,-0.00513,0.191])
+        )
+        rng = np.random.default_rng(1076)
+        frames = [rng.integers(0,255,(RESOLUTION[1],RESOLUTION[0],3),dtype=np.uint8) for _ in range(10)]
+        print(f"{'MODE':>5} | {'RESULTS/S':>9} | INTERPOLATED")
+        for asyncInference in (False,True):
+            detector = ObjectDetector(model,intrinsics,backend=backend,inputSize=inputSize)
+            pipeline = ObjDetectPipeline(detector,False,False,Annotator.Annotator(intrinsics),ObjectTracker(),asyncInference)
+            rate, fraction = publishRate(pipeline,frames)
+            print(f"{'async' if asyncInference else 'sync':>5} | {rate: 9.1f} | {fraction * 100:.1f}%")
+        sleep(Pipeline._INFER_IDLE_TIMEOUT + 0.5) # Lets the inference thread exit before the interpreter does
@@ -0,0 +1,119 @@
+# Copyright (c) FRC 1076 PiHi Samurai
+# You may use, distribute, and modify this software under the terms of
+# the license found in the root directory of this project
+
+# Compares quantized versions of an ONNX object detection model against the original on a labeled image set.
+# Reports inference latency, mAP against the labels, and mAP against the original model's detections (how much quantization changed the output).
+# Usage: python man_quantization_evaluation.py <model.onnx> <calibration frame directory> <labeled directory> [inputSize] [backend]
+# The labeled directory uses the YOLO dataset layout: images/<name>.<ext>, and labels/<name>.txt with one "class x_center y_center width height" line per object,
+# normalized to the image size. Frames the quantized models are calibrated on should not be part of the labeled set.
+
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__),'../src/core')))
+import cv2
+import numpy as np
+from time import perf_counter_ns
+from typing import List, Tuple
+from pipeline import backends, quantize
+from pipeline.ObjectTracker import iou
+
+def loadLabeled(directory: str) -> Tuple[List[np.ndarray],List[np.ndarray]]:
+    """
+    :return: Every labeled image, and its (M,6) ground truth boxes as left, top, right, bottom, confidence (always 1), class
+    """
+    images: List[np.ndarray] = []
+    truths: List[np.ndarray] = []
+    for name in sorted(os.listdir(os.path.join(directory,"images"))):
+        image = cv2.imread(os.path.join(directory,"images",name))
+        if image is None:
+            continue
+        labelPath = os.path.join(directory,"labels",os.path.splitext(name)[0] + ".txt")
+        # Empty label files (images without objects) load as an empty array of the wrong shape
+        labels = np.loadtxt(labelPath,ndmin=2).reshape((-1,5)) if os.path.isfile(labelPath) else np.empty((0,5))
+        height, width = image.shape[:2]
+        boxes = np.empty((len(labels),6))
+        boxes[:,0] = (labels[:,1] - labels[:,3] / 2) * width
+        boxes[:,1] = (labels[:,2] - labels[:,4] / 2) * height
+        boxes[:,2] = (labels[:,1] + labels[:,3] / 2) * width
+        boxes[:,3] = (labels[:,2] + labels[:,4] / 2) * height
+        boxes[:,4] = 1.0
+        boxes[:,5] = labels[:,0]
+        images.append(image)
+        truths.append(boxes)
+    return images, truths
+
+def meanAveragePrecision(detections: List[np.ndarray], truths: List[np.ndarray], minIou: float) -> float:
+    """
+    All-point interpolated average precision, averaged over every class that has ground truth boxes
+    :param detections: (N,6) detections of each image, see InferenceBackend.infer
+    :param truths: (M,6) ground truth boxes of each image, in the same layout
+    """
+    precisions: List[float] = []
+    for obj_class in np.unique(np.concatenate([truth[:,5] for truth in truths])):
+        scores: List[float] = []
+        hits: List[bool] = []
+        total = 0
+        for frameDetections, truth in zip(detections,truths):
+            candidates = frameDetections[frameDetections[:,5] == obj_class]
+            candidates = candidates[np.argsort(candidates[:,4])[::-1]]
+            targets = truth[truth[:,5] == obj_class]
+            total += len(targets)
+            overlaps = iou(candidates[:,:4],targets[:,:4]) if len(targets) > 0 else np.zeros((len(candidates),0))
+            matched = np.zeros(len(targets),dtype=bool)
+            for index in range(len(candidates)):
+                # Each ground truth box can only be matched by its most confident detection
+                available = np.where(matched,-1.0,overlaps[index])
+                best = int(available.argmax()) if len(targets) > 0 else -1
+                hit = best >= 0 and available[best] >= minIou
+                if hit:
+                    matched[best] = True
+                scores.append(candidates[index,4])
+                hits.append(hit)
+        order = np.argsort(scores)[::-1]
+        truePositives = np.cumsum(np.array(hits,dtype=bool)[order])
+        recall = truePositives / total
+        precision = truePositives / np.arange(1,len(order) + 1)
+        # Area under the precision envelope
+        recall = np.concatenate(([0.0],recall))
+        precision = np.concatenate(([1.0],np.maximum.accumulate(precision[::-1])[::-1]))
+        precisions.append(float(np.sum((recall[1:] - recall[:-1]) * precision[1:])))
+    return float(np.mean(precisions)) if len(precisions) > 0 else 0.0
+
+def mapRange(detections: List[np.ndarray], truths: List[np.ndarray]) -> Tuple[float,float]:
+    """
+    :return: mAP at 0.5 IoU, and mAP averaged over 0.5 to 0.95 IoU
+    """
+    thresholds = np.linspace(0.5,0.95,10)
+    values = [meanAveragePrecision(detections,truths,threshold) for threshold in thresholds]
+    return values[0], float(np.mean(values))
+
+if __name__ == "__main__":
+    model, calibration, labeled = sys.argv[1], sys.argv[2], sys.argv[3]
+    inputSize = int(sys.argv[4]) if len(sys.argv) > 4 else 640
+    backend = sys.argv[5] if len(sys.argv) > 5 else "onnxruntime"
+    images, truths = loadLabeled(labeled)
+    print(f"Loaded {len(images)} labeled images with {sum(len(truth) for truth in truths)} objects")
+
+    reference: List[np.ndarray] = []
+    print(f"{'QUANTIZATION':>12} | {'AVG':>7} | {'P95':>7} | {'mAP50':>6} | {'mAP50-95':>8} | {'AGREEMENT mAP50':>15} (milliseconds)")
+    for quantization in quantize.QUANTIZATIONS:
+        try:
+            path = quantize.getQuantizedModel(model,quantization,calibration,inputSize)
+            detector = backends.createBackend(backend,path,inputSize)
+        except Exception as e:
+            print(f"{quantization:>12} | unavailable ({type(e).__name__}: {e})")
+            continue
+        for image in images[:5]:
+            detector.infer(image) # Warm up
+        times: List[float] = []
+        detections: List[np.ndarray] = []
+        for image in images:
+            t0 = perf_counter_ns()
+            detections.append(detector.infer(image))
+            times.append((perf_counter_ns() - t0) / 1e6)
+        if quantization == "none":
+            reference = detections
+        map50, map5095 = mapRange(detections,truths)
+        agreement = meanAveragePrecision(detections,reference,0.5) if len(reference) > 0 else float("nan")
+        print(f"{quantization:>12} | {np.mean(times): 7.2f} | {np.percentile(times,95): 7.2f} | {map50: 6.3f} | {map5095: 8.3f} | {agreement: 15.3f}")
@@ -0,0 +1,93 @@
+# Copyright (c) FRC 1076 PiHi Samurai
+# You may use, distribute, and modify this software under the terms of
+# the license found in the root directory of this project
+
+# Runs the load scheduler against simulated pipelines on a simulated clock, and checks that it only throttles pipelines when the CPU is actually oversubscribed.
+# Each pipeline is a single worker that takes the newest frame from its camera when idle, and shares the cores evenly with the other busy pipelines.
+# Usage: python man_scheduler_simulation.py
+
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__),'../src/core')))
+from typing import Dict, List, Tuple
+from configuration.config_types import SchedulerConfig
+from pipeline import LoadScheduler
+
+SECONDS = 20
+TICK_MS = 0.5
+
+class SimulatedPipeline:
+    def __init__(self, name: str, priority: int, targetFps: float, cost: float):
+        self.name = name
+        self.priority = priority
+        self.targetFps = targetFps
+        self.cost = cost # Milliseconds of CPU time per frame
+        self.pending: bool = False
+        self.drops: int = 0
+        self.seenDrops: int = 0
+        self.work: float = 0.0 # Remaining CPU time of the frame being processed
+        self.start: float = 0.0
+        self.processed: int = 0
+
+def simulate(cores: int, cameraFps: float, pipelines: List[SimulatedPipeline]) -> Tuple[Dict[str,tuple],float]:
+    """
+    :return: The scheduler state and processed frame count of each pipeline at the end, and the scheduler's final capacity scale
+    """
+    now = [0.0] # Milliseconds
+    LoadScheduler.perf_counter_ns = lambda: int(now[0] * 1e6)
+    scheduler = LoadScheduler.LoadScheduler(SchedulerConfig(True,cores,0.9,0.5,0.2))
+    for pipeline in pipelines:
+        scheduler.register(pipeline.name,pipeline.priority,pipeline.targetFps)
+    nextFrame = 0.0
+    while now[0] < SECONDS * 1000:
+        if now[0] >= nextFrame:
+            nextFrame += 1000 / cameraFps
+            for pipeline in pipelines:
+                if pipeline.pending:
+                    pipeline.drops += 1 # Replaced before the worker got to it
+                pipeline.pending = True
+        for pipeline in pipelines:
+            if pipeline.work <= 0.0 and pipeline.pending:
+                pipeline.pending = False
+                missed = pipeline.drops - pipeline.seenDrops
+                pipeline.seenDrops = pipeline.drops
+                if scheduler.admit(pipeline.name,missed):
+                    pipeline.work = pipeline.cost
+                    pipeline.start = now[0]
+        busy = [pipeline for pipeline in pipelines if pipeline.work > 0.0]
+        share = min(1.0,cores / len(busy)) if len(busy) > 0 else 0.0
+        now[0] += TICK_MS
+        for pipeline in busy:
+            pipeline.work -= TICK_MS * share
+            if pipeline.work <= 0.0:
+                pipeline.processed += 1
+                scheduler.report(pipeline.name,int((now[0] - pipeline.start) * 1e6))
+    return {pipeline.name: scheduler.getState(pipeline.name) + (pipeline.processed,) for pipeline in pipelines}, scheduler._scale
+
+def printResults(title: str, results: Dict[str,tuple], scale: float) -> None:
+    print(f"{title} (capacity scale {scale:.2f})")
+    print(f"{'PIPELINE':>10} | {'ALLOWED':>7} | {'ACHIEVED':>8} | {'COST':>6} | {'SKIPPED':>7} | PROCESSED")
+    for name, (allowed, achieved, cost, skipped, processed) in results.items():
+        print(f"{name:>10} | {allowed: 7.1f} | {achieved: 8.1f} | {cost: 6.1f} | {skipped:>7} | {processed}")
+
+def check(description: str, passed: bool) -> bool:
+    print(f"{'PASS' if passed else 'FAIL'}: {description}")
+    return passed
+
+if __name__ == "__main__":
+    passed = True
+
+    # The target is above what the camera delivers, with plenty of idle CPU. Nothing should be throttled
+    results, scale = simulate(4,30,[SimulatedPipeline("apriltag",2,60,5),SimulatedPipeline("objdetect",1,60,100)])
+    printResults("Camera slower than the target, 4 cores",results,scale)
+    passed &= check("capacity is not shrunk",scale >= 0.99)
+    passed &= check("apriltag runs at the camera's rate",results["apriltag"][1] >= 0.9 * 30)
+    passed &= check("objdetect runs as fast as one worker can",results["objdetect"][1] >= 0.9 * 10)
+
+    # One core cannot fit both pipelines, the lower priority one gives way
+    results, scale = simulate(1,30,[SimulatedPipeline("apriltag",2,30,20),SimulatedPipeline("objdetect",1,30,100)])
+    printResults("Oversubscribed, 1 core",results,scale)
+    passed &= check("apriltag keeps most of its rate",results["apriltag"][1] >= 0.8 * 30)
+    passed &= check("objdetect is throttled",results["objdetect"][3] > 0)
+
+    sys.exit(0 if passed else 1)
@@ -0,0 +1,91 @@
+# Copyright (c) FRC 1076 PiHi Samurai
+# You may use, distribute, and modify this software under the terms of
+# the license found in the root directory of this project
+
+# Compares the general PnP solver with and without temporal mode on a recorded sequence.
+# Reports solve time, and how often the primary pose jumps between frames (usually the IPPE ambiguity flipping on single tag frames).
+# Usage: python man_temporal_pnp_benchmark.py <image directory or video file> <fx> <fy> <cx> <cy> [k1 k2 p1 p2 k3] [--layout name] [--tagsize meters]
+
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__),'../src/core')))
+import cv2
+import numpy as np
+import robotpy_apriltag as apriltag
+from time import perf_counter_ns
+from typing import List
+from configuration import Field
+from configuration.config_types import CameraIntrinsics
+from pipeline.ApriltagDetector import ApriltagDetector
+from pipeline.pnpsolvers import GeneralPnPSolver
+from utils.vtypes import FiducialBatch
+
+JUMP_THRESHOLD = 0.5 # meters between consecutive frames' primary poses counted as a jump
+
+def loadFrames(path: str) -> List[np.ndarray]:
+    frames: List[np.ndarray] = []
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            image = cv2.imread(os.path.join(path,name),cv2.IMREAD_GRAYSCALE)
+            if image is not None:
+                frames.append(image)
+    else:
+        capture = cv2.VideoCapture(path)
+        while True:
+            ok, image = capture.read()
+            if not ok:
+                break
+            frames.append(cv2.cvtColor(image,cv2.COLOR_BGR2GRAY))
+    return frames
+
+def benchmark(solver: GeneralPnPSolver, sequence: List[FiducialBatch], repeats: int = 5):
+    times: List[float] = []
+    jumps = 0
+    for _ in range(repeats):
+        previous = None
+        for fiducials in sequence:
+            t0 = perf_counter_ns()
+            result = solver.solve(fiducials)
+            times.append((perf_counter_ns() - t0) / 1e6)
+            if result is None:
+                previous = None
+                continue
+            translation = result.field_pose_0[:3,3]
+            if previous is not None and np.linalg.norm(translation - previous) > JUMP_THRESHOLD:
+                jumps += 1
+            previous = translation
+    return np.array(times), jumps // repeats
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    layout = "2025-reefscape-welded"
+    tagSize = 0.1651
+    if "--layout" in args:
+        index = args.index("--layout")
+        layout = args[index + 1]
+        del args[index:index + 2]
+    if "--tagsize" in args:
+        index = args.index("--tagsize")
+        tagSize = float(args[index + 1])
+        del args[index:index + 2]
+    fx, fy, cx, cy = (float(arg) for arg in args[1:5])
+    intrinsics = CameraIntrinsics(
+        np.array([[fx,0,cx],[0,fy,cy],[0,0,1.0]]),
+        np.array([float(arg) for arg in args[5:]] or [0.0] * 5)
+    )
+    Field.setFamily("tag36h11")
+    Field.setLayout(apriltag.AprilTagFieldLayout(os.path.join(os.path.dirname(__file__),"../resources/fields",layout + ".json")))
+    Field.setTagSize(tagSize)
+
+    detector = ApriltagDetector()
+    detector.addFamily(Field.getFamily())
+    sequence = [detector.detect(frame) for frame in loadFrames(args[0])]
+    counts = np.array([len(fiducials) for fiducials in sequence])
+    print(f"Loaded {len(sequence)} frames, {np.count_nonzero(counts == 1)} with a single tag, {np.count_nonzero(counts > 1)} with several")
+
+    print(f"{'':>8} |    AVG    |    P95    | JUMPS")
+    for temporal in (False,True):
+        solver = GeneralPnPSolver(intrinsics,[])
+        solver.setTemporal(temporal)
+        times, jumps = benchmark(solver,sequence)
+        print(f"{'temporal' if temporal else 'full':>8} | {times.mean(): 9.3f} | {np.percentile(times,95): 9.3f} | {jumps}")
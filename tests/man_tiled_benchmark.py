@@ -0,0 +1,65 @@
+# Copyright (c) FRC 1076 PiHi Samurai
+# You may use, distribute, and modify this software under the terms of
+# the license found in the root directory of this project
+
+# Compares the tiled apriltag detector against the single-call detector on the same frames.
+# Usage: python man_tiled_benchmark.py <image directory or video file> [columns] [rows] [overlap] [numThreads]
+
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__),'../src/core')))
+import cv2
+import numpy as np
+from time import perf_counter_ns
+from typing import List
+from pipeline.ApriltagDetector import ApriltagDetector, TiledApriltagDetector
+
+def loadFrames(path: str) -> List[np.ndarray]:
+    frames: List[np.ndarray] = []
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            image = cv2.imread(os.path.join(path,name),cv2.IMREAD_GRAYSCALE)
+            if image is not None:
+                frames.append(image)
+    else:
+        capture = cv2.VideoCapture(path)
+        while True:
+            ok, image = capture.read()
+            if not ok:
+                break
+            frames.append(cv2.cvtColor(image,cv2.COLOR_BGR2GRAY))
+    return frames
+
+def benchmark(detector: ApriltagDetector, frames: List[np.ndarray], repeats: int = 3):
+    times: List[float] = []
+    counts: List[int] = []
+    for _ in range(repeats):
+        for frame in frames:
+            t0 = perf_counter_ns()
+            fiducials = detector.detect(frame)
+            times.append((perf_counter_ns() - t0) / 1e6)
+            counts.append(len(fiducials))
+    return np.array(times), np.array(counts)
+
+if __name__ == "__main__":
+    frames = loadFrames(sys.argv[1])
+    columns = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    rows = int(sys.argv[3]) if len(sys.argv) > 3 else 2
+    overlap = int(sys.argv[4]) if len(sys.argv) > 4 else 128
+    numThreads = int(sys.argv[5]) if len(sys.argv) > 5 else 1
+    print(f"Loaded {len(frames)} frames of {frames[0].shape[1]}x{frames[0].shape[0]}")
+
+    single = ApriltagDetector()
+    tiled = TiledApriltagDetector(columns,rows,overlap)
+    for detector in (single,tiled):
+        detector.addFamily("tag36h11")
+        config = detector.getConfig()
+        config.numThreads = numThreads
+        detector.setConfig(config)
+
+    singleTimes, singleCounts = benchmark(single,frames)
+    tiledTimes, tiledCounts = benchmark(tiled,frames)
+    print(f"{'':>8} |    AVG    |    P95    |    MAX    | TAGS")
+    print(f"{'single':>8} | {singleTimes.mean(): 9.3f} | {np.percentile(singleTimes,95): 9.3f} | {singleTimes.max(): 9.3f} | {singleCounts.sum()}")
+    print(f"{'tiled':>8} | {tiledTimes.mean(): 9.3f} | {np.percentile(tiledTimes,95): 9.3f} | {tiledTimes.max(): 9.3f} | {tiledCounts.sum()}")
+    print(f"Speedup: {singleTimes.mean() / tiledTimes.mean():.2f}x, frames with a different tag count: {np.count_nonzero(singleCounts != tiledCounts)}")
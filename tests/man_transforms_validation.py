@@ -0,0 +1,66 @@
+# Copyright (c) FRC 1076 PiHi Samurai
+# You may use, distribute, and modify this software under the terms of
+# the license found in the root directory of this project
+
+# Checks pipeline.transforms against the wpimath based conversions it replaces on random poses, and times both.
+# Usage: python man_transforms_validation.py [numPoses]
+
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__),'../src/core')))
+import numpy as np
+from time import perf_counter_ns
+from wpimath.geometry import Pose3d
+from pipeline import transforms
+from pipeline.coords import openCvPoseToWpilib
+
+def timeUs(fn, repeats: int = 500) -> float:
+    t0 = perf_counter_ns()
+    for _ in range(repeats):
+        fn()
+    return (perf_counter_ns() - t0) / repeats / 1e3
+
+def poseArray(pose: Pose3d) -> np.ndarray:
+    q = pose.rotation().getQuaternion()
+    return np.array([pose.X(),pose.Y(),pose.Z(),q.W(),q.X(),q.Y(),q.Z()])
+
+def maxDifference(a: np.ndarray, b: np.ndarray) -> float:
+    # Quaternions q and -q are the same rotation
+    quaternion = np.minimum(np.abs(a[:,3:] - b[:,3:]).max(axis=1),np.abs(a[:,3:] + b[:,3:]).max(axis=1))
+    return float(max(np.abs(a[:,:3] - b[:,:3]).max(),quaternion.max()))
+
+if __name__ == "__main__":
+    numPoses = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    rng = np.random.default_rng(1076)
+    rvecs = rng.normal(size=(numPoses,3,1)) * 1.5 # Shaped like OpenCV output
+    rvecs[:10] *= 1e-9 # Near identity rotations
+    tvecs = rng.uniform(-5,5,size=(numPoses,3,1))
+
+    reference = [openCvPoseToWpilib(tvecs[i],rvecs[i]) for i in range(numPoses)]
+    T = transforms.openCvToWpilib(transforms.fromRvecTvec(rvecs,tvecs))
+    referenceArray = np.array([poseArray(pose) for pose in reference])
+    print(f"fromRvecTvec + openCvToWpilib:  {maxDifference(transforms.toTranslationQuaternions(T),referenceArray):.2e}")
+
+    inverses = np.array([poseArray(Pose3d() + (Pose3d() - pose)) for pose in reference])
+    print(f"invert:                         {maxDifference(transforms.toTranslationQuaternions(transforms.invert(T)),inverses):.2e}")
+
+    composed = np.array([poseArray(reference[i].transformBy(reference[i - 1] - Pose3d())) for i in range(numPoses)])
+    print(f"compose:                        {maxDifference(transforms.toTranslationQuaternions(T @ np.roll(T,1,axis=0)),composed):.2e}")
+
+    roundTrip = np.array([poseArray(transforms.toPose3d(transforms.fromPose3d(pose))) for pose in reference])
+    print(f"fromPose3d/toPose3d round trip: {maxDifference(roundTrip,referenceArray):.2e}")
+
+    angles = np.array([min(pose.rotation().angle,2 * np.pi - pose.rotation().angle) for pose in reference])
+    print(f"rotationAngles:                 {np.abs(transforms.rotationAngles(T) - angles).max():.2e}")
+
+    print(f"{'POSES':>5} | {'WPIMATH':>9} | {'NUMPY':>9} | SPEEDUP (microseconds, convert + invert + serialize)")
+    for n in (1,2,4,8,16):
+        def wpimathPath():
+            for i in range(n):
+                pose = openCvPoseToWpilib(tvecs[i],rvecs[i])
+                poseArray(Pose3d() + (Pose3d() - pose))
+        def numpyPath():
+            transforms.toTranslationQuaternions(transforms.invert(transforms.openCvToWpilib(transforms.fromRvecTvec(rvecs[:n],tvecs[:n]))))
+        old = timeUs(wpimathPath)
+        new = timeUs(numpyPath)
+        print(f"{n:>5} | {old: 9.1f} | {new: 9.1f} | {old / new:.2f}x")
@@ -0,0 +1,82 @@
+# Copyright (c) FRC 1076 PiHi Samurai
+# You may use, distribute, and modify this software under the terms of
+# the license found in the root directory of this project
+
+# Checks the undistortion lookup table against OpenCV on random points, and times undistortion and the apriltag solvers with and without it.
+# Usage: python man_undistort_validation.py [step]
+
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__),'../src/core')))
+import cv2
+import numpy as np
+import robotpy_apriltag as apriltag
+from time import perf_counter_ns
+from configuration import Field
+from configuration.config_types import CameraIntrinsics
+from pipeline import pnpsolvers
+from pipeline.Undistorter import Undistorter
+from utils.vtypes import FiducialBatch
+
+RESOLUTION = (1280,720)
+
+def timeUs(fn, repeats: int = 500) -> float:
+    t0 = perf_counter_ns()
+    for _ in range(repeats):
+        fn()
+    return (perf_counter_ns() - t0) / repeats / 1e3
+
+def randomBatch(rng: np.random.Generator, n: int, intrinsics: CameraIntrinsics) -> FiducialBatch:
+    corners = np.empty((n,4,2))
+    for i in range(n):
+        rvec = rng.normal(size=3) * 0.3
+        tvec = np.array([rng.uniform(-0.8,0.8),rng.uniform(-0.4,0.4),rng.uniform(1,4)])
+        projected, _ = cv2.projectPoints(Field.getTagCorners(),rvec,tvec,intrinsics.matrix,intrinsics.dist_coeffs)
+        corners[i] = projected.reshape((4,2))
+    return FiducialBatch(np.arange(17,17 + n,dtype=np.int32),corners,np.full(n,50.0),np.zeros(n,dtype=np.int32))
+
+if __name__ == "__main__":
+    step = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    Field.setFamily("tag36h11")
+    Field.setLayout(apriltag.AprilTagFieldLayout(os.path.join(os.path.dirname(__file__),"../resources/fields/2025-reefscape-welded.json")))
+    Field.setTagSize(0.1651)
+    intrinsics = CameraIntrinsics(
+        np.array([[979.1,0,608.6],[0,979.8,353.0],[0,0,1.0]]),
+        np.array([0.0958,-0.2604,0.00358,-0.00513,0.191])
+    )
+    t0 = perf_counter_ns()
+    undistorter = Undistorter(intrinsics,RESOLUTION,step)
+    print(f"Built a {step} pixel lookup table in {(perf_counter_ns() - t0) / 1e6:.1f} ms")
+
+    rng = np.random.default_rng(1076)
+    points = rng.uniform((0,0),(RESOLUTION[0] - 1,RESOLUTION[1] - 1),size=(10000,2))
+    # Run OpenCV's iterative undistortion to convergence as the reference
+    reference = cv2.undistortPoints(points.reshape((-1,1,2)),intrinsics.matrix,intrinsics.dist_coeffs,None,intrinsics.matrix).reshape((-1,2))
+    if hasattr(cv2,"undistortImagePoints"):
+        reference = cv2.undistortImagePoints(points.reshape((-1,1,2)),intrinsics.matrix,intrinsics.dist_coeffs,arg1=(cv2.TERM_CRITERIA_COUNT | cv2.TERM_CRITERIA_EPS,200,1e-14)).reshape((-1,2))
+    print(f"Max difference from OpenCV: {np.abs(undistorter.undistortPixels(points) - reference).max():.2e} px")
+
+    print(f"{'POINTS':>6} | {'OPENCV':>9} | {'TABLE':>9} (microseconds)")
+    for n in (4,16,64,256):
+        subset = points[:n]
+        opencv = timeUs(lambda: cv2.undistortPoints(subset.reshape((-1,1,2)),intrinsics.matrix,intrinsics.dist_coeffs,None,intrinsics.matrix))
+        table = timeUs(lambda: undistorter.undistortPixels(subset))
+        print(f"{n:>6} | {opencv: 9.1f} | {table: 9.1f}")
+
+    solver = pnpsolvers.GeneralPnPSolver(intrinsics,[])
+    fidSolver = pnpsolvers.FiducialPnPSolver(intrinsics)
+    context = pnpsolvers.SolveContext()
+    def solveFrame(fiducials: FiducialBatch, useTable: bool):
+        context.reset()
+        if useTable:
+            fiducials = undistorter.undistortFiducials(fiducials)
+        fidSolver.solveBatch(fiducials,context)
+        return solver.solve(fiducials,context)
+
+    print(f"{'TAGS':>6} | {'OPENCV':>9} | {'TABLE':>9} | POSE DIFFERENCE (microseconds per frame, meters)")
+    for n in (1,2,4,8):
+        fiducials = randomBatch(rng,n,intrinsics)
+        opencv = timeUs(lambda: solveFrame(fiducials,False))
+        table = timeUs(lambda: solveFrame(fiducials,True))
+        difference = np.abs(solveFrame(fiducials,False).field_pose_0[:3,3] - solveFrame(fiducials,True).field_pose_0[:3,3]).max()
+        print(f"{n:>6} | {opencv: 9.1f} | {table: 9.1f} | {difference:.1e}")